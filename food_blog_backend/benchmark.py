@@ -0,0 +1,227 @@
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from food_blog import (BitmapIndex, BulkImporter, QuantityTable, RecipeRepository, RecipesTable, ServeTable,
+                       TableExecutor, get_exactly_expr, get_like_expr, get_recipe_by_meal_and_ingredient,
+                       search_recipes)
+
+
+SYLLABLES = ('ba', 'ca', 'da', 'la', 'ma', 'na', 'ra', 'sa', 'ta', 'be', 'ke', 'le', 'me', 'pe', 're', 'te',
+             'bi', 'ki', 'li', 'mi', 'ni', 'ri', 'si', 'ti', 'bo', 'co', 'lo', 'mo', 'no', 'ro', 'to', 'nu')
+VERBS = ('mix', 'blend', 'bake', 'boil', 'fry', 'chop', 'whisk', 'stir', 'serve', 'chill', 'roast', 'grill')
+
+
+def make_words(rng: random.Random, n: int) -> List[str]:
+    """
+    Make up distinct words of two to four syllables
+
+    :param rng: source of random numbers
+    :param n: number of words
+    """
+
+    words = dict.fromkeys(TableExecutor.default_data['ingredients'])
+    while len(words) < n:
+        words[''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))] = None
+    return list(words)[:n]
+
+
+def make_records(n: int, ingredients: List[str], seed: int = 0) -> Iterator[Dict[str, Any]]:
+    """
+    Generate records of recipes in format of @BulkImporter. Ingredients are Zipf-distributed,
+    so the first ones are common and the last ones are rare
+
+    :param n: number of recipes
+    :param ingredients: names of ingredients from common to rare
+    :param seed: seed of random generator
+    """
+
+    rng = random.Random(seed)
+    meals = TableExecutor.default_data['meals']
+    measures = [measure for measure in TableExecutor.default_data['measures'] if measure]
+    cum_weights, total = [], 0.0
+    for rank in range(len(ingredients)):
+        total += 1 / (rank + 1)
+        cum_weights.append(total)
+    for i in range(n):
+        chosen = set(rng.choices(ingredients, cum_weights=cum_weights, k=rng.randint(2, 8)))
+        yield {'name': f'Recipe {i} {rng.choice(ingredients)} {rng.choice(VERBS)}',
+               'description': ' '.join(rng.choice(VERBS) + ' ' + rng.choice(ingredients)
+                                       for _ in range(rng.randint(2, 6))),
+               'meals': rng.sample(meals, rng.randint(1, 3)),
+               'ingredients': [f'{rng.randint(1, 500)} {rng.choice(measures)} {ingredient}' for ingredient in chosen]}
+
+
+def open_database(path: str) -> Tuple[RecipeRepository, RecipesTable, ServeTable, QuantityTable]:
+    """
+    Open database by @RecipeRepository and create schema as the CLI of @food_blog does
+
+    :param path: path to db file
+    :Return repository and objects of tables writing by it
+    """
+
+    repository = RecipeRepository(path)
+    repository.create_schema()
+    return repository, RecipesTable(repository), ServeTable(repository), QuantityTable(repository)
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """
+    Call function several times and summarize wall time of calls
+
+    :param func: function without arguments
+    :param repeat: number of calls
+    :Return timings in milliseconds and number of rows returned by the last call
+    """
+
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {'calls': repeat, 'min_ms': timings[0], 'median_ms': statistics.median(timings),
+            'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))], 'max_ms': timings[-1],
+            'rows': len(result) if result else 0}
+
+
+def capture_plans(connection: sqlite3.Connection, func: Callable[[], Any]) -> List[Dict[str, Any]]:
+    """
+    Run function once, tracing SQL it executes, and explain query plans of its SELECT statements
+
+    :param connection: connection the function queries by
+    :param func: function without arguments
+    :Return list of statements with their plans, every step of plan is indented by its depth
+    """
+
+    statements = []
+    connection.set_trace_callback(statements.append)
+    try:
+        func()
+    finally:
+        connection.set_trace_callback(None)
+    plans = []
+    for statement in dict.fromkeys(statements):
+        if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            continue
+        depth, steps = {0: -1}, []
+        for id_, parent, _, detail in connection.execute(f'EXPLAIN QUERY PLAN {statement}'):
+            depth[id_] = depth.get(parent, -1) + 1
+            steps.append('  ' * depth[id_] + detail)
+        plans.append({'sql': ' '.join(statement.split()), 'plan': steps})
+    return plans
+
+
+def run_size(n: int, path: str, seed: int, repeat: int, batch_size: int, n_ingredients: int,
+             single_inserts: int) -> Dict[str, Any]:
+    """
+    Build synthetic database of @n recipes and benchmark inserts and lookups on it
+
+    :param n: number of recipes
+    :param path: path to new db file
+    :param seed: seed of synthetic data
+    :param repeat: number of calls of every query
+    :param batch_size: number of recipes per transaction of bulk insert
+    :param n_ingredients: number of distinct ingredients
+    :param single_inserts: number of recipes inserted one by one after bulk insert
+    :Return metrics of inserts and queries
+    """
+
+    repository, recipes, serves, quantity = open_database(path)
+    ingredients = make_words(random.Random(seed), n_ingredients)
+    result: Dict[str, Any] = {'recipes': n, 'ingredients': n_ingredients, 'batch_size': batch_size}
+
+    report = BulkImporter(recipes, serves, quantity, batch_size).import_records(make_records(n, ingredients, seed))
+    result['bulk_insert'] = {'seconds': report['seconds'],
+                             'rows': report['recipes'] + report['serve'] + report['quantity'],
+                             'rejected': report['rejected'], 'rows_per_second': report['rows_per_second']}
+    lookup_cache = repository.lookup_cache
+    names = {table: lookup_cache.id_by_name(table) for table in lookup_cache.tables}
+
+    measure_id, meal_id = names['measures']['g'], names['meals']['lunch']
+    ingredient_ids = list(names['ingredients'].values())
+    start = time.perf_counter()
+    for i in range(single_inserts):
+        recipe_id = recipes.insert_and_commit(f'Single {i}', 'mix')
+        serves.insert_and_commit(recipe_id, meal_id)
+        for ingredient_id in ingredient_ids[i % 10:i % 10 + 3]:
+            quantity.insert_and_commit(measure_id, ingredient_id, 100, recipe_id)
+    elapsed = time.perf_counter() - start
+    result['single_insert'] = {'recipes': single_inserts,
+                               'ms_per_recipe': elapsed * 1000 / single_inserts if single_inserts else None}
+    result['database_bytes'] = os.path.getsize(path)
+
+    rare = ingredients[-2:]
+    mixes = {'one_meal_common_ingredient': (['lunch'], ingredients[:1]),
+             'two_meals_two_ingredients': (['breakfast', 'lunch'], ingredients[:2]),
+             'all_meals_three_ingredients': (list(TableExecutor.default_data['meals']), ingredients[1:4]),
+             'one_meal_rare_ingredients': (['supper'], rare),
+             'unknown_ingredient': (['lunch'], ['unknown'])}
+    # queries run on one cursor of the writer, so plans can be captured by tracing its connection
+    cursor = repository.connection.cursor()
+    index = BitmapIndex()
+    start = time.perf_counter()
+    index.refresh(cursor)
+    result['bitmap_build_seconds'] = time.perf_counter() - start
+
+    cases: Dict[str, Callable[[], Any]] = {}
+    for mix, (meals, mix_ingredients) in mixes.items():
+        cases[f'sql:{mix}'] = lambda m=meals, i=mix_ingredients: get_recipe_by_meal_and_ingredient(cursor, m, i)
+        cases[f'bitmap:{mix}'] = lambda m=meals, i=mix_ingredients: index.query(cursor, m, i)
+    cases['bitmap:missing_one_of_three'] = lambda: index.query(cursor, ['lunch'], ingredients[:3], missing=1)
+    substring = ingredients[len(ingredients) // 2][1:4]
+    cases['sql:like_ingredient'] = lambda: get_like_expr(cursor, substring, 'ingredients', 'ingredient_name')
+    cases['cache:like_ingredient'] = lambda: lookup_cache.like('ingredients', substring)
+    cases['sql:exact_ingredient'] = lambda: get_exactly_expr(cursor, 'ingredients', ingredients[0], 'ingredient_name')
+    cases['sql:like_recipe_name'] = lambda: get_like_expr(cursor, ingredients[5], 'recipes', 'recipe_name')
+    cases['fts:search_recipes'] = lambda: search_recipes(cursor, f'{ingredients[5]} {VERBS[0]}')
+    cases['fts:search_recipes_filtered'] = lambda: search_recipes(cursor, ingredients[5], ['lunch'], ingredients[:1])
+
+    result['queries'] = {}
+    for name, func in cases.items():
+        metrics = measure(func, repeat)
+        if not name.startswith(('bitmap:', 'cache:')):
+            metrics['plans'] = capture_plans(repository.connection, func)
+        result['queries'][name] = metrics
+        print(f'{n} recipes {name}: median {metrics["median_ms"]:.3f}ms, {metrics["rows"]} rows', file=sys.stderr)
+    repository.close()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark inserts and queries of food_blog on synthetic databases')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000],
+                        help='Numbers of recipes of synthetic databases')
+    parser.add_argument('--ingredients', type=int, default=500, help='Number of distinct ingredients')
+    parser.add_argument('--repeat', type=int, default=20, help='Number of calls of every query')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Number of recipes per transaction of insert')
+    parser.add_argument('--single-inserts', type=int, default=200, help='Number of recipes inserted one by one')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of synthetic data')
+    parser.add_argument('--keep', required=False, help='Directory to keep databases in, temporary if omitted')
+    parser.add_argument('--output', '-o', required=False, help='Path to JSON report, stdout if omitted')
+    args = parser.parse_args()
+
+    report = {'python': sys.version, 'sqlite': sqlite3.sqlite_version, 'platform': platform.platform(),
+              'sizes': []}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        directory = args.keep or tmp_dir
+        for size in args.sizes:
+            db_path = os.path.join(directory, f'food_blog_{size}.db')
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+            report['sizes'].append(run_size(size, db_path, args.seed, args.repeat, args.batch_size,
+                                            args.ingredients, args.single_inserts))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
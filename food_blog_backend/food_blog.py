@@ -1,28 +1,40 @@
 import sys
-from typing import List, Dict, Union
+import time
+import queue
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from itertools import islice
+from typing import Any, Iterable, Iterator, List, Dict, Optional, Tuple, Union
 
+import csv
+import json
+import re
 import sqlite3
 import argparse
 
 
-def get_meals() -> Dict[int, str]:
+def get_meals(cursor_: sqlite3.Cursor) -> Dict[int, str]:
     """
     Data access function to select meals and map into dict name_by_number
 
+    :param cursor_: cursor to query by
     :Return mapping name_by_number to meals
     """
 
-    query = cursor.execute(f'''SELECT * FROM meals''').fetchall()
+    query = cursor_.execute(f'''SELECT * FROM meals''').fetchall()
     return_dict = {}
     for item in query:
         return_dict[item[0]] = item[1]
     return return_dict
 
 
-def get_like_expr(expr: Union[int, str], table_name: str, col_name: str) -> List[Union[str, int]]:
+def get_like_expr(cursor_: sqlite3.Cursor, expr: Union[int, str], table_name: str,
+                  col_name: str) -> List[Union[str, int]]:
     """
     Return list of objects obtained using the corresponding predicate like expression
 
+    :param cursor_ - cursor to query by
     :param expr - predicate to search by
     :param table_name - full name of table
     :param col_name - name of column to search in
@@ -30,15 +42,17 @@ def get_like_expr(expr: Union[int, str], table_name: str, col_name: str) -> List
     Return: list of objects with @col_name values contains @expr left-sided or right-sided
     """
 
-    query = cursor.execute(f'''SELECT * FROM {table_name}
+    query = cursor_.execute(f'''SELECT * FROM {table_name}
                             where {col_name} like ?;''', ('%' + expr + '%',)).fetchall()
     return query
 
 
-def get_exactly_expr(table_name: str, expr: Union[int, str], col_name: str) -> List[Union[str, int]]:
+def get_exactly_expr(cursor_: sqlite3.Cursor, table_name: str, expr: Union[int, str],
+                     col_name: str) -> List[Union[str, int]]:
     """
     Return list of objects obtained using where clause
 
+    :param cursor_: cursor to query by
     :param table_name: full name of table contains @col_name
     :param expr: predicate to search by
     :param col_name: name of column to search in
@@ -46,44 +60,679 @@ def get_exactly_expr(table_name: str, expr: Union[int, str], col_name: str) -> L
     :Return list of objects with @col_name values equals @expr
     """
 
-    query = cursor.execute(f'''SELECT * FROM {table_name}
+    query = cursor_.execute(f'''SELECT * FROM {table_name}
                             where {col_name} = ?''', (expr,))
     return query.fetchall()
 
 
-def get_recipe_by_meal_and_ingredient(meals_: List[int], ingredients_: List[str]) -> Union[List[str], None]:
+def recipe_filters(meals_: Optional[List[str]], ingredients_: Optional[List[str]],
+                   correlated: bool = False) -> Tuple[List[str], List[Any]]:
+    """
+    Build where clauses over recipes aliased t1 for meal and ingredient filters.
+    Ingredients filter is relational division: recipe is kept if the number of distinct matched
+    ingredients equals the number of requested ones. Meals filter keeps recipes served at any of meals
+
+    :param meals_: list of names of meals or None
+    :param ingredients_: list of names of ingredients or None
+    :param correlated: check ingredients of every recipe by index instead of selecting all recipes
+                       with the ingredients at once, faster if few recipes are filtered
+    :Return list of clauses to join by and, list of their parameters
+    """
+
+    clauses, params = [], []
+    ingredient_names = list(dict.fromkeys(ingredients_ or []))
+    if ingredient_names and correlated:
+        clauses.append(f'''(SELECT count(distinct t4.ingredient_id) FROM quantity t4
+                             inner join ingredients t5
+                             on t5.ingredient_id = t4.ingredient_id
+                             where t4.recipe_id = t1.recipe_id
+                             and t5.ingredient_name in ({",".join(["?"] * len(ingredient_names))})) = ?''')
+        params.extend((*ingredient_names, len(ingredient_names)))
+    elif ingredient_names:
+        clauses.append(f'''t1.recipe_id in (SELECT t4.recipe_id FROM quantity t4
+                                            inner join ingredients t5
+                                            on t5.ingredient_id = t4.ingredient_id
+                                            where t5.ingredient_name in ({",".join(["?"] * len(ingredient_names))})
+                                            group by t4.recipe_id
+                                            having count(distinct t4.ingredient_id) = ?)''')
+        params.extend((*ingredient_names, len(ingredient_names)))
+    if meals_:
+        clauses.append(f'''exists (SELECT 1 FROM serve t2
+                                    inner join meals t3
+                                    on t3.meal_id = t2.meal_id
+                                    where t2.recipe_id = t1.recipe_id
+                                    and t3.meal_name in ({",".join(["?"] * len(meals_))}))''')
+        params.extend(meals_)
+    return clauses, params
+
+
+def get_recipe_by_meal_and_ingredient(cursor_: sqlite3.Cursor, meals_: List[str],
+                                      ingredients_: List[str]) -> Union[List[str], None]:
     """
     Data access function to get recipe by meal and ingredient
-    Multiple queries in loop of ingredients, then get their intersection
+    Single relational division query, look @recipe_filters
 
-    :param meals_: list of numbers (integer values), look @get_meals()
+    :param cursor_: cursor to query by
+    :param meals_: list of names of meals, look @get_meals()
     :param ingredients_: list of ingredients
 
     :Return None if there is no recipe by meal and ingredients. Expected to search by all ingredients
     """
 
-    list_of_sets_ids = []
-    for ingredient in ingredients_:
-        query = cursor.execute(f'''SELECT t1.recipe_name, t1.recipe_id FROM recipes t1
-                            inner join serve t2
-                            on t1.recipe_id = t2.recipe_id
-                            inner join meals t3
-                            on t2.meal_id = t3.meal_id
-                            inner join quantity t4
-                            on t4.recipe_id = t1.recipe_id
-                            join ingredients t5
-                            on t5.ingredient_id = t4.ingredient_id
-                            where t5.ingredient_name = ? and t3.meal_name in ({",".join(["?"] * len(meals_))});''',
-                               (ingredient, *meals_)).fetchall()
-        if query:
-            list_of_sets_ids.append(set(item[1] for item in query))
-    if list_of_sets_ids and len(list_of_sets_ids) == len(ingredients_):
-        recipe_ids = set.intersection(*list_of_sets_ids)
-    else:
+    if not ingredients_ or not meals_:
+        return None
+    clauses, params = recipe_filters(meals_, ingredients_)
+    query = cursor_.execute(f'''SELECT t1.recipe_name FROM recipes t1
+                            where {" and ".join(clauses)}
+                            order by t1.recipe_id;''', params).fetchall()
+    return query or None
+
+
+def fts_query(text: str) -> Optional[str]:
+    """
+    Convert free text into FTS5 query: text is split into words on punctuation like the tokenizer does,
+    so "stir-fry" gives words "stir" and "fry". Every word is quoted and matched as prefix, all words are required
+
+    :param text: text typed by user
+    :Return query for MATCH or None if text has no words
+    """
+
+    tokens = re.findall(r'\w+', text)
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def match_is_narrower(cursor_: sqlite3.Cursor, match: str, ingredients_: Optional[List[str]],
+                      bound: int = 5000) -> bool:
+    """
+    Tell if full-text query matches fewer recipes than there are quantities of ingredients.
+    Then @recipe_filters are cheaper correlated with matched recipes than selected at once.
+    Both are counted up to a bound, so the check costs no more than the cheaper filter
+
+    :param cursor_: cursor to query by
+    :param match: query for MATCH, look @fts_query
+    :param ingredients_: list of ingredients or None
+    :param bound: maximal number of counted quantities
+    """
+
+    ingredient_names = list(dict.fromkeys(ingredients_ or []))
+    if not ingredient_names:
+        return False
+    quantities = cursor_.execute(f'''SELECT count(*) FROM (SELECT 1 FROM quantity t4
+                                     inner join ingredients t5
+                                     on t5.ingredient_id = t4.ingredient_id
+                                     where t5.ingredient_name in ({",".join(["?"] * len(ingredient_names))})
+                                     limit ?);''', (*ingredient_names, bound)).fetchone()[0]
+    matches = cursor_.execute('''SELECT count(*) FROM (SELECT rowid FROM recipes_fts
+                                  where recipes_fts match ?
+                                  limit ?);''', (match, quantities + 1)).fetchone()[0]
+    return matches <= quantities
+
+
+def search_recipes(cursor_: sqlite3.Cursor, text: str, meals_: Optional[List[str]] = None,
+                   ingredients_: Optional[List[str]] = None, limit: int = 20) -> Union[List[Tuple[int, str]], None]:
+    """
+    Data access function to search recipes by words of name and description, ranked by bm25.
+    Name matches weigh more than description ones. Can be narrowed by meals and ingredients, look @recipe_filters,
+    which are checked per matched recipe if the text is selective, look @match_is_narrower
+
+    :param cursor_: cursor to query by
+    :param text: free text, words are matched as prefixes
+    :param meals_: list of names of meals or None
+    :param ingredients_: list of ingredients or None
+    :param limit: maximal number of recipes
+
+    :Return list of (recipe_id, recipe_name) from best match or None if nothing is found
+    """
+
+    match = fts_query(text)
+    if match is None:
         return None
-    return cursor.execute(f'''SELECT recipe_name FROM recipes
-                         where recipe_id in ({",".join(["?"] * len(recipe_ids))});''',
-                          (*recipe_ids,)).fetchall()
+    clauses, params = recipe_filters(meals_, ingredients_, match_is_narrower(cursor_, match, ingredients_))
+    where = ''.join(f' and {clause}' for clause in clauses)
+    query = cursor_.execute(f'''SELECT t1.recipe_id, t1.recipe_name FROM recipes_fts f
+                            inner join recipes t1
+                            on t1.recipe_id = f.rowid
+                            where recipes_fts match ?{where}
+                            order by bm25(recipes_fts, 10.0, 1.0)
+                            limit ?;''', (match, *params, limit)).fetchall()
+    return query or None
+
+
+def search_ingredients(cursor_: sqlite3.Cursor, text: str, limit: int = 20) -> List[Tuple[int, str]]:
+    """
+    Data access function to search ingredients by words of name, ranked by bm25.
+    Unlike @get_like_expr it uses full-text index instead of scan
+
+    :param cursor_: cursor to query by
+    :param text: free text, words are matched as prefixes
+    :param limit: maximal number of ingredients
+
+    :Return list of (ingredient_id, ingredient_name) from best match
+    """
+
+    match = fts_query(text)
+    if match is None:
+        return []
+    return cursor_.execute('''SELECT rowid, ingredient_name FROM ingredients_fts
+                            where ingredients_fts match ?
+                            order by rank
+                            limit ?;''', (match, limit)).fetchall()
+
+
+class RecipeRepository:
+    """
+    Owner of connections to database file: one writer and pool of readers, all in WAL journal mode,
+    so readers neither block each other nor wait for the writer.
+    Methods are safe to call from many threads, every connection is used by one thread at a time.
+    Query methods are the data access functions above run on a pooled reader cursor.
+    Schema setup and imports run on the writer, lookups are cached in its own @LookupCache
+    """
+
+    pragmas = ('''PRAGMA journal_mode = WAL;''',
+               '''PRAGMA synchronous = NORMAL;''',
+               '''PRAGMA foreign_keys = ON;''')
+
+    def __init__(self, database_name: str, readers: int = 4, timeout: float = 30.0):
+        """
+        Open writer connection first, it creates database file and switches it to WAL
+
+        :param database_name: path to db file
+        :param readers: number of reader connections, that is the number of concurrent queries
+        :param timeout: seconds to wait for a lock of database or for a free reader
+        """
+
+        self.database_name = database_name
+        self.timeout = timeout
+        self.connection = self.open_connection()
+        self.write_lock = threading.Lock()
+        self.readers: queue.LifoQueue = queue.LifoQueue()
+        for _ in range(readers):
+            self.readers.put(self.open_connection(read_only=True))
+        self.lookup_cache = LookupCache(self)
+
+    def open_connection(self, read_only: bool = False) -> sqlite3.Connection:
+        """
+        Open connection which may be passed between threads
+
+        :param read_only: refuse writes on this connection
+        """
+
+        connection = sqlite3.connect(self.database_name, timeout=self.timeout, check_same_thread=False)
+        for pragma in self.pragmas:
+            connection.execute(pragma)
+        if read_only:
+            connection.execute('''PRAGMA query_only = ON;''')
+        return connection
+
+    @contextmanager
+    def reading(self) -> Iterator[sqlite3.Cursor]:
+        """
+        Borrow reader connection for a block of queries. Waits if all readers are busy
+
+        :Return cursor of borrowed connection
+        """
+
+        connection = self.readers.get(timeout=self.timeout)
+        try:
+            yield connection.cursor()
+        finally:
+            self.readers.put(connection)
+
+    @contextmanager
+    def writing(self) -> Iterator[sqlite3.Cursor]:
+        """
+        Hold the only writer for a transaction. It is committed at the end of block
+        and rolled back if the block raises
+
+        :Return cursor of writer connection
+        """
+
+        with self.write_lock:
+            try:
+                yield self.connection.cursor()
+            except BaseException:
+                self.connection.rollback()
+                raise
+            self.connection.commit()
+
+    def create_schema(self) -> int:
+        """
+        Create tables with default values and apply migrations, as the CLI does on start
+
+        :Return version of schema, look @SchemaMigrator
+        """
+
+        executor = TableExecutor(self)
+        for table_name in ('meals', 'ingredients', 'measures'):
+            executor.create_table(table_name)
+        for table in (RecipesTable(self), ServeTable(self), QuantityTable(self)):
+            table.create_table()
+        return SchemaMigrator(self).migrate()
+
+    def import_file(self, path: str, batch_size: int = 1000) -> Dict[str, float]:
+        """Look @BulkImporter.import_file"""
+
+        return BulkImporter(RecipesTable(self), ServeTable(self), QuantityTable(self), batch_size).import_file(path)
+
+    def get_meals(self) -> Dict[int, str]:
+        """Look @get_meals"""
+
+        with self.reading() as cursor_:
+            return get_meals(cursor_)
+
+    def get_like_expr(self, expr: Union[int, str], table_name: str, col_name: str) -> List[Union[str, int]]:
+        """Look @get_like_expr"""
+
+        with self.reading() as cursor_:
+            return get_like_expr(cursor_, expr, table_name, col_name)
+
+    def get_exactly_expr(self, table_name: str, expr: Union[int, str], col_name: str) -> List[Union[str, int]]:
+        """Look @get_exactly_expr"""
+
+        with self.reading() as cursor_:
+            return get_exactly_expr(cursor_, table_name, expr, col_name)
+
+    def get_recipe_by_meal_and_ingredient(self, meals_: List[str], ingredients_: List[str]) -> Union[List[str], None]:
+        """Look @get_recipe_by_meal_and_ingredient"""
+
+        with self.reading() as cursor_:
+            return get_recipe_by_meal_and_ingredient(cursor_, meals_, ingredients_)
+
+    def search_recipes(self, text: str, meals_: Optional[List[str]] = None, ingredients_: Optional[List[str]] = None,
+                       limit: int = 20) -> Union[List[Tuple[int, str]], None]:
+        """Look @search_recipes"""
+
+        with self.reading() as cursor_:
+            return search_recipes(cursor_, text, meals_, ingredients_, limit)
+
+    def search_ingredients(self, text: str, limit: int = 20) -> List[Tuple[int, str]]:
+        """Look @search_ingredients"""
+
+        with self.reading() as cursor_:
+            return search_ingredients(cursor_, text, limit)
+
+    def close(self) -> None:
+        """Close writer and all readers, expected to be called when no query is running"""
+
+        while not self.readers.empty():
+            self.readers.get_nowait().close()
+        self.connection.close()
+
+    def __enter__(self) -> 'RecipeRepository':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class SchemaMigrator:
+    """
+    Apply numbered schema migrations once. Number of the last applied one is kept in PRAGMA user_version
+    """
+
+    migrations = {
+        1: ('CREATE INDEX IF NOT EXISTS serve_recipe_meal_idx ON serve (recipe_id, meal_id);',
+            'CREATE INDEX IF NOT EXISTS serve_meal_recipe_idx ON serve (meal_id, recipe_id);',
+            'CREATE INDEX IF NOT EXISTS quantity_recipe_ingredient_idx ON quantity (recipe_id, ingredient_id);',
+            'CREATE INDEX IF NOT EXISTS quantity_ingredient_recipe_idx ON quantity (ingredient_id, recipe_id);',
+            'CREATE INDEX IF NOT EXISTS recipes_name_idx ON recipes (recipe_name);'),
+        # full-text indexes over external content, kept in sync by triggers and filled from existing rows
+        2: ('''CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5(
+                recipe_name, recipe_description, content='recipes', content_rowid='recipe_id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3');''',
+            '''CREATE TRIGGER IF NOT EXISTS recipes_fts_insert AFTER INSERT ON recipes BEGIN
+                INSERT INTO recipes_fts (rowid, recipe_name, recipe_description)
+                VALUES (new.recipe_id, new.recipe_name, new.recipe_description);
+            END;''',
+            '''CREATE TRIGGER IF NOT EXISTS recipes_fts_delete AFTER DELETE ON recipes BEGIN
+                INSERT INTO recipes_fts (recipes_fts, rowid, recipe_name, recipe_description)
+                VALUES ('delete', old.recipe_id, old.recipe_name, old.recipe_description);
+            END;''',
+            '''CREATE TRIGGER IF NOT EXISTS recipes_fts_update AFTER UPDATE ON recipes BEGIN
+                INSERT INTO recipes_fts (recipes_fts, rowid, recipe_name, recipe_description)
+                VALUES ('delete', old.recipe_id, old.recipe_name, old.recipe_description);
+                INSERT INTO recipes_fts (rowid, recipe_name, recipe_description)
+                VALUES (new.recipe_id, new.recipe_name, new.recipe_description);
+            END;''',
+            '''CREATE VIRTUAL TABLE IF NOT EXISTS ingredients_fts USING fts5(
+                ingredient_name, content='ingredients', content_rowid='ingredient_id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3');''',
+            '''CREATE TRIGGER IF NOT EXISTS ingredients_fts_insert AFTER INSERT ON ingredients BEGIN
+                INSERT INTO ingredients_fts (rowid, ingredient_name) VALUES (new.ingredient_id, new.ingredient_name);
+            END;''',
+            '''CREATE TRIGGER IF NOT EXISTS ingredients_fts_delete AFTER DELETE ON ingredients BEGIN
+                INSERT INTO ingredients_fts (ingredients_fts, rowid, ingredient_name)
+                VALUES ('delete', old.ingredient_id, old.ingredient_name);
+            END;''',
+            '''CREATE TRIGGER IF NOT EXISTS ingredients_fts_update AFTER UPDATE ON ingredients BEGIN
+                INSERT INTO ingredients_fts (ingredients_fts, rowid, ingredient_name)
+                VALUES ('delete', old.ingredient_id, old.ingredient_name);
+                INSERT INTO ingredients_fts (rowid, ingredient_name) VALUES (new.ingredient_id, new.ingredient_name);
+            END;''',
+            "INSERT INTO recipes_fts (recipes_fts) VALUES ('rebuild');",
+            "INSERT INTO ingredients_fts (ingredients_fts) VALUES ('rebuild');"),
+    }
+
+    def __init__(self, repository: RecipeRepository):
+        """
+        :param repository: repository to migrate database of
+        """
+
+        self.repository = repository
+
+    def migrate(self) -> int:
+        """
+        Apply migrations newer than schema version, each one in its own transaction.
+        Expected to be called after all tables are created
+
+        :Return version of schema after migration
+        """
+
+        with self.repository.writing() as cursor_:
+            version = cursor_.execute('''PRAGMA user_version;''').fetchone()[0]
+        for number in sorted(self.migrations):
+            if number <= version:
+                continue
+            with self.repository.writing() as cursor_:
+                cursor_.execute('''BEGIN;''')
+                for statement in self.migrations[number]:
+                    cursor_.execute(statement)
+                cursor_.execute(f'''PRAGMA user_version = {number};''')
+            version = number
+        return version
+
+
+class LookupCache:
+    """
+    In-memory copy of small dimension tables: meals, measures and ingredients.
+    Answers exact, prefix and substring lookups without table scans.
+    Table is loaded on first lookup and reloaded after @invalidate, which is called on inserts.
+    Index loaded while the table is invalidated is not kept, so it is safe to share between threads
+
+    Index of table contains: rows - list of (id, name) ordered by id
+                             exact - rows_by_name
+                             names - sorted list of (folded name, id) for prefix search
+                             suffixes - sorted list of (folded suffix of name, id) for substring search
+    """
+
+    tables = {'meals': 'meal_name', 'measures': 'measure_name', 'ingredients': 'ingredient_name'}
+    # LIKE of SQLite ignores case of ASCII letters only
+    ascii_lower = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+    def __init__(self, repository: RecipeRepository):
+        """
+        :param repository: repository to load tables by its readers
+        """
+
+        self.repository = repository
+        self.indexes: Dict[str, Dict[str, Any]] = {}
+        self.versions: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def invalidate(self, table_name: Optional[str] = None) -> None:
+        """
+        Drop index of table, or of all tables if @table_name is None
+
+        :param table_name: name of changed table
+        """
+
+        with self.lock:
+            for name in self.tables if table_name is None else (table_name,):
+                self.indexes.pop(name, None)
+                self.versions[name] = self.versions.get(name, 0) + 1
+
+    def load_rows(self, table_name: str) -> List[Tuple[int, str]]:
+        """
+        Select all rows of table ordered by id
+
+        :param table_name: one of @tables
+        """
+
+        with self.repository.reading() as cursor_:
+            return cursor_.execute(f'''SELECT * FROM {table_name} ORDER BY 1''').fetchall()
+
+    def index(self, table_name: str) -> Dict[str, Any]:
+        """
+        Get index of table, load it from database if it is missing
+
+        :param table_name: one of @tables
+        """
+
+        index = self.indexes.get(table_name)
+        if index is None:
+            version = self.versions.get(table_name, 0)
+            rows = self.load_rows(table_name)
+            exact, names, suffixes = {}, [], []
+            for id_, name in rows:
+                if name is None:
+                    continue
+                exact.setdefault(name, []).append((id_, name))
+                folded = name.translate(self.ascii_lower)
+                names.append((folded, id_))
+                suffixes.extend((folded[i:], id_) for i in range(max(len(folded), 1)))
+            names.sort()
+            suffixes.sort()
+            index = {'rows': rows, 'by_id': dict(rows), 'exact': exact, 'names': names, 'suffixes': suffixes}
+            with self.lock:
+                if self.versions.get(table_name, 0) == version:
+                    self.indexes[table_name] = index
+        return index
+
+    def exact(self, table_name: str, expr: str) -> List[Tuple[int, str]]:
+        """
+        Rows with name equal to @expr, as @get_exactly_expr
+
+        :param table_name: one of @tables
+        :param expr: name to search
+        """
+
+        return self.index(table_name)['exact'].get(expr, [])
+
+    def _search(self, table_name: str, key: str, expr: str) -> List[Tuple[int, str]]:
+        """
+        Rows whose folded names or suffixes start with @expr, ordered by id
+
+        :param table_name: one of @tables
+        :param key: names or suffixes
+        :param expr: string to search
+        """
+
+        index = self.index(table_name)
+        sorted_keys = index[key]
+        folded = expr.translate(self.ascii_lower)
+        ids = set()
+        position = bisect_left(sorted_keys, (folded,))
+        while position < len(sorted_keys) and sorted_keys[position][0].startswith(folded):
+            ids.add(sorted_keys[position][1])
+            position += 1
+        return [(id_, index['by_id'][id_]) for id_ in sorted(ids)]
+
+    def like(self, table_name: str, expr: str) -> List[Tuple[int, str]]:
+        """
+        Rows with name containing @expr case-insensitively, as @get_like_expr.
+        Wildcards % and _ in @expr are taken literally
+
+        :param table_name: one of @tables
+        :param expr: substring to search
+        """
+
+        return self._search(table_name, 'suffixes', expr)
+
+    def prefix(self, table_name: str, expr: str) -> List[Tuple[int, str]]:
+        """
+        Rows with name starting with @expr case-insensitively
+
+        :param table_name: one of @tables
+        :param expr: prefix to search
+        """
+
+        return self._search(table_name, 'names', expr)
+
+    def id_by_name(self, table_name: str) -> Dict[str, int]:
+        """
+        Map names of table to their ids
+
+        :param table_name: one of @tables
+        """
+
+        return {name: rows[0][0] for name, rows in self.index(table_name)['exact'].items()}
+
+    def get_meals(self) -> Dict[int, str]:
+        """
+        Cached version of @get_meals
+        """
+
+        return dict(self.index('meals')['rows'])
+
+
+class BitmapIndex:
+    """
+    Optional in-process index of recipes by ingredient and by meal. Set of recipes is a bitmap
+    stored in Python int: bit i is set if recipe with id i belongs to it. AND and OR of
+    filters are intersection and union of bitmaps, without joins.
+    Index follows inserts incrementally: @refresh reads only rows of quantity, serve and recipes
+    with id greater than the last one seen. Deleted rows are dropped by @rebuild only
+
+    Contains: by_ingredient - bitmap_by_ingredient_name
+              by_meal - bitmap_by_meal_name
+              names - recipe_name_by_id
+              all_recipes - bitmap of all recipes
+              last_ids - the last seen id by table name
+    """
+
+    sources = {'quantity': '''SELECT t4.quantity_id, t5.ingredient_name, t4.recipe_id FROM quantity t4
+                              inner join ingredients t5
+                              on t5.ingredient_id = t4.ingredient_id
+                              where t4.quantity_id > ?''',
+               'serve': '''SELECT t2.serve_id, t3.meal_name, t2.recipe_id FROM serve t2
+                           inner join meals t3
+                           on t3.meal_id = t2.meal_id
+                           where t2.serve_id > ?''',
+               'recipes': '''SELECT recipe_id, recipe_name, recipe_id FROM recipes
+                             where recipe_id > ?'''}
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rebuild_state()
+
+    def rebuild_state(self) -> None:
+        """Forget everything, next @refresh loads tables from the start"""
+
+        self.by_ingredient: Dict[str, int] = {}
+        self.by_meal: Dict[str, int] = {}
+        self.names: Dict[int, str] = {}
+        self.all_recipes = 0
+        self.last_ids = dict.fromkeys(self.sources, 0)
+
+    def refresh(self, cursor_: sqlite3.Cursor) -> None:
+        """
+        Add rows inserted since the last refresh
+
+        :param cursor_: cursor to query by
+        """
+
+        with self.lock:
+            for table_name, statement in self.sources.items():
+                rows = cursor_.execute(statement, (self.last_ids[table_name],)).fetchall()
+                if not rows:
+                    continue
+                if table_name == 'recipes':
+                    for recipe_id, name, _ in rows:
+                        self.names[recipe_id] = name
+                    self.all_recipes |= self.bitmap([recipe_id for recipe_id, _, _ in rows])
+                else:
+                    bitmaps = self.by_ingredient if table_name == 'quantity' else self.by_meal
+                    ids_by_name: Dict[str, List[int]] = {}
+                    for _, name, recipe_id in rows:
+                        ids_by_name.setdefault(name, []).append(recipe_id)
+                    for name, recipe_ids in ids_by_name.items():
+                        bitmaps[name] = bitmaps.get(name, 0) | self.bitmap(recipe_ids)
+                self.last_ids[table_name] = max(row[0] for row in rows)
+
+    @staticmethod
+    def bitmap(ids: List[int]) -> int:
+        """
+        Make bitmap of ids at once in bytes. Setting bits one by one would copy the whole int for every id
+
+        :param ids: non-empty list of ids
+        """
+
+        bits = bytearray(max(ids) // 8 + 1)
+        for id_ in ids:
+            bits[id_ >> 3] |= 1 << (id_ & 7)
+        return int.from_bytes(bits, 'little')
+
+    def rebuild(self, cursor_: sqlite3.Cursor) -> None:
+        """
+        Load index from scratch, needed after deletes
+
+        :param cursor_: cursor to query by
+        """
+
+        with self.lock:
+            self.rebuild_state()
+        self.refresh(cursor_)
+
+    def meals_bitmap(self, meals_: Optional[List[str]]) -> int:
+        """
+        Recipes served at any of meals, all recipes if @meals_ is empty
+
+        :param meals_: list of names of meals
+        """
+
+        if not meals_:
+            return self.all_recipes
+        bitmap = 0
+        for meal in meals_:
+            bitmap |= self.by_meal.get(meal, 0)
+        return bitmap
+
+    def at_least(self, ingredients_: List[str], n: int) -> int:
+        """
+        Recipes containing at least @n of ingredients. Counted by bitmaps:
+        level j holds recipes containing at least j of ingredients seen so far
+
+        :param ingredients_: list of names of distinct ingredients
+        :param n: required number of matched ingredients
+        """
+
+        if n <= 0:
+            return self.all_recipes
+        levels = [self.all_recipes] + [0] * n
+        for ingredient in ingredients_:
+            bitmap = self.by_ingredient.get(ingredient, 0)
+            for j in range(n, 0, -1):
+                levels[j] |= levels[j - 1] & bitmap
+        return levels[n]
+
+    def query(self, cursor_: sqlite3.Cursor, meals_: Optional[List[str]], ingredients_: List[str], missing: int = 0,
+              any_ingredient: bool = False) -> Union[List[str], None]:
+        """
+        Get recipes by meal and ingredient from index, refreshed before query
+
+        :param cursor_: cursor to refresh index by
+        :param meals_: list of names of meals, recipe is served at any of them. No filter if empty
+        :param ingredients_: list of ingredients, recipe contains all of them
+        :param missing: recipe may lack at most this number of @ingredients_
+        :param any_ingredient: recipe contains any of @ingredients_ instead of all
+
+        :Return names of recipes ordered by id, None if there is no such recipe, as @get_recipe_by_meal_and_ingredient
+        """
+
+        self.refresh(cursor_)
+        ingredient_names = list(dict.fromkeys(ingredients_))
+        required = 1 if any_ingredient else len(ingredient_names) - missing
+        bitmap = self.meals_bitmap(meals_) & self.at_least(ingredient_names, required)
+        if not bitmap:
+            return None
+        bits = bin(bitmap)[:1:-1]
+        recipe_ids, position = [], bits.find('1')
+        while position >= 0:
+            recipe_ids.append(position)
+            position = bits.find('1', position + 1)
+        return [self.names[recipe_id] for recipe_id in recipe_ids]
 
 
 class TableExecutor:
@@ -94,8 +743,14 @@ class TableExecutor:
     default_data = {"meals": ("breakfast", "brunch", "lunch", "supper"),
                     "ingredients": ("milk", "cacao", "strawberry", "blueberry", "blackberry", "sugar"),
                     "measures": ("ml", "g", "l", "cup", "tbsp", "tsp", "dsp", "")}
-    global cursor
-    global connect
+
+    def __init__(self, repository: RecipeRepository):
+        """
+        :param repository: repository to write by its writer
+        """
+
+        self.repository = repository
+        self.lookup_cache = repository.lookup_cache
 
     def create_table(self, table_name: str) -> None:
         """
@@ -112,12 +767,12 @@ class TableExecutor:
             not_null = ''
         elif table_name == 'recipes':
             unique = ''
-        cursor.execute(f'''CREATE TABLE IF NOT EXISTS {table_name}
-                            (
-                            {id_} INTEGER PRIMARY KEY,
-                            {name_} VARCHAR(30) {not_null} {unique}
-                            );''')
-        connect.commit()
+        with self.repository.writing() as cursor_:
+            cursor_.execute(f'''CREATE TABLE IF NOT EXISTS {table_name}
+                                (
+                                {id_} INTEGER PRIMARY KEY,
+                                {name_} VARCHAR(30) {not_null} {unique}
+                                );''')
         if table_name != 'recipes':
             self.insert_default_values(table_name)
 
@@ -129,13 +784,14 @@ class TableExecutor:
         """
 
         values_attr = table_name[:-1] + '_name'
-        query = cursor.execute(f'''SELECT * FROM {table_name}
-                                    WHERE {values_attr} = \'{self.default_data[table_name][0]}\'''').fetchall()
+        with self.repository.writing() as cursor_:
+            query = cursor_.execute(f'''SELECT * FROM {table_name}
+                                        WHERE {values_attr} = \'{self.default_data[table_name][0]}\'''').fetchall()
+            if not query:
+                cursor_.executemany(f'''INSERT INTO {table_name}({values_attr})
+                                        VALUES (?)''', [(item,) for item in self.default_data[table_name]])
         if not query:
-            for item in self.default_data[table_name]:
-                cursor.execute(f'''INSERT INTO {table_name}({values_attr})
-                                    VALUES (\'{item}\')''')
-                connect.commit()
+            self.lookup_cache.invalidate(table_name)
 
 
 class RecipesTable(TableExecutor):
@@ -152,12 +808,12 @@ class RecipesTable(TableExecutor):
 
         super().create_table(table_name)
         column_name = table_name[:-1] + '_description'
-        all_cols = cursor.execute(f'''PRAGMA table_info({table_name});''').fetchall()
-        checker = [1 for x in all_cols if column_name in x]
-        if not checker:
-            cursor.execute(f'''ALTER TABLE {table_name}
-                                ADD COLUMN {column_name} VARCHAR(80)''')
-        connect.commit()
+        with self.repository.writing() as cursor_:
+            all_cols = cursor_.execute(f'''PRAGMA table_info({table_name});''').fetchall()
+            checker = [1 for x in all_cols if column_name in x]
+            if not checker:
+                cursor_.execute(f'''ALTER TABLE {table_name}
+                                    ADD COLUMN {column_name} VARCHAR(80)''')
 
     def insert_and_commit(self, recipe_name: str, recipe_description: str) -> int:
         """
@@ -169,10 +825,23 @@ class RecipesTable(TableExecutor):
 
         description = self.table_name[:-1] + '_description'
         name = self.table_name[:-1] + '_name'
-        id_ = cursor.execute(f'''INSERT INTO {self.table_name} ({name}, {description})
-                            VALUES (?, ?)''', (recipe_name, recipe_description)).lastrowid
-        connect.commit()
-        return id_
+        with self.repository.writing() as cursor_:
+            return cursor_.execute(f'''INSERT INTO {self.table_name} ({name}, {description})
+                                VALUES (?, ?)''', (recipe_name, recipe_description)).lastrowid
+
+    def insert_many(self, rows: Iterable[Tuple[int, str, str]], cursor_: sqlite3.Cursor) -> None:
+        """
+        DAO to insert batch of recipes with explicit ids. Commit is left to the caller
+
+        :param rows: tuples of (recipe_id, recipe_name, recipe_description)
+        :param cursor_: cursor of caller's transaction
+        """
+
+        description = self.table_name[:-1] + '_description'
+        name = self.table_name[:-1] + '_name'
+        id_ = self.table_name[:-1] + '_id'
+        cursor_.executemany(f'''INSERT INTO {self.table_name} ({id_}, {name}, {description})
+                            VALUES (?, ?, ?)''', rows)
 
     def process_input(self, serves_table, quantity_table) -> None:
         """
@@ -186,7 +855,7 @@ class RecipesTable(TableExecutor):
         while recipe_name:
             recipe_description = input('Recipe description: ')
             last_row_id = self.insert_and_commit(recipe_name, recipe_description)
-            meals_ = get_meals()
+            meals_ = self.lookup_cache.get_meals()
             print(*[f'{item}) ' + meals_[item] for item in meals_.keys()])
             chosen_numbers = list(map(int, input('When the dish can be served: ').split()))
             for number in chosen_numbers:
@@ -209,16 +878,16 @@ class ServeTable(TableExecutor):
 
         :param table_name: name of table in database
         """
-        cursor.execute(f'''CREATE TABLE IF NOT EXISTS {table_name} (
-                        {self.col_1} INTEGER PRIMARY KEY,
-                        {self.col_2} INTEGER NOT NULL,
-                        {self.col_3} INTEGER NOT NULL,
-                        CONSTRAINT fk_recipes FOREIGN KEY ({self.col_2})
-                        REFERENCES recipes ({self.col_2}),
-                        CONSTRAINT fk_meals FOREIGN KEY ({self.col_3})
-                        REFERENCES meals ({self.col_3})
-                        );''')
-        connect.commit()
+        with self.repository.writing() as cursor_:
+            cursor_.execute(f'''CREATE TABLE IF NOT EXISTS {table_name} (
+                            {self.col_1} INTEGER PRIMARY KEY,
+                            {self.col_2} INTEGER NOT NULL,
+                            {self.col_3} INTEGER NOT NULL,
+                            CONSTRAINT fk_recipes FOREIGN KEY ({self.col_2})
+                            REFERENCES recipes ({self.col_2}),
+                            CONSTRAINT fk_meals FOREIGN KEY ({self.col_3})
+                            REFERENCES meals ({self.col_3})
+                            );''')
 
     def insert_and_commit(self, recipe_id: int, meal_id: int) -> None:
         """
@@ -227,9 +896,19 @@ class ServeTable(TableExecutor):
         :param recipe_id: id of recipe in recipes table
         :param meal_id: id of meal in meals table
         """
-        cursor.execute(f'''INSERT INTO {self.table_name}({self.col_2}, {self.col_3})
-                        VALUES (?, ?)''', (recipe_id, meal_id))
-        connect.commit()
+        with self.repository.writing() as cursor_:
+            cursor_.execute(f'''INSERT INTO {self.table_name}({self.col_2}, {self.col_3})
+                            VALUES (?, ?)''', (recipe_id, meal_id))
+
+    def insert_many(self, rows: Iterable[Tuple[int, int]], cursor_: sqlite3.Cursor) -> None:
+        """
+        Insert batch of objects in table. Commit is left to the caller
+
+        :param rows: tuples of (recipe_id, meal_id)
+        :param cursor_: cursor of caller's transaction
+        """
+        cursor_.executemany(f'''INSERT INTO {self.table_name}({self.col_2}, {self.col_3})
+                        VALUES (?, ?)''', rows)
 
 
 class QuantityTable(TableExecutor):
@@ -250,18 +929,19 @@ class QuantityTable(TableExecutor):
 
         :param table_name: name of table. Default is "quantity"
         """
-        cursor.execute(f'''CREATE TABLE IF NOT EXISTS {table_name}(
-                       {self.col_1} INTEGER PRIMARY KEY,
-                       {self.col_2} INTEGER NOT NULL,
-                       {self.col_3} INTEGER NOT NULL,
-                       {self.col_4} INTEGER NOT NULL,
-                       {self.col_5} INTEGER NOT NULL,
-                        CONSTRAINT fk_measures FOREIGN KEY ({self.col_2})
-                        REFERENCES measures ({self.col_2}),
-                        CONSTRAINT fk_ingredients FOREIGN KEY ({self.col_3})
-                        REFERENCES ingredients ({self.col_3}),
-                        CONSTRAINT fk_recipes FOREIGN KEY ({self.col_5})
-                        REFERENCES recipes ({self.col_5}))''')
+        with self.repository.writing() as cursor_:
+            cursor_.execute(f'''CREATE TABLE IF NOT EXISTS {table_name}(
+                           {self.col_1} INTEGER PRIMARY KEY,
+                           {self.col_2} INTEGER NOT NULL,
+                           {self.col_3} INTEGER NOT NULL,
+                           {self.col_4} INTEGER NOT NULL,
+                           {self.col_5} INTEGER NOT NULL,
+                            CONSTRAINT fk_measures FOREIGN KEY ({self.col_2})
+                            REFERENCES measures ({self.col_2}),
+                            CONSTRAINT fk_ingredients FOREIGN KEY ({self.col_3})
+                            REFERENCES ingredients ({self.col_3}),
+                            CONSTRAINT fk_recipes FOREIGN KEY ({self.col_5})
+                            REFERENCES recipes ({self.col_5}))''')
 
     def insert_and_commit(self, measure_id: int, ingredient_id: int, quantity_: int, recipe_id: int) -> None:
         """
@@ -272,9 +952,19 @@ class QuantityTable(TableExecutor):
         :param quantity_: count of corresponding ingredient
         :param recipe_id: id of object in @RecipesTable
         """
-        cursor.execute(f'''INSERT INTO {self.table_name} ({self.col_2}, {self.col_3}, {self.col_4}, {self.col_5})
-                        VALUES (?, ?, ?, ?);''', (measure_id, ingredient_id, quantity_, recipe_id))
-        connect.commit()
+        with self.repository.writing() as cursor_:
+            cursor_.execute(f'''INSERT INTO {self.table_name} ({self.col_2}, {self.col_3}, {self.col_4}, {self.col_5})
+                            VALUES (?, ?, ?, ?);''', (measure_id, ingredient_id, quantity_, recipe_id))
+
+    def insert_many(self, rows: Iterable[Tuple[int, int, int, int]], cursor_: sqlite3.Cursor) -> None:
+        """
+        Insert batch of values by ids of related objects. Commit is left to the caller
+
+        :param rows: tuples of (measure_id, ingredient_id, quantity, recipe_id)
+        :param cursor_: cursor of caller's transaction
+        """
+        cursor_.executemany(f'''INSERT INTO {self.table_name} ({self.col_2}, {self.col_3}, {self.col_4}, {self.col_5})
+                        VALUES (?, ?, ?, ?);''', rows)
 
     def process_input(self, recipe_id: int) -> None:
         """
@@ -291,22 +981,22 @@ class QuantityTable(TableExecutor):
             if len(list_of_input) == 2:
                 measure = ''
                 ingredient = list_of_input[1]
-                like_ingredients = get_like_expr(ingredient, 'ingredients', 'ingredient_name')
+                like_ingredients = self.lookup_cache.like('ingredients', ingredient)
                 if len(like_ingredients) > 1:
                     print('The ingredient is not conclusive!')
                     continue
                 else:
-                    measure_id = get_exactly_expr('measures', measure, 'measure_name')
+                    measure_id = self.lookup_cache.exact('measures', measure)
                     self.insert_and_commit(int(measure_id[0][0]), int(like_ingredients[0][0]),
                                            quantity_, recipe_id)
             elif len(list_of_input) == 3:
                 measure = list_of_input[1]
-                like_measure = get_like_expr(measure, 'measures', 'measure_name')
+                like_measure = self.lookup_cache.like('measures', measure)
                 if len(like_measure) > 1:
                     print('The measure is not conclusive!')
                     continue
                 ingredient = list_of_input[2]
-                like_ingredients = get_like_expr(ingredient, 'ingredients', 'ingredient_name')
+                like_ingredients = self.lookup_cache.like('ingredients', ingredient)
                 if len(like_ingredients) == 2:
                     print('The ingredient is not conclusive!')
                     continue
@@ -314,37 +1004,237 @@ class QuantityTable(TableExecutor):
                                        quantity_, recipe_id)
 
 
+class BulkImporter:
+    """
+    Import recipes from JSON Lines or CSV file by batches. Every batch of recipes,
+    their serve links and quantities is written by executemany in one transaction
+
+    JSON Lines record: {"name": "Milkshake", "description": "Blend all", "meals": ["breakfast"],
+                        "ingredients": ["500 ml milk", {"quantity": 1, "measure": "cup", "ingredient": "strawberry"}]}
+    CSV columns: name, description, meals separated by commas, ingredients separated by semicolons
+    Ingredient line has the same format as in @QuantityTable.process_input: quantity [measure] ingredient
+    """
+
+    pragmas = ('''PRAGMA journal_mode = WAL;''',
+               '''PRAGMA synchronous = NORMAL;''',
+               '''PRAGMA temp_store = MEMORY;''',
+               '''PRAGMA cache_size = -65536;''')
+
+    def __init__(self, recipes_table: RecipesTable, serves_table: ServeTable, quantity_table: QuantityTable,
+                 batch_size: int = 1000):
+        """
+        :param recipes_table: object of @RecipesTable, import writes by writer of its repository
+        :param serves_table: object of @ServeTable
+        :param quantity_table: object of @QuantityTable
+        :param batch_size: number of recipes written in one transaction
+        """
+
+        self.recipes_table = recipes_table
+        self.serves_table = serves_table
+        self.quantity_table = quantity_table
+        self.batch_size = batch_size
+        self.repository = recipes_table.repository
+        self.lookup_cache = self.repository.lookup_cache
+
+    def tune(self) -> None:
+        """
+        Switch database to WAL journal and relaxed fsync, suited for bulk writes
+        """
+
+        with self.repository.writing() as cursor_:
+            for pragma in self.pragmas:
+                cursor_.execute(pragma)
+
+    @staticmethod
+    def read_records(path: str) -> Iterator[Dict[str, Any]]:
+        """
+        Read recipes one by one from file. Format is chosen by extension: .csv or JSON Lines otherwise
+
+        :param path: path to file
+        :Return iterator over records with keys name, description, meals, ingredients
+        """
+
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            if path.lower().endswith('.csv'):
+                for row in csv.DictReader(f):
+                    yield {'name': row['name'], 'description': row.get('description', ''),
+                           'meals': [item.strip() for item in row['meals'].split(',') if item.strip()],
+                           'ingredients': [item.strip() for item in row['ingredients'].split(';') if item.strip()]}
+            else:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    @staticmethod
+    def parse_ingredient(item: Union[str, Dict[str, Any]]) -> Tuple[int, str, str]:
+        """
+        Parse ingredient of record
+
+        :param item: line "quantity [measure] ingredient" or dict with the same keys
+        :Return tuple of (quantity, measure name, ingredient name)
+        """
+
+        if isinstance(item, dict):
+            if not isinstance(item['ingredient'], str) or not item['ingredient']:
+                raise ValueError(f'Wrong ingredient: {item}')
+            return int(item['quantity']), item.get('measure', ''), item['ingredient']
+        parts = item.split()
+        if len(parts) == 2:
+            return int(parts[0]), '', parts[1]
+        if len(parts) == 3:
+            return int(parts[0]), parts[1], parts[2]
+        raise ValueError(f'Wrong ingredient line: {item}')
+
+    @staticmethod
+    def parse_recipe(record: Dict[str, Any]) -> Tuple[str, str]:
+        """
+        Validate name and description of record
+
+        :param record: record of recipe
+        :Return tuple of (name, description), description is empty if it is missing
+        """
+
+        name, description = record['name'], record.get('description')
+        if not isinstance(name, str) or not name:
+            raise ValueError(f'Wrong recipe name: {name!r}')
+        if description is None:
+            description = ''
+        if not isinstance(description, str):
+            raise ValueError(f'Wrong recipe description: {description!r}')
+        return name, description
+
+    def import_file(self, path: str) -> Dict[str, float]:
+        """
+        Import all recipes of file, look @import_records
+
+        :param path: path to JSON Lines or CSV file
+        :Return report of @import_records
+        """
+
+        return self.import_records(self.read_records(path))
+
+    def import_records(self, records: Iterable[Dict[str, Any]]) -> Dict[str, float]:
+        """
+        Import recipes by batches. Records with unknown meal or measure are rejected,
+        unknown ingredients are added to @ingredients
+
+        :param records: records in format of JSON Lines file, look @read_records
+        :Return report with numbers of inserted rows, rejected records, time and rows per second
+        """
+
+        self.tune()
+        names = {table: self.lookup_cache.id_by_name(table) for table in self.lookup_cache.tables}
+        report = {'recipes': 0, 'serve': 0, 'quantity': 0, 'rejected': 0}
+        start = time.perf_counter()
+        records = iter(records)
+        batch = list(islice(records, self.batch_size))
+        while batch:
+            for key, value in self.write_batch(batch, names).items():
+                report[key] += value
+            batch = list(islice(records, self.batch_size))
+        report['seconds'] = time.perf_counter() - start
+        rows = report['recipes'] + report['serve'] + report['quantity']
+        report['rows_per_second'] = rows / report['seconds'] if report['seconds'] else 0.0
+        return report
+
+    def write_batch(self, batch: List[Dict[str, Any]], names: Dict[str, Dict[str, int]]) -> Dict[str, int]:
+        """
+        Write batch of records in one transaction. Ids of recipes are given explicitly
+        from the current maximum, which is safe while the write transaction is held
+
+        :param batch: records of recipes
+        :param names: id_by_name of meals, measures and ingredients. New ingredients are added to it
+                      once the batch is committed
+        :Return numbers of inserted rows and rejected records
+        """
+
+        new_ingredients: Dict[str, int] = {}
+        try:
+            with self.repository.writing() as cursor_:
+                cursor_.execute('''BEGIN IMMEDIATE;''')
+                next_id = cursor_.execute('''SELECT COALESCE(MAX(recipe_id), 0) + 1 FROM recipes''').fetchone()[0]
+                recipe_rows, serve_rows, quantity_rows = [], [], []
+                rejected = 0
+                for record in batch:
+                    try:
+                        name, description = self.parse_recipe(record)
+                        meal_ids = [names['meals'][meal] for meal in record['meals']]
+                        parsed = [self.parse_ingredient(item) for item in record['ingredients']]
+                        measure_ids = [names['measures'][measure] for _, measure, _ in parsed]
+                    except (KeyError, ValueError, TypeError, AttributeError) as error:
+                        name = record.get('name') if isinstance(record, dict) else None
+                        print(f'Recipe {name!r} is rejected: {error!r}', file=sys.stderr)
+                        rejected += 1
+                        continue
+                    ingredient_ids = []
+                    for _, _, ingredient in parsed:
+                        ingredient_id = names['ingredients'].get(ingredient) or new_ingredients.get(ingredient)
+                        if ingredient_id is None:
+                            ingredient_id = new_ingredients[ingredient] = cursor_.execute(
+                                '''INSERT INTO ingredients (ingredient_name) VALUES (?)''', (ingredient,)).lastrowid
+                        ingredient_ids.append(ingredient_id)
+                    recipe_rows.append((next_id, name, description))
+                    serve_rows.extend((next_id, meal_id) for meal_id in meal_ids)
+                    quantity_rows.extend((measure_id, ingredient_id, quantity_, next_id)
+                                         for (quantity_, _, _), measure_id, ingredient_id
+                                         in zip(parsed, measure_ids, ingredient_ids))
+                    next_id += 1
+                self.recipes_table.insert_many(recipe_rows, cursor_)
+                self.serves_table.insert_many(serve_rows, cursor_)
+                self.quantity_table.insert_many(quantity_rows, cursor_)
+            names['ingredients'].update(new_ingredients)
+        finally:
+            self.lookup_cache.invalidate('ingredients')
+        return {'recipes': len(recipe_rows), 'serve': len(serve_rows), 'quantity': len(quantity_rows),
+                'rejected': rejected}
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Provide interface to recipes book')
     parser.add_argument('data_base', help='Relative path to db file', type=str)
     parser.add_argument('--ingredients', '-i', required=False, help='List of ingredients')
     parser.add_argument('--meals', '-m', required=False, help='List of meals')
+    parser.add_argument('--import', dest='import_file', required=False,
+                        help='Bulk import recipes from JSON Lines or CSV file')
+    parser.add_argument('--search', '-s', required=False,
+                        help='Search recipes by words of name and description, can be combined with filters')
+    parser.add_argument('--bitmap', action='store_true',
+                        help='Answer --meals/--ingredients by in-process bitmap index instead of SQL')
+    parser.add_argument('--missing', type=int, default=0,
+                        help='Recipe may lack this number of --ingredients, answered by bitmap index')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Number of recipes per transaction of import')
     if len(sys.argv) < 1:
         print('Error argument db name')
     args = parser.parse_args()
     database_name = args.data_base
     ingredients = args.ingredients.split(',') if args.ingredients else None
     meals = args.meals.split(',') if args.meals else None
-    connect = sqlite3.connect(database_name)
-    cursor = connect.cursor()
-    cursor.execute('''PRAGMA foreign_keys = ON;''')
-    connect.commit()
-    executor = TableExecutor()
-    list_of_tables = ['meals', 'ingredients', 'measures']
-    for table in list_of_tables:
-        executor.create_table(table)
-    recipes = RecipesTable()
-    recipes.create_table()
-    serves = ServeTable()
-    serves.create_table()
-    quantity = QuantityTable()
-    quantity.create_table()
-    if not (ingredients and meals):
-        recipes.process_input(serves, quantity)
+    repository = RecipeRepository(database_name)
+    repository.create_schema()
+    if args.import_file:
+        report = repository.import_file(args.import_file, args.batch_size)
+        print(f'Imported {report["recipes"]} recipes, {report["serve"]} serve links, '
+              f'{report["quantity"]} quantities, rejected {report["rejected"]} '
+              f'in {report["seconds"]:.2f}s ({report["rows_per_second"]:.0f} rows/s)')
+    elif args.search:
+        res = repository.search_recipes(args.search, meals, ingredients)
+        if res:
+            print(f'Recipes found for you: {", ".join(name for _, name in res)}')
+        else:
+            print('There are no such recipes in the database.')
+    elif ingredients and (args.bitmap or args.missing):
+        with repository.reading() as reader:
+            res = BitmapIndex().query(reader, meals, ingredients, args.missing)
+        if res:
+            print(f'Recipes selected for you: {", ".join(res)}')
+        else:
+            print('There are no such recipes in the database.')
+    elif not (ingredients and meals):
+        RecipesTable(repository).process_input(ServeTable(repository), QuantityTable(repository))
     else:
-        res = get_recipe_by_meal_and_ingredient(meals, ingredients)
+        res = repository.get_recipe_by_meal_and_ingredient(meals, ingredients)
         if res:
             print(f'Recipes selected for you: {", ".join(res[i][0] for i in range(len(res)))}')
         else:
             print('There are no such recipes in the database.')
-    connect.close()
+    repository.close()
@@ -0,0 +1,245 @@
+from collections import defaultdict, Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Match, Optional, Tuple
+import argparse
+import cProfile
+import json
+import multiprocessing
+import os
+import platform
+import pstats
+import random
+import re
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from model_file import corpus_fingerprint, load_model, save_model
+from text_generator import MAX_RESTARTS, Preprocessor
+
+
+BACKENDS = ('legacy', 'trigram', 'trie')
+HOT_PATHS = ('generate_random', 'find_in_counter', 'str_endswith_punctuation', 'sample', 'find_context')
+MEGABYTE = 1 << 20
+
+
+class LegacyPreprocessor:
+    """
+    Dict of Counters keyed by "w1 w2" strings, as the model was before @TrigramModel.
+    Kept here as the baseline to compare backends with
+    """
+
+    def __init__(self, path_input: str):
+        with open(path_input, 'r', encoding='utf-8') as f:
+            tokens = f.read().split()
+        tmp_dict = defaultdict(list)
+        for val1, val2, val3 in zip(tokens, tokens[1:], tokens[2:]):
+            tmp_dict[val1 + ' ' + val2].append(val3)
+        self.data = {item: Counter(followers) for item, followers in tmp_dict.items()}
+
+    def generate_random(self, rng: random.Random) -> List[str]:
+        """
+        Generate sentence by rejection sampling of start and weighted choice of next words
+
+        :param rng: source of random numbers
+        """
+
+        for _ in range(MAX_RESTARTS):
+            while True:
+                curr_iter = rng.choice(list(self.data.keys()))
+                if not self.str_endswith_punctuation(curr_iter) and curr_iter[0].isupper():
+                    break
+            final_str = [*curr_iter.split()]
+            is_capital = False
+            while True:
+                counter = self.data.get(curr_iter)
+                if counter is None:
+                    break
+                next_iter, need_capital = self.find_in_counter(counter, is_capital, rng)
+                is_capital = need_capital
+                final_str.append(next_iter)
+                if len(final_str) >= 5 and need_capital:
+                    return final_str
+                curr_iter = curr_iter.split(' ')[1] + ' ' + next_iter
+        raise RuntimeError(f'No sentence is finished after {MAX_RESTARTS} random starts')
+
+    @staticmethod
+    def find_in_counter(counter: Counter, capital: bool, rng: random.Random) -> Tuple[str, Match]:
+        """
+        Weighted random choice with rejection of lower words if @capital.
+        Gives up on @capital if counter has no capitalized words
+        """
+
+        keys, weights = list(counter.keys()), list(counter.values())
+        if capital and not any(key[0].isupper() for key in keys):
+            capital = False
+        while True:
+            return_value = rng.choices(keys, weights)[0]
+            if not capital or return_value[0].isupper():
+                return return_value, LegacyPreprocessor.str_endswith_punctuation(return_value)
+
+    @staticmethod
+    def str_endswith_punctuation(word: str) -> Match:
+        return re.match(r".+[.?!]", word)
+
+
+def make_synthetic_corpus(path: str, size: int, seed: int = 0, vocab_size: int = 50000) -> None:
+    """
+    Write corpus of random sentences over Zipf-distributed vocabulary of made up words
+
+    :param path: destination path
+    :param size: approximate size of corpus in bytes
+    :param seed: seed of random generator
+    :param vocab_size: number of distinct words before capitalization and punctuation
+    """
+
+    rng = random.Random(seed)
+    letters = 'etaoinshrdlcumwfgypbvkjxqz'
+    vocab = [''.join(rng.choice(letters) for _ in range(rng.randint(1, 10))) for _ in range(vocab_size)]
+    cum_weights, total = [], 0.0
+    for rank in range(vocab_size):
+        total += 1 / (rank + 1)
+        cum_weights.append(total)
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        while written < size:
+            lines = []
+            for _ in range(1000):
+                words = rng.choices(vocab, cum_weights=cum_weights, k=rng.randint(3, 20))
+                words[0] = words[0].capitalize()
+                words[-1] += rng.choice('..?!')
+                lines.append(' '.join(words))
+            text = '\n'.join(lines) + '\n'
+            f.write(text)
+            written += len(text)
+
+
+def profile_summary(profiler: cProfile.Profile, top: int = 15) -> Dict[str, Any]:
+    """
+    Extract timings of @HOT_PATHS and top functions by own time from profile
+
+    :param profiler: finished profiler
+    :param top: number of functions to keep
+    """
+
+    stats = pstats.Stats(profiler).stats
+    rows = [{'function': f'{os.path.basename(file)}:{line}({name})', 'name': name, 'calls': nc,
+             'tottime': tt, 'cumtime': ct} for (file, line, name), (_, nc, tt, ct, _) in stats.items()]
+    rows.sort(key=lambda row: row['tottime'], reverse=True)
+    return {'hot_paths': [row for row in rows if row['name'] in HOT_PATHS], 'top': rows[:top]}
+
+
+def run_case(corpus: str, backend: str, order: Optional[int], workers: int, sentences: int,
+             seed: int, profile: bool, trace: bool) -> Dict[str, Any]:
+    """
+    Build model of corpus, load it and generate sentences. Runs in fresh process,
+    so peak RSS belongs to this case only
+
+    :param corpus: path to corpus
+    :param backend: one of @BACKENDS
+    :param order: order of trie backend
+    :param workers: number of processes to build trigram backend
+    :param sentences: number of sentences to generate
+    :param seed: seed of generation
+    :param profile: capture cProfile of generation
+    :param trace: capture tracemalloc of build, it slows the build down
+    :Return metrics of case
+    """
+
+    result: Dict[str, Any] = {'corpus': os.path.basename(corpus), 'corpus_bytes': os.path.getsize(corpus),
+                              'backend': backend, 'order': order if backend == 'trie' else 3,
+                              'workers': workers, 'sentences': sentences, 'traced': trace}
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    if backend == 'legacy':
+        model = LegacyPreprocessor(corpus)
+    else:
+        model = Preprocessor.build_model(corpus, workers, order if backend == 'trie' else None)
+    result['build_seconds'] = time.perf_counter() - start
+    if trace:
+        snapshot = tracemalloc.take_snapshot()
+        result['tracemalloc'] = {'peak_bytes': tracemalloc.get_traced_memory()[1],
+                                 'top': [str(stat) for stat in snapshot.statistics('lineno')[:10]]}
+        tracemalloc.stop()
+    with tempfile.TemporaryDirectory() as tmp:
+        if backend == 'legacy':
+            result['model_bytes'] = result['model_file_bytes'] = result['load_seconds'] = None
+            generator: Callable[[random.Random], List[str]] = model.generate_random
+        else:
+            model_path = os.path.join(tmp, 'model')
+            save_model(model, model_path, corpus_fingerprint(corpus))
+            result['model_bytes'] = model.nbytes
+            result['model_file_bytes'] = os.path.getsize(model_path)
+            del model
+            start = time.perf_counter()
+            loaded = load_model(model_path)
+            result['load_seconds'] = time.perf_counter() - start
+            generator = Preprocessor.from_model(loaded).generate_random
+        rng = random.Random(seed)
+        profiler = cProfile.Profile() if profile else None
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        for _ in range(sentences):
+            generator(rng)
+        if profiler:
+            profiler.disable()
+        elapsed = time.perf_counter() - start
+    result['generate_seconds'] = elapsed
+    result['sentences_per_second'] = sentences / elapsed if elapsed else None
+    if profiler:
+        result['profile'] = profile_summary(profiler)
+    result['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return result
+
+
+def run_isolated(*args) -> Dict[str, Any]:
+    """
+    Run @run_case in new spawned process
+
+    :param args: arguments of @run_case
+    """
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run_case, *args).result()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark build and generation of text_generator backends')
+    parser.add_argument('--corpus', nargs='*', default=['corpus.txt'], help='Real corpora to benchmark')
+    parser.add_argument('--synthetic', nargs='*', type=float, default=[],
+                        help='Sizes in MB of synthetic corpora to generate and benchmark')
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--orders', nargs='+', type=int, default=[3, 4], help='Orders of trie backend')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes to build trigram backend')
+    parser.add_argument('--sentences', '-n', type=int, default=2000, help='Number of sentences to generate')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of synthetic corpora and generation')
+    parser.add_argument('--profile', action='store_true', help='Capture cProfile of generation')
+    parser.add_argument('--tracemalloc', action='store_true', help='Capture tracemalloc of build')
+    parser.add_argument('--output', '-o', required=False, help='Path to JSON report, stdout if omitted')
+    args = parser.parse_args()
+
+    report = {'python': sys.version, 'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'cases': []}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpora = list(args.corpus)
+        for size in args.synthetic:
+            path = os.path.join(tmp_dir, f'synthetic_{size:g}mb.txt')
+            make_synthetic_corpus(path, int(size * MEGABYTE), args.seed)
+            corpora.append(path)
+        for corpus_path in corpora:
+            for backend_name in args.backends:
+                for trie_order in (args.orders if backend_name == 'trie' else [None]):
+                    case = run_isolated(corpus_path, backend_name, trie_order, args.workers, args.sentences,
+                                        args.seed, args.profile, args.tracemalloc)
+                    report['cases'].append(case)
+                    print(f"{case['corpus']} {backend_name} order={case['order']}: "
+                          f"build {case['build_seconds']:.2f}s, rss {case['peak_rss_bytes'] / MEGABYTE:.1f}MB, "
+                          f"{case['sentences_per_second']:.0f} sentences/s", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,99 @@
+from typing import Iterable, Iterator, List, Tuple
+import codecs
+import os
+
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = b' \t\n\r\x0b\x0c'
+
+
+def iter_chunk_tokens(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    Yield whitespace separated tokens of text given by chunks.
+    Token cut by the end of chunk is carried over and glued to the next chunk,
+    so result is equal to str.split() of the joined text
+
+    :param chunks: iterable of consecutive parts of text
+    :Return iterator over tokens
+    """
+
+    tail = ''
+    for chunk in chunks:
+        chunk = tail + chunk
+        if not chunk:
+            continue
+        tokens = chunk.split()
+        tail = tokens.pop() if tokens and not chunk[-1].isspace() else ''
+        yield from tokens
+    if tail:
+        yield tail
+
+
+def iter_file_tokens(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    Read corpus by chunks and yield whitespace separated tokens
+
+    :param path: path to corpus
+    :param chunk_size: number of characters to read at once
+    :Return iterator over tokens
+    """
+
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from iter_chunk_tokens(iter(lambda: f.read(chunk_size), ''))
+
+
+def iter_range_tokens(path: str, start: int, end: int, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    Read byte range of corpus by chunks and yield whitespace separated tokens.
+    Range is expected to be bounded by whitespace, look @shard_ranges
+
+    :param path: path to corpus
+    :param start: offset of the first byte
+    :param end: offset after the last byte
+    :param chunk_size: number of bytes to read at once
+    :Return iterator over tokens
+    """
+
+    decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def chunks() -> Iterator[str]:
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                block = f.read(min(chunk_size, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield decoder.decode(block)
+        yield decoder.decode(b'', final=True)
+
+    yield from iter_chunk_tokens(chunks())
+
+
+def shard_ranges(path: str, n_shards: int) -> List[Tuple[int, int]]:
+    """
+    Split file into byte ranges of about equal size. Every inner boundary is moved forward
+    to the nearest ASCII whitespace, which can not be a part of multibyte character or token
+
+    :param path: path to corpus
+    :param n_shards: desired number of ranges
+    :Return list of (start, end) pairs covering the whole file, empty ranges are dropped
+    """
+
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, n_shards):
+            position = max(size * i // n_shards, bounds[-1])
+            f.seek(position)
+            while position < size:
+                block = f.read(4096)
+                found = [block.find(char) for char in WHITESPACE if char in block]
+                if found:
+                    position += min(found)
+                    break
+                position += len(block)
+            bounds.append(min(position, size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
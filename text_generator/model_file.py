@@ -0,0 +1,190 @@
+from array import array
+from typing import Callable, List, NamedTuple, Optional, Tuple, Union
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+from ngram_model import TrigramModel, Vocabulary
+from ngram_trie import NGramTrie
+
+
+MAGIC = b'TRIGRAM\0'
+VERSION = 2
+MODEL_SUFFIX = '.trigram'
+# magic, version, byte order, corpus size, corpus mtime in ns, sha256 of corpus,
+# order of trie (0 for @TrigramModel), number of sections
+HEADER = struct.Struct('<8sIcQq32sII')
+# name, typecode, offset of data in file, number of items
+SECTION = struct.Struct('<16scQQ')
+ALIGNMENT = 8
+
+Model = Union[TrigramModel, NGramTrie]
+
+
+class Fingerprint(NamedTuple):
+    """Identity of source corpus: size, modification time in ns and sha256 digest"""
+
+    size: int
+    mtime_ns: int
+    digest: bytes
+
+
+def default_model_path(corpus_path: str, order: Optional[int] = None) -> str:
+    """
+    Get path of model file stored next to corpus
+
+    :param corpus_path: path to text corpus
+    :param order: order of @NGramTrie, None for @TrigramModel
+    :Return path with @MODEL_SUFFIX or .<order>gram appended
+    """
+
+    return corpus_path + (MODEL_SUFFIX if order is None else f'.{order}gram')
+
+
+def file_digest(path: str) -> bytes:
+    """
+    Compute sha256 of file reading it by blocks
+
+    :param path: path to file
+    :Return raw digest
+    """
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+def corpus_fingerprint(path: str) -> Fingerprint:
+    """
+    Fingerprint of corpus to check if a model built from it is stale
+
+    :param path: path to corpus
+    """
+
+    stat = os.stat(path)
+    return Fingerprint(stat.st_size, stat.st_mtime_ns, file_digest(path))
+
+
+def save_model(model: Model, path: str, fingerprint: Fingerprint) -> None:
+    """
+    Serialize model into versioned binary file. Sections of arrays are aligned to 8 bytes
+    and written in native byte order, so they can be memory-mapped without copying.
+    File is written to temporary path and then atomically replaced
+
+    :param model: model to save
+    :param path: destination path
+    :param fingerprint: fingerprint of corpus the model was built from
+    """
+
+    vocab = '\n'.join(model.vocab.words).encode('utf-8')
+    sections: List[Tuple[str, str, bytes, int]] = [('vocab', 'B', vocab, len(vocab))]
+    for name, values in model.sections().items():
+        sections.append((name, values.format if isinstance(values, memoryview) else values.typecode,
+                         bytes(values), len(values)))
+    offset = HEADER.size + SECTION.size * len(sections)
+    table = []
+    for name, typecode, data, length in sections:
+        offset += -offset % ALIGNMENT
+        table.append(SECTION.pack(name.encode('ascii'), typecode.encode('ascii'), offset, length))
+        offset += len(data)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, sys.byteorder[0].encode('ascii'), fingerprint.size,
+                            fingerprint.mtime_ns, fingerprint.digest,
+                            model.order if isinstance(model, NGramTrie) else 0, len(sections)))
+        f.write(b''.join(table))
+        for _, _, data, _ in sections:
+            f.write(b'\0' * (-f.tell() % ALIGNMENT))
+            f.write(data)
+    os.replace(tmp_path, path)
+
+
+def read_header(path: str) -> Optional[Tuple[Fingerprint, int]]:
+    """
+    Read fingerprint of corpus and order of model stored in model file
+
+    :param path: path to model file
+    :Return None if file is missing, is not a model or has other version or byte order
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+    except OSError:
+        return None
+    if len(header) < HEADER.size:
+        return None
+    magic, version, byteorder, size, mtime_ns, digest, order, _ = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION or byteorder != sys.byteorder[0].encode('ascii'):
+        return None
+    return Fingerprint(size, mtime_ns, digest), order
+
+
+def load_model(path: str) -> Model:
+    """
+    Memory-map model file. Arrays of model are read-only views of the mapped pages,
+    so loading does not depend on model size and processes share the same pages
+
+    :param path: path to model file
+    :Return model backed by the file
+    """
+
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(buffer)
+    order, n_sections = HEADER.unpack_from(buffer)[-2:]
+    sections = {}
+    for i in range(n_sections):
+        name, typecode, offset, length = SECTION.unpack_from(buffer, HEADER.size + i * SECTION.size)
+        typecode = typecode.decode('ascii')
+        size = length * array(typecode).itemsize
+        sections[name.rstrip(b'\0').decode('ascii')] = view[offset:offset + size].cast(typecode)
+    vocab = Vocabulary()
+    for word in bytes(sections.pop('vocab')).decode('utf-8').split('\n'):
+        if word:
+            vocab.intern(word)
+    if order:
+        return NGramTrie.from_sections(vocab, order, sections, buffer)
+    return TrigramModel.from_sections(vocab, sections, buffer)
+
+
+def is_fresh(model_path: str, corpus_path: str, order: Optional[int] = None) -> bool:
+    """
+    Check if model file has expected order and was built from the current state of corpus.
+    Equal size and mtime are trusted, otherwise sha256 of corpus is compared
+
+    :param model_path: path to model file
+    :param corpus_path: path to corpus
+    :param order: order of @NGramTrie, None for @TrigramModel
+    """
+
+    header = read_header(model_path)
+    if header is None or header[1] != (order or 0):
+        return False
+    stored = header[0]
+    stat = os.stat(corpus_path)
+    if stored.size != stat.st_size:
+        return False
+    return stored.mtime_ns == stat.st_mtime_ns or stored.digest == file_digest(corpus_path)
+
+
+def load_or_build(corpus_path: str, model_path: str, build: Callable[[str], Model],
+                  order: Optional[int] = None) -> Model:
+    """
+    Load model from file, rebuild and save it first if it is missing or stale
+
+    :param corpus_path: path to corpus
+    :param model_path: path to model file
+    :param build: function to train model from corpus path
+    :param order: order of @NGramTrie built by @build, None for @TrigramModel
+    :Return memory-mapped model
+    """
+
+    if not is_fresh(model_path, corpus_path, order):
+        fingerprint = corpus_fingerprint(corpus_path)
+        save_model(build(corpus_path), model_path, fingerprint)
+    return load_model(model_path)
@@ -0,0 +1,522 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from heapq import merge as merge_sorted
+from mmap import mmap
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import random
+import re
+
+
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+PUNCTUATION_RE = re.compile(r".+[.?!]")
+
+
+def pack_prefix(first_id: int, second_id: int) -> int:
+    """
+    Pack ids of two words into single integer key of a bigram prefix
+
+    :param first_id: id of the first word of prefix
+    :param second_id: id of the second word of prefix
+    :Return 64-bit key, sortable in (first_id, second_id) order
+    """
+
+    return first_id << ID_BITS | second_id
+
+
+def unpack_prefix(key: int) -> Tuple[int, int]:
+    """
+    Split key of bigram prefix back into word ids
+
+    :param key: key built by @pack_prefix
+    :Return pair of word ids
+    """
+
+    return key >> ID_BITS, key & ID_MASK
+
+
+def is_sentence_start(*words: str) -> bool:
+    """
+    Check if prefix of words can start a sentence:
+    first word starts with capital letter and prefix does not end with punctuation
+
+    :param words: words of prefix
+    """
+
+    return words[0][0].isupper() and not PUNCTUATION_RE.match(' '.join(words))
+
+
+class Vocabulary:
+    """Interning table of words. Ids are given in order of first occurrence"""
+
+    def __init__(self):
+        self.words: List[str] = []
+        self.ids: Dict[str, int] = {}
+
+    def intern(self, word: str) -> int:
+        """
+        Get id of @word, add it to vocabulary if it is new
+
+        :param word: token to intern
+        :Return integer id of word
+        """
+
+        word_id = self.ids.get(word)
+        if word_id is None:
+            word_id = len(self.words)
+            self.ids[word] = word_id
+            self.words.append(word)
+        return word_id
+
+    def get(self, word: str) -> Optional[int]:
+        """
+        Get id of @word without adding it
+
+        :param word: token to search
+        :Return id of word or None if word is unknown
+        """
+
+        return self.ids.get(word)
+
+    def __getitem__(self, word_id: int) -> str:
+        return self.words[word_id]
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+
+def append_group(group: List[Tuple[bool, int, int]], followers: array, cumulative: array) -> int:
+    """
+    Append followers of one prefix, capitalized words first, with running sums of counts
+
+    :param group: list of (is_lower, follower_id, count) for one prefix
+    :param followers: array of follower ids to extend
+    :param cumulative: array of running sums to extend
+    :Return end of capitalized part of the appended range
+    """
+
+    group.sort()
+    total = 0
+    capital_end = len(followers)
+    for is_lower, follower, count in group:
+        total += count
+        followers.append(follower)
+        cumulative.append(total)
+        if not is_lower:
+            capital_end = len(followers)
+    return capital_end
+
+
+class TrigramModel:
+    """
+    Trigram model stored in flat arrays.
+    Updates are kept in delta of rebuilt tables of touched prefixes until @compact
+
+    Contains: vocab - interned words
+              prefix_keys - sorted packed keys of bigram prefixes, look @pack_prefix
+              offsets - range of followers of i-th prefix is offsets[i]:offsets[i + 1]
+              capital_ends - followers starting with capital letter go first,
+                             i-th prefix has them in offsets[i]:capital_ends[i]
+              followers - ids of words following the prefixes, sorted by id inside
+                          the capital and the lower part of the range
+              cumulative - running sum of trigram counts inside the range of prefix,
+                           used as sampling table for weighted random choice
+              start_keys - packed keys of prefixes which can start a sentence,
+                           look @is_sentence_start
+              buffer - memory-mapped file the arrays are views of, None for model built in memory
+              delta_keys - keys of prefixes updated after build, their index in model is
+                           len(prefix_keys) + position in this list
+              delta_tables - (followers, cumulative, capital_end) of the updated prefixes,
+                             they shadow the ranges of arrays
+              delta_index - position_by_key of @delta_keys
+              extra_start_keys - keys of new prefixes which can start a sentence
+    """
+
+    def __init__(self, vocab: Vocabulary, prefix_keys: array, offsets: array,
+                 capital_ends: array, followers: array, cumulative: array, start_keys: array,
+                 buffer: Optional[mmap] = None):
+        self.vocab = vocab
+        self.prefix_keys = prefix_keys
+        self.offsets = offsets
+        self.capital_ends = capital_ends
+        self.followers = followers
+        self.cumulative = cumulative
+        self.start_keys = start_keys
+        self.buffer = buffer
+        self.reset_delta()
+
+    def reset_delta(self) -> None:
+        """Forget updates kept in delta"""
+
+        self.delta_keys: List[int] = []
+        self.delta_tables: List[Tuple[array, array, int]] = []
+        self.delta_index: Dict[int, int] = {}
+        self.extra_start_keys: List[int] = []
+        self.n_new_prefixes = 0
+
+    def __len__(self) -> int:
+        return len(self.prefix_keys) + self.n_new_prefixes
+
+    @property
+    def dirty(self) -> bool:
+        """Model has updates which are not merged into arrays"""
+
+        return bool(self.delta_keys)
+
+    def sections(self) -> Dict[str, array]:
+        """
+        Arrays of model by names, used to save model, look @model_file
+        """
+
+        return {name: getattr(self, name) for name in ('prefix_keys', 'offsets', 'capital_ends',
+                                                       'followers', 'cumulative', 'start_keys')}
+
+    @classmethod
+    def from_sections(cls, vocab: Vocabulary, sections: Dict[str, array],
+                      buffer: Optional[mmap] = None) -> 'TrigramModel':
+        """
+        Create model of arrays saved by @sections
+
+        :param vocab: interned words
+        :param sections: arrays by names
+        :param buffer: memory-mapped file the arrays are views of
+        """
+
+        return cls(vocab, sections['prefix_keys'], sections['offsets'], sections['capital_ends'],
+                   sections['followers'], sections['cumulative'], sections['start_keys'], buffer)
+
+    def __contains__(self, prefix: str) -> bool:
+        return self.find_prefix(prefix) is not None
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the transition arrays in bytes"""
+
+        return sum(item.itemsize * len(item)
+                   for item in (self.prefix_keys, self.offsets, self.capital_ends,
+                                self.followers, self.cumulative, self.start_keys,
+                                *(table for followers, cumulative, _ in self.delta_tables
+                                  for table in (followers, cumulative))))
+
+    def _find_base(self, key: int) -> Optional[int]:
+        """
+        Binary search of prefix key in arrays
+
+        :param key: packed key of prefix
+        :Return index in @prefix_keys or None
+        """
+
+        index = bisect_left(self.prefix_keys, key)
+        if index < len(self.prefix_keys) and self.prefix_keys[index] == key:
+            return index
+        return None
+
+    def find_prefix_ids(self, first_id: int, second_id: int) -> Optional[int]:
+        """
+        Search of prefix by ids of its words, updated prefixes are checked first
+
+        :param first_id: id of the first word
+        :param second_id: id of the second word
+        :Return index of prefix in model or None if it has no followers
+        """
+
+        key = pack_prefix(first_id, second_id)
+        if self.delta_index:
+            position = self.delta_index.get(key)
+            if position is not None:
+                return len(self.prefix_keys) + position
+        return self._find_base(key)
+
+    def find_context(self, history: Sequence[int]) -> Optional[int]:
+        """
+        Search of prefix by the last two words of history
+
+        :param history: ids of generated words
+        :Return index of prefix in model or None if it has no followers
+        """
+
+        return self.find_prefix_ids(history[-2], history[-1])
+
+    def find_prefix(self, prefix: str) -> Optional[int]:
+        """
+        Search of prefix by its text
+
+        :param prefix: two words separated by space
+        :Return index of prefix in model or None if it is unknown
+        """
+
+        words = prefix.split(' ')
+        if len(words) != 2:
+            return None
+        first_id, second_id = self.vocab.get(words[0]), self.vocab.get(words[1])
+        if first_id is None or second_id is None:
+            return None
+        return self.find_prefix_ids(first_id, second_id)
+
+    def _key_at(self, index: int) -> int:
+        """Packed key of prefix stored at @index"""
+
+        if index < len(self.prefix_keys):
+            return self.prefix_keys[index]
+        return self.delta_keys[index - len(self.prefix_keys)]
+
+    def _table_at(self, index: int) -> Tuple[array, array, int, int, int]:
+        """
+        Sampling table of prefix stored at @index
+
+        :param index: index of prefix in model
+        :Return followers, cumulative, start and end of range, end of capitalized part
+        """
+
+        if index < len(self.prefix_keys):
+            return (self.followers, self.cumulative, self.offsets[index], self.offsets[index + 1],
+                    self.capital_ends[index])
+        followers, cumulative, capital_end = self.delta_tables[index - len(self.prefix_keys)]
+        return followers, cumulative, 0, len(followers), capital_end
+
+    def prefix_at(self, index: int) -> str:
+        """
+        Text of prefix stored at @index
+
+        :param index: index of prefix in model
+        :Return two words separated by space
+        """
+
+        first_id, second_id = unpack_prefix(self._key_at(index))
+        return self.vocab[first_id] + ' ' + self.vocab[second_id]
+
+    def prefixes(self) -> Iterator[str]:
+        """Iterate over texts of all prefixes, prefixes added by updates go last"""
+
+        for index in range(len(self.prefix_keys)):
+            yield self.prefix_at(index)
+        for position, key in enumerate(self.delta_keys):
+            if self._find_base(key) is None:
+                yield self.prefix_at(len(self.prefix_keys) + position)
+
+    def follower_counts(self, index: int) -> Iterator[Tuple[int, int]]:
+        """
+        Iterate over followers of prefix stored at @index
+
+        :param index: index of prefix in model
+        :Return iterator over pairs of follower id and count of trigram
+        """
+
+        followers, cumulative, start, end, _ = self._table_at(index)
+        previous = 0
+        for i in range(start, end):
+            yield followers[i], cumulative[i] - previous
+            previous = cumulative[i]
+
+    def followers_counter(self, index: int) -> Counter:
+        """
+        Build Counter of followers of prefix stored at @index
+
+        :param index: index of prefix in model
+        :Return Counter count_by_word
+        """
+
+        return Counter({self.vocab[follower]: count for follower, count in self.follower_counts(index)})
+
+    def sample(self, index: int, capital: bool = False, rng: random.Random = random) -> int:
+        """
+        Weighted random choice of follower by binary search in cumulative counts
+
+        :param index: index of prefix in model
+        :param capital: choose only between followers starting with capital letter.
+                        Falls back to all followers if prefix has no such words
+        :param rng: source of random numbers
+        :Return id of chosen word
+        """
+
+        followers, cumulative, start, end, capital_end = self._table_at(index)
+        if capital and capital_end > start:
+            end = capital_end
+        position = bisect_right(cumulative, rng.randrange(cumulative[end - 1]), start, end)
+        return followers[position]
+
+    def random_start(self, rng: random.Random = random) -> Tuple[int, int]:
+        """
+        Uniform random choice of prefix from index of sentence starts
+
+        :param rng: source of random numbers
+        :Return ids of two words of prefix
+        """
+
+        n_base = len(self.start_keys)
+        n_starts = n_base + len(self.extra_start_keys)
+        if not n_starts:
+            raise ValueError('Model has no prefix to start a sentence')
+        position = rng.randrange(n_starts)
+        if position < n_base:
+            return unpack_prefix(self.start_keys[position])
+        return unpack_prefix(self.extra_start_keys[position - n_base])
+
+    def add_counts(self, counts: Counter) -> None:
+        """
+        Add counts of new trigrams in place. Only tables of prefixes found in @counts are rebuilt
+        and stored in delta, so cost depends on new text and not on size of model
+
+        :param counts: count_by_trigram in ids of @vocab, look @TrigramBuilder
+        """
+
+        groups: Dict[int, Counter] = {}
+        for key, count in counts.items():
+            groups.setdefault(key >> ID_BITS, Counter())[key & ID_MASK] += count
+        words = self.vocab.words
+        for prefix, group in groups.items():
+            index = self.find_prefix_ids(*unpack_prefix(prefix))
+            if index is not None:
+                group.update(dict(self.follower_counts(index)))
+            followers, cumulative = array('I'), array('Q')
+            capital_end = append_group([(not words[follower][0].isupper(), follower, count)
+                                        for follower, count in group.items()], followers, cumulative)
+            table = (followers, cumulative, capital_end)
+            if index is not None and index >= len(self.prefix_keys):
+                self.delta_tables[index - len(self.prefix_keys)] = table
+                continue
+            self.delta_index[prefix] = len(self.delta_keys)
+            self.delta_keys.append(prefix)
+            self.delta_tables.append(table)
+            if index is None:
+                self.n_new_prefixes += 1
+                first, second = unpack_prefix(prefix)
+                if is_sentence_start(words[first], words[second]):
+                    self.extra_start_keys.append(prefix)
+
+    def compact(self) -> None:
+        """Merge delta of updates into flat arrays. Arrays are copied into memory"""
+
+        if not self.delta_keys:
+            return
+        prefix_keys, offsets, capital_ends = array('Q'), array('I', [0]), array('I')
+        followers, cumulative = array('I'), array('Q')
+        n_base = len(self.prefix_keys)
+        delta_order = sorted(range(len(self.delta_keys)), key=self.delta_keys.__getitem__)
+        indexes = (n_base + position for position in delta_order)
+        base_indexes = (index for index in range(n_base) if self.prefix_keys[index] not in self.delta_index)
+        for index in merge_sorted(base_indexes, indexes, key=self._key_at):
+            prefix_keys.append(self._key_at(index))
+            table_followers, table_cumulative, start, end, capital_end = self._table_at(index)
+            capital_ends.append(len(followers) + capital_end - start)
+            followers.extend(table_followers[start:end])
+            cumulative.extend(table_cumulative[start:end])
+            offsets.append(len(followers))
+        self.start_keys = array('Q', sorted([*self.start_keys, *self.extra_start_keys]))
+        self.prefix_keys, self.offsets, self.capital_ends = prefix_keys, offsets, capital_ends
+        self.followers, self.cumulative = followers, cumulative
+        self.buffer = None
+        self.reset_delta()
+
+    def __getitem__(self, prefix: str) -> Counter:
+        index = self.find_prefix(prefix)
+        if index is None:
+            raise KeyError(prefix)
+        return self.followers_counter(index)
+
+
+class TrigramBuilder:
+    """
+    Accumulate counts of trigrams and freeze them into @TrigramModel
+
+    Contains: vocab - interned words
+              counts - count_by_trigram, trigram is packed as prefix key << 32 | follower id
+              window - ids of the last two tokens passed to @add_tokens
+    """
+
+    def __init__(self, vocab: Optional[Vocabulary] = None):
+        self.vocab = vocab if vocab is not None else Vocabulary()
+        self.counts: Counter = Counter()
+        self.window: Tuple[Optional[int], Optional[int]] = (None, None)
+
+    def add_tokens(self, tokens: Iterable[str]) -> None:
+        """
+        Count trigrams of token stream by sliding window of the last two tokens.
+        Window is kept between calls, so stream can be passed by parts
+
+        :param tokens: iterable of tokens, e.g. @corpus_reader.iter_file_tokens
+        """
+
+        intern = self.vocab.intern
+        counts = self.counts
+        first, second = self.window
+        for token in tokens:
+            third = intern(token)
+            if first is not None:
+                counts[(first << ID_BITS | second) << ID_BITS | third] += 1
+            first, second = second, third
+        self.window = (first, second)
+
+    def merge(self, words: List[str], counts: Counter, head: List[int], tail: List[int]) -> None:
+        """
+        Merge counts of the next part of text, counted by other builder, e.g. in other process.
+        Local ids are remapped, so merging parts in order gives the same ids as one stream.
+        Trigrams crossing the boundary between current window and the part are counted here
+
+        :param words: vocabulary of the part, ordered by id
+        :param counts: count_by_trigram of the part in its local ids
+        :param head: local ids of the first two tokens of the part
+        :param tail: local ids of the last two tokens of the part
+        """
+
+        mapping = [self.vocab.intern(word) for word in words]
+        own = self.counts
+        for key, count in counts.items():
+            first, second, third = key >> 2 * ID_BITS, key >> ID_BITS & ID_MASK, key & ID_MASK
+            own[(mapping[first] << ID_BITS | mapping[second]) << ID_BITS | mapping[third]] += count
+        window = [word_id for word_id in self.window if word_id is not None]
+        sequence = window + [mapping[word_id] for word_id in head]
+        for i in range(min(len(window), len(sequence) - 2)):
+            own[(sequence[i] << ID_BITS | sequence[i + 1]) << ID_BITS | sequence[i + 2]] += 1
+        window = (window + [mapping[word_id] for word_id in tail])[-2:]
+        self.window = (None,) * (2 - len(window)) + tuple(window)
+
+    def reset_window(self) -> None:
+        """Forget the last tokens, next tokens do not continue the previous text"""
+
+        self.window = (None, None)
+
+    def add_trigram(self, first: str, second: str, third: str) -> None:
+        """
+        Count one occurrence of trigram
+
+        :param first: first word
+        :param second: second word
+        :param third: word following the prefix
+        """
+
+        intern = self.vocab.intern
+        key = (pack_prefix(intern(first), intern(second)) << ID_BITS) | intern(third)
+        self.counts[key] += 1
+
+    def build(self) -> TrigramModel:
+        """
+        Sort counted trigrams and pack them into flat arrays with sampling tables
+
+        :Return frozen model
+        """
+
+        words = self.vocab.words
+        prefix_keys, offsets, capital_ends = array('Q'), array('I', [0]), array('I')
+        followers, cumulative, start_keys = array('I'), array('Q'), array('Q')
+        group = []
+        last_prefix = None
+        for key in sorted(self.counts):
+            prefix = key >> ID_BITS
+            if prefix != last_prefix and group:
+                capital_ends.append(append_group(group, followers, cumulative))
+                offsets.append(len(followers))
+                group = []
+            if prefix != last_prefix:
+                prefix_keys.append(prefix)
+                first, second = unpack_prefix(prefix)
+                if is_sentence_start(words[first], words[second]):
+                    start_keys.append(prefix)
+                last_prefix = prefix
+            follower = key & ID_MASK
+            group.append((not words[follower][0].isupper(), follower, self.counts[key]))
+        if group:
+            capital_ends.append(append_group(group, followers, cumulative))
+            offsets.append(len(followers))
+        return TrigramModel(self.vocab, prefix_keys, offsets, capital_ends, followers, cumulative, start_keys)
@@ -0,0 +1,321 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque
+from mmap import mmap
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import random
+
+from ngram_model import ID_BITS, ID_MASK, Vocabulary, is_sentence_start
+
+
+def unpack_ngram(key: int, n: int) -> Tuple[int, ...]:
+    """
+    Split packed key of n-gram into word ids
+
+    :param key: ids packed by 32 bits, the first word in the highest bits
+    :param n: number of words in key
+    :Return tuple of word ids
+    """
+
+    return tuple(key >> ID_BITS * (n - 1 - i) & ID_MASK for i in range(n))
+
+
+class NGramTrie:
+    """
+    Variable-order n-gram model stored as prefix trie in flat arrays, one level per order.
+    Node of level k is a k-gram, its children are (k + 1)-grams starting with it,
+    so every n-gram shares storage with all its prefixes. Level 0 is the root with single node
+
+    Contains: vocab - interned words
+              order - maximal n of n-grams
+              words - words[k] is array of last word ids of nodes of level k
+              cumulative - cumulative[k] is array of running sums of counts of nodes of level k
+                           inside range of their siblings, used as sampling table
+              child_offsets - children of i-th node of level k are
+                              child_offsets[k][i]:child_offsets[k][i + 1] of level k + 1
+              capital_ends - children starting with capital letter go first, i-th node of level k
+                             has them in child_offsets[k][i]:capital_ends[k][i].
+                             Both parts of range are sorted by word id
+              start_contexts - concatenated word ids of contexts of (order - 1) words
+                               which can start a sentence, look @is_sentence_start
+              min_count - context followed less times than this is backed off to shorter one
+              buffer - memory-mapped file the arrays are views of, None for model built in memory
+    """
+
+    def __init__(self, vocab: Vocabulary, order: int, words: List[array], cumulative: List[array],
+                 child_offsets: List[array], capital_ends: List[array], start_contexts: array,
+                 min_count: int = 1, buffer: Optional[mmap] = None):
+        self.vocab = vocab
+        self.order = order
+        self.words = words
+        self.cumulative = cumulative
+        self.child_offsets = child_offsets
+        self.capital_ends = capital_ends
+        self.start_contexts = start_contexts
+        self.min_count = min_count
+        self.buffer = buffer
+
+    def __len__(self) -> int:
+        return len(self.words[self.order - 1])
+
+    @property
+    def dirty(self) -> bool:
+        """Trie is rebuilt from scratch, it never has unsaved updates"""
+
+        return False
+
+    def compact(self) -> None:
+        """Trie has no delta of updates, look @TrigramModel.compact"""
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the trie arrays in bytes"""
+
+        return sum(item.itemsize * len(item) for item in self.sections().values())
+
+    def sections(self) -> Dict[str, array]:
+        """
+        Arrays of trie by names, used to save model, look @model_file
+        """
+
+        sections = {'start_contexts': self.start_contexts}
+        for level in range(self.order + 1):
+            if level:
+                sections[f'words{level}'] = self.words[level]
+                sections[f'cumulative{level}'] = self.cumulative[level]
+            if level < self.order:
+                sections[f'offsets{level}'] = self.child_offsets[level]
+                sections[f'capitals{level}'] = self.capital_ends[level]
+        return sections
+
+    @classmethod
+    def from_sections(cls, vocab: Vocabulary, order: int, sections: Dict[str, array],
+                      buffer: Optional[mmap] = None) -> 'NGramTrie':
+        """
+        Create trie of arrays saved by @sections
+
+        :param vocab: interned words
+        :param order: maximal n of n-grams
+        :param sections: arrays by names
+        :param buffer: memory-mapped file the arrays are views of
+        """
+
+        empty = array('I')
+        return cls(vocab, order,
+                   [empty] + [sections[f'words{level}'] for level in range(1, order + 1)],
+                   [empty] + [sections[f'cumulative{level}'] for level in range(1, order + 1)],
+                   [sections[f'offsets{level}'] for level in range(order)],
+                   [sections[f'capitals{level}'] for level in range(order)],
+                   sections['start_contexts'], buffer=buffer)
+
+    def find_child(self, level: int, node: int, word_id: int) -> Optional[int]:
+        """
+        Binary search of child of node by word id in capitalized or lower part of its range
+
+        :param level: level of parent node
+        :param node: index of parent node in its level
+        :param word_id: id of word of child
+        :Return index of child at level + 1 or None
+        """
+
+        start, end = self.child_offsets[level][node], self.child_offsets[level][node + 1]
+        capital_end = self.capital_ends[level][node]
+        if self.vocab[word_id][0].isupper():
+            end = capital_end
+        else:
+            start = capital_end
+        words = self.words[level + 1]
+        index = bisect_left(words, word_id, start, end)
+        if index < end and words[index] == word_id:
+            return index
+        return None
+
+    def find_node(self, context: Sequence[int]) -> Optional[int]:
+        """
+        Walk down the trie by words of context
+
+        :param context: word ids
+        :Return index of node at level len(context) or None if n-gram is unknown
+        """
+
+        node = 0
+        for level, word_id in enumerate(context):
+            node = self.find_child(level, node, word_id)
+            if node is None:
+                return None
+        return node
+
+    def children_count(self, level: int, node: int) -> int:
+        """
+        Number of times node was followed by any word
+
+        :param level: level of node
+        :param node: index of node in its level
+        """
+
+        start, end = self.child_offsets[level][node], self.child_offsets[level][node + 1]
+        return self.cumulative[level + 1][end - 1] if end > start else 0
+
+    def find_context(self, history: Sequence[int]) -> Optional[Tuple[int, int]]:
+        """
+        Find the longest suffix of history, up to order - 1 words, which was followed
+        at least @min_count times. Shorter suffixes are tried one by one (backoff)
+
+        :param history: ids of generated words
+        :Return level and index of context node or None if model is empty
+        """
+
+        for length in range(min(len(history), self.order - 1), -1, -1):
+            node = self.find_node(history[len(history) - length:])
+            if node is not None and self.children_count(length, node) >= max(self.min_count, 1):
+                return length, node
+        return None
+
+    def sample(self, context: Tuple[int, int], capital: bool = False, rng: random.Random = random) -> int:
+        """
+        Weighted random choice of child of context node by binary search in cumulative counts
+
+        :param context: level and index of node, look @find_context
+        :param capital: choose only between words starting with capital letter.
+                        Falls back to all children if there is no such words
+        :param rng: source of random numbers
+        :Return id of chosen word
+        """
+
+        level, node = context
+        start, end = self.child_offsets[level][node], self.child_offsets[level][node + 1]
+        capital_end = self.capital_ends[level][node]
+        if capital and capital_end > start:
+            end = capital_end
+        cumulative = self.cumulative[level + 1]
+        position = bisect_right(cumulative, rng.randrange(cumulative[end - 1]), start, end)
+        return self.words[level + 1][position]
+
+    def random_start(self, rng: random.Random = random) -> Tuple[int, ...]:
+        """
+        Uniform random choice of context from index of sentence starts
+
+        :param rng: source of random numbers
+        :Return word ids of context of order - 1 words
+        """
+
+        length = self.order - 1
+        n_starts = len(self.start_contexts) // length
+        if not n_starts:
+            raise ValueError('Model has no context to start a sentence')
+        position = rng.randrange(n_starts) * length
+        return tuple(self.start_contexts[position:position + length])
+
+    def follower_counts(self, context: Tuple[int, int]) -> Iterator[Tuple[int, int]]:
+        """
+        Iterate over children of context node
+
+        :param context: level and index of node
+        :Return iterator over pairs of word id and count
+        """
+
+        level, node = context
+        start, end = self.child_offsets[level][node], self.child_offsets[level][node + 1]
+        cumulative, words = self.cumulative[level + 1], self.words[level + 1]
+        previous = 0
+        for i in range(start, end):
+            yield words[i], cumulative[i] - previous
+            previous = cumulative[i]
+
+    def __getitem__(self, context: str) -> Counter:
+        ids = [self.vocab.get(word) for word in context.split()]
+        node = None if None in ids else self.find_node(ids)
+        if node is None or not self.children_count(len(ids), node):
+            raise KeyError(context)
+        return Counter({self.vocab[word_id]: count for word_id, count in self.follower_counts((len(ids), node))})
+
+
+class NGramTrieBuilder:
+    """
+    Accumulate counts of all n-grams of orders 1..@order and freeze them into @NGramTrie
+
+    Contains: vocab - interned words
+              order - maximal n of n-grams
+              counts - counts[k] is count_by_ngram of k-grams packed by @ID_BITS per word
+              window - ids of the last @order tokens
+    """
+
+    def __init__(self, order: int):
+        if order < 2:
+            raise ValueError('Order of model must be at least 2')
+        self.vocab = Vocabulary()
+        self.order = order
+        self.counts: List[Counter] = [Counter() for _ in range(order + 1)]
+        self.window = deque(maxlen=order)
+
+    def add_tokens(self, tokens: Iterable[str]) -> None:
+        """
+        Count n-grams of all orders ending at every token of stream
+
+        :param tokens: iterable of tokens, e.g. @corpus_reader.iter_file_tokens
+        """
+
+        intern = self.vocab.intern
+        counts, window = self.counts, self.window
+        for token in tokens:
+            window.append(intern(token))
+            key = 0
+            for n in range(1, len(window) + 1):
+                key |= window[-n] << ID_BITS * (n - 1)
+                counts[n][key] += 1
+
+    def reset_window(self) -> None:
+        """Forget the last tokens, next tokens do not continue the previous text"""
+
+        self.window.clear()
+
+    def build(self, min_count: int = 1) -> NGramTrie:
+        """
+        Sort counted n-grams level by level and pack them into trie arrays
+
+        :param min_count: backoff threshold of model, look @NGramTrie.find_context
+        :Return frozen trie
+        """
+
+        vocab_words = self.vocab.words
+        words, cumulative = [array('I')], [array('Q')]
+        child_offsets, capital_ends = [], []
+        node_by_key = {0: 0}
+        for level in range(1, self.order + 1):
+            level_counts = self.counts[level]
+            entries = sorted((node_by_key[key >> ID_BITS], not vocab_words[key & ID_MASK][0].isupper(),
+                              key & ID_MASK, key) for key in level_counts)
+            level_words, level_cumulative = array('I'), array('Q')
+            offsets, capitals = array('I', [0]), array('I')
+            next_by_key = {}
+            position = 0
+            for parent in range(len(words[level - 1]) if level > 1 else 1):
+                total = 0
+                capital_end = len(level_words)
+                while position < len(entries) and entries[position][0] == parent:
+                    _, is_lower, word_id, key = entries[position]
+                    total += level_counts[key]
+                    next_by_key[key] = len(level_words)
+                    level_words.append(word_id)
+                    level_cumulative.append(total)
+                    if not is_lower:
+                        capital_end = len(level_words)
+                    position += 1
+                offsets.append(len(level_words))
+                capitals.append(capital_end)
+            child_offsets.append(offsets)
+            capital_ends.append(capitals)
+            words.append(level_words)
+            cumulative.append(level_cumulative)
+            if level == self.order - 1:
+                contexts = sorted(next_by_key.items(), key=lambda item: item[1])
+            node_by_key = next_by_key
+        start_contexts = array('I')
+        level = self.order - 1
+        for key, node in contexts:
+            context = unpack_ngram(key, level)
+            if (child_offsets[level][node + 1] > child_offsets[level][node]
+                    and is_sentence_start(*(vocab_words[word_id] for word_id in context))):
+                start_contexts.extend(context)
+        return NGramTrie(self.vocab, self.order, words, cumulative, child_offsets, capital_ends,
+                         start_contexts, min_count)
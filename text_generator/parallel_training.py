@@ -0,0 +1,63 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+from typing import List, NamedTuple, Optional
+import os
+
+from corpus_reader import iter_range_tokens, shard_ranges
+from ngram_model import TrigramBuilder, TrigramModel
+
+
+class ShardCounts(NamedTuple):
+    """
+    Partial counts of one shard in local ids of the shard
+
+    Contains: words - vocabulary of shard ordered by local id
+              counts - count_by_trigram inside shard
+              head - ids of the first two tokens of shard
+              tail - ids of the last two tokens of shard
+    """
+
+    words: List[str]
+    counts: Counter
+    head: List[int]
+    tail: List[int]
+
+
+def count_shard(path: str, start: int, end: int) -> ShardCounts:
+    """
+    Count trigrams of byte range of corpus. Runs in worker process
+
+    :param path: path to corpus
+    :param start: offset of the first byte of shard
+    :param end: offset after the last byte of shard
+    """
+
+    builder = TrigramBuilder()
+    tokens = iter_range_tokens(path, start, end)
+    head = list(islice(tokens, 2))
+    builder.add_tokens(head)
+    builder.add_tokens(tokens)
+    tail = [word_id for word_id in builder.window if word_id is not None]
+    return ShardCounts(builder.vocab.words, builder.counts, [builder.vocab.get(word) for word in head], tail)
+
+
+def build_sharded(path: str, workers: Optional[int] = None) -> TrigramModel:
+    """
+    Split corpus into one shard per worker aligned on whitespace, count them in process pool
+    and merge partial counts in order of shards, merging is the only serial part.
+    Result is identical to single-process build
+
+    :param path: path to corpus
+    :param workers: number of processes, default is number of CPUs
+    :Return model built in memory
+    """
+
+    workers = workers or os.cpu_count() or 1
+    ranges = shard_ranges(path, workers)
+    builder = TrigramBuilder()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        starts, ends = [start for start, _ in ranges], [end for _, end in ranges]
+        for shard in executor.map(count_shard, repeat(path, len(ranges)), starts, ends):
+            builder.merge(*shard)
+    return builder.build()
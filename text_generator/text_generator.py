@@ -1,33 +1,137 @@
-from collections import defaultdict, Counter
-from typing import List, Tuple, Match
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import count
+from typing import Iterable, Iterator, List, Optional, Tuple, Match
+import argparse
 import random
 import re
 
 
-from nltk.util import ngrams
+from corpus_reader import iter_file_tokens
+from model_file import Fingerprint, Model, default_model_path, load_model, load_or_build, read_header, save_model
+from ngram_model import TrigramBuilder, TrigramModel
+from ngram_trie import NGramTrie, NGramTrieBuilder
+from parallel_training import build_sharded
+
+
+SENTENCES_PER_TASK = 1000
+MAX_RESTARTS = 1000
 
 
 class Preprocessor:
     """Class to process data"""
 
-    def __init__(self):
+    def __init__(self, path_input: str = None, model_path: str = None, workers: int = 1,
+                 order: Optional[int] = None, min_count: int = 1):
+        """
+        Load n_grams of corpus from model file when initiating object.
+        Model file is rebuilt if it is missing or the corpus has changed
+
+        :param path_input: path to corpus. Read from input if omitted
+        :param model_path: path to model file. Default is next to corpus, look @default_model_path
+        :param workers: number of processes to build model with
+        :param order: use @NGramTrie of this order with backoff instead of @TrigramModel
+        :param min_count: context of @NGramTrie followed less times is backed off
+        """
+
+        if path_input is None:
+            path_input = input()
+        self.path_input = path_input
+        self.model_path = model_path or default_model_path(path_input, order)
+        self.data = load_or_build(path_input, self.model_path,
+                                  partial(self.build_model, workers=workers, order=order), order)
+        self.fingerprint: Optional[Fingerprint] = read_header(self.model_path)[0]
+        if order is not None:
+            self.data.min_count = min_count
+
+    @classmethod
+    def from_model(cls, data: Model, fingerprint: Optional[Fingerprint] = None) -> 'Preprocessor':
+        """
+        Create object around already loaded model, e.g. in worker process
+
+        :param data: trigram model
+        :param fingerprint: fingerprint of corpus the model was built from, look @read_header.
+                            Model can be saved only if it is given
+        """
+
+        preprocessor = cls.__new__(cls)
+        preprocessor.path_input, preprocessor.model_path = None, None
+        preprocessor.data = data
+        preprocessor.fingerprint = fingerprint
+        return preprocessor
+
+    @staticmethod
+    def build_model(path_input: str, workers: int = 1, order: Optional[int] = None) -> Model:
+        """
+        Create n_grams of corpus streamed by chunks. Count them into compact @TrigramModel
+
+        :param path_input: path to corpus
+        :param workers: number of processes. If more than one, corpus is split into shards,
+                        look @build_sharded
+        :param order: build @NGramTrie of all orders up to this one instead, in single process
+        :Return model built in memory
+        """
+
+        if order is not None:
+            builder = NGramTrieBuilder(order)
+            builder.add_tokens(iter_file_tokens(path_input))
+            return builder.build()
+        if workers > 1:
+            return build_sharded(path_input, workers)
+        builder = TrigramBuilder()
+        builder.add_tokens(iter_file_tokens(path_input))
+        return builder.build()
+
+    def add_documents(self, documents: Iterable[str]) -> None:
+        """
+        Count n_grams of new documents into existing model.
+        Documents are independent, n_grams do not cross their boundaries
+
+        :param documents: iterable of texts
+        """
+
+        self.check_updatable()
+        builder = TrigramBuilder(self.data.vocab)
+        for document in documents:
+            builder.add_tokens(document.split())
+            builder.reset_window()
+        self.data.add_counts(builder.counts)
+
+    def add_file(self, path: str) -> None:
+        """
+        Count n_grams of file streamed by chunks into existing model
+
+        :param path: path to text file
+        """
+
+        self.check_updatable()
+        builder = TrigramBuilder(self.data.vocab)
+        builder.add_tokens(iter_file_tokens(path))
+        self.data.add_counts(builder.counts)
+
+    def check_updatable(self) -> None:
+        """Incremental updates are supported by @TrigramModel only, @NGramTrie is rebuilt"""
+
+        if not isinstance(self.data, TrigramModel):
+            raise ValueError('Only trigram model can be updated, rebuild n-gram trie from corpus')
+
+    def save(self, model_path: str = None) -> None:
         """
-        Create n_grams when initiating object. Count
+        Merge updates into model arrays and save model file.
+        File keeps fingerprint of corpus the model was loaded with, so updates survive
+        until the corpus itself changes
+
+        :param model_path: path to model file. Default is the file model was loaded from
         """
 
-        path_input = input()
-        self.tokens = []
-        with open(path_input, 'r', encoding='utf-8') as f:
-            data = f.read()
-        self.tokens = data.split()
-        tmp_dict = defaultdict(list)
-        for val1, val2, val3 in ngrams(self.tokens, n=3):
-            tmp_dict[val1 + ' ' + val2].append(val3)
-        dataset_dict = {}
-        for item in tmp_dict:
-            counter = Counter(tmp_dict[item])
-            dataset_dict[item] = counter
-        self.data = dataset_dict
+        model_path = model_path or self.model_path
+        if model_path is None:
+            raise ValueError('Path to model file is required, the model was not loaded from file')
+        if self.fingerprint is None:
+            raise ValueError('Fingerprint of corpus is unknown, pass it to from_model to save the model')
+        self.data.compact()
+        save_model(self.data, model_path, self.fingerprint)
 
     def get_next_word(self, curr_word: str) -> Counter:
         """
@@ -39,49 +143,45 @@ class Preprocessor:
 
         return self.data[curr_word]
 
-    def generate_random(self) -> List[str]:
+    def generate_random(self, rng: random.Random = random) -> List[str]:
         """
-        Generate random sentences by random start
+        Generate random sentences by random start. Generation starts over when it reaches a prefix
+        without followers, at most @MAX_RESTARTS times
 
+        :param rng: source of random numbers
         :Return Sentence found by algorithm of weighted counts in n_grams
         """
 
-        while True:
-            curr_iter = random.choice(list(self.data.keys()))
-            if not self.str_endswith_punctuation(curr_iter) and curr_iter[0].isupper():
-                break
-        final_str = [*curr_iter.split()]
-        is_capital = False
-        while True:
-            counter = self.get_next_word(curr_iter)
-            next_iter, need_capital = self.find_in_counter(counter, capital=is_capital)
-            is_capital = need_capital
-            final_str.append(next_iter)
-            if len(final_str) >= 5 and self.str_endswith_punctuation(next_iter):  # sentence more then 5 words add new
-                break
-            curr_iter = curr_iter.split(' ')[1] + ' ' + next_iter
-        return final_str
+        for _ in range(MAX_RESTARTS):
+            history = list(self.data.random_start(rng))
+            final_str = [self.data.vocab[word_id] for word_id in history]
+            is_capital = False
+            while True:
+                index = self.data.find_context(history)
+                if index is None:  # prefix from the end of corpus without followers, start over
+                    break
+                next_id, need_capital = self.find_in_counter(index, capital=is_capital, rng=rng)
+                is_capital = need_capital
+                final_str.append(self.data.vocab[next_id])
+                if len(final_str) >= 5 and need_capital:  # sentence more then 5 words add new
+                    return final_str
+                history = history[1:] + [next_id]
+        raise RuntimeError(f'No sentence is finished after {MAX_RESTARTS} random starts, '
+                           'corpus has too many dead ends')
 
-    @staticmethod
-    def find_in_counter(counter: Counter, capital: bool) -> Tuple[str, Match]:
+    def find_in_counter(self, index, capital: bool, rng: random.Random = random) -> Tuple[int, Match]:
         """
         Get next word. If @capital word must start with capital letter
-        Else try to find the next word by weighted random choice in dataset
+        Else find the next word by weighted random choice in precomputed sampling table
 
-        :param counter: dataset of mapping counts_by_word
+        :param index: current context in model, look @TrigramModel.find_context and @NGramTrie.find_context
         :param capital: find word starting with capital letter
-        :Return pair of next weighted random word and match object if it ends with punctuation sign
+        :param rng: source of random numbers
+        :Return pair of id of next weighted random word and match object if it ends with punctuation sign
         """
 
-        weights = [item for item in counter.values()]
-        keys = list(counter.keys())
-        while True:
-            return_value = random.choices(keys, weights)[0]
-            if capital:
-                if not return_value[0].isupper():
-                    return_value = None
-            if return_value:
-                return return_value, Preprocessor.str_endswith_punctuation(return_value)
+        next_id = self.data.sample(index, capital, rng)
+        return next_id, self.str_endswith_punctuation(self.data.vocab[next_id])
 
     @staticmethod
     def str_endswith_punctuation(word: str) -> Match:
@@ -101,24 +201,140 @@ class Preprocessor:
         :Return list of sentences generated
         """
 
-        return [self.generate_random() for _ in range(n)]
+        return list(self.iter_random_sentences(n))
+
+    def iter_random_sentences(self, n: Optional[int] = None, rng: random.Random = random) -> Iterator[List[str]]:
+        """
+        Yield random sentences one by one as they are generated
+
+        :param n: number of sentences, endless if None
+        :param rng: source of random numbers
+        :Return iterator over sentences
+        """
+
+        for _ in (range(n) if n is not None else count()):
+            yield self.generate_random(rng)
+
+    def generate_chunk(self, seed: int, index: int, n: int) -> List[List[str]]:
+        """
+        Generate @index-th chunk of sentences with its own random generator.
+        Generator is seeded by @seed and @index, so chunk does not depend on who generates it
+
+        :param seed: seed of the whole run
+        :param index: number of chunk
+        :param n: number of sentences in chunk
+        :Return list of sentences
+        """
+
+        return list(self.iter_random_sentences(n, random.Random(f'{seed}:{index}')))
+
+    def generate_parallel(self, n: int, workers: int = 1, seed: int = 0,
+                          chunk_size: int = SENTENCES_PER_TASK) -> Iterator[List[str]]:
+        """
+        Generate sentences by chunks in process pool and yield them in order of chunks.
+        Output is reproducible by @seed and does not depend on number of workers.
+        Workers memory-map the model file if it has no unsaved updates, otherwise model is sent to them
+
+        :param n: number of sentences
+        :param workers: number of processes, chunks are generated in this process if 1
+        :param seed: seed of random generators of chunks
+        :param chunk_size: number of sentences generated by one task
+        :Return iterator over sentences
+        """
+
+        tasks = [(index, min(chunk_size, n - start)) for index, start in enumerate(range(0, n, chunk_size))]
+        if workers <= 1:
+            for index, size in tasks:
+                yield from self.generate_chunk(seed, index, size)
+            return
+        min_count = self.data.min_count if isinstance(self.data, NGramTrie) else None
+        if self.data.buffer is not None and not self.data.dirty:
+            init_args = (self.model_path, None, min_count)
+        else:
+            self.data.compact()
+            init_args = (None, self.data, min_count)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=init_args) as executor:
+            pending = deque()
+            for index, size in tasks:
+                pending.append(executor.submit(generate_worker_chunk, seed, index, size))
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+
+worker_preprocessor: Optional[Preprocessor] = None
+
+
+def init_worker(model_path: Optional[str], data: Optional[Model], min_count: Optional[int]) -> None:
+    """
+    Prepare model in worker process of @Preprocessor.generate_parallel
+
+    :param model_path: path to model file to memory-map
+    :param data: model sent by parent if there is no up-to-date file
+    :param min_count: backoff threshold of @NGramTrie, it is not stored in file
+    """
+
+    global worker_preprocessor
+    if data is None:
+        data = load_model(model_path)
+        if min_count is not None:
+            data.min_count = min_count
+    worker_preprocessor = Preprocessor.from_model(data)
+
+
+def generate_worker_chunk(seed: int, index: int, n: int) -> List[List[str]]:
+    """
+    Generate chunk of sentences in worker process, look @Preprocessor.generate_chunk
+    """
+
+    return worker_preprocessor.generate_chunk(seed, index, n)
 
 
 class Menu:
     """Class to interact with user"""
 
     @staticmethod
-    def process_output(preprocessor_: Preprocessor) -> None:
+    def process_output(preprocessor_: Preprocessor, n: int = 10, workers: int = 1,
+                       seed: Optional[int] = None) -> None:
         """
-        Print the resulted sentences from @generate_n_random_sentences
+        Print sentences as soon as they are generated
 
         :param preprocessor_: object contains the dataset
+        :param n: number of sentences
+        :param workers: number of processes, look @Preprocessor.generate_parallel
+        :param seed: seed to reproduce output. Global random state is used if None and @workers is 1
         """
 
-        for item in preprocessor_.generate_n_random_sentences():
+        if seed is None and workers <= 1:
+            sentences = preprocessor_.iter_random_sentences(n)
+        else:
+            seed = seed if seed is not None else random.getrandbits(32)
+            sentences = preprocessor_.generate_parallel(n, workers, seed)
+        for item in sentences:
             print(' '.join(item), end='\n')
 
 
 if __name__ == '__main__':
-    preprocessor = Preprocessor()
-    Menu.process_output(preprocessor_=preprocessor)
+    parser = argparse.ArgumentParser(description='Generate random sentences by trigram model of corpus')
+    parser.add_argument('corpus', nargs='?', help='Path to corpus. Read from input if omitted')
+    parser.add_argument('--model', required=False, help='Path to model file built from corpus')
+    parser.add_argument('--build', action='store_true', help='Only build model file if it is stale')
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                        help='Number of processes to build model and generate sentences')
+    parser.add_argument('--add', nargs='+', required=False, help='Text files to add into model and save it')
+    parser.add_argument('--sentences', '-n', type=int, default=10, help='Number of sentences to generate')
+    parser.add_argument('--seed', type=int, required=False, help='Seed to reproduce generated sentences')
+    parser.add_argument('--order', type=int, required=False, help='Use n-gram trie of this order with backoff')
+    parser.add_argument('--min-count', type=int, default=1,
+                        help='Context of n-gram trie followed less times is backed off')
+    args = parser.parse_args()
+    if args.add and args.order is not None:
+        parser.error('--add updates trigram model only, it cannot be used with --order')
+    preprocessor = Preprocessor(args.corpus, args.model, args.workers, args.order, args.min_count)
+    if args.add:
+        for path in args.add:
+            preprocessor.add_file(path)
+        preprocessor.save()
+    if not args.build:
+        Menu.process_output(preprocessor_=preprocessor, n=args.sentences, workers=args.workers, seed=args.seed)
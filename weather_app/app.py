@@ -1,21 +1,64 @@
 import sys
 import os
-import requests
-from typing import Dict, Any
+from datetime import datetime, timezone
+from functools import partial
+from typing import Dict, Any, Callable, List, Optional, Set, Tuple, Union
+import base64
+import hmac
+import json
+import math
+import re
+import threading
+import zlib
 
-from flask import Flask, render_template, request, redirect, url_for, flash
+import click
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, session
 from flask_sqlalchemy import SQLAlchemy
 from flask_restful import marshal, fields
+from sqlalchemy import bindparam, inspect, or_, text
+from sqlalchemy.exc import IntegrityError
+
+from city_catalog import DEFAULT_CATALOG, CityCatalog, city_json
+from metrics import Instrumentation
+from refresh import RateLimitTimeout, RefreshGuard, RefreshScheduler, fetch_concurrently
+from weather_cache import SQLiteCacheStore, WeatherAPIError, WeatherCache, WeatherClient
 
 # Init flask and db
 app = Flask(__name__)
 API_KEY = os.environ.get('WEATHER_API_KEY')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///weather.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///weather.db')
 app.secret_key = os.urandom(24)
+app.config['WEATHER_CACHE_SIZE'] = int(os.environ.get('WEATHER_CACHE_SIZE', 1024))
+app.config['WEATHER_CACHE_TTL'] = float(os.environ.get('WEATHER_CACHE_TTL', 600))
+app.config['WEATHER_CACHE_NEGATIVE_TTL'] = float(os.environ.get('WEATHER_CACHE_NEGATIVE_TTL', 3600))
+app.config['WEATHER_CACHE_PERSISTENT'] = os.environ.get('WEATHER_CACHE_PERSISTENT', '0') == '1'
+app.config['WEATHER_CACHE_PURGE_EVERY'] = int(os.environ.get('WEATHER_CACHE_PURGE_EVERY', 1000))
+app.config['WEATHER_API_TIMEOUT'] = float(os.environ.get('WEATHER_API_TIMEOUT', 5))
+app.config['WEATHER_REFRESH_INTERVAL'] = float(os.environ.get('WEATHER_REFRESH_INTERVAL', 600))
+app.config['WEATHER_REFRESH_WORKERS'] = int(os.environ.get('WEATHER_REFRESH_WORKERS', 4))
+app.config['WEATHER_REFRESH_BATCH'] = int(os.environ.get('WEATHER_REFRESH_BATCH', 50))
+app.config['WEATHER_API_RATE'] = float(os.environ.get('WEATHER_API_RATE', 1))
+app.config['WEATHER_API_RETRIES'] = int(os.environ.get('WEATHER_API_RETRIES', 2))
+app.config['WEATHER_BULK_LIMIT'] = int(os.environ.get('WEATHER_BULK_LIMIT', 1000))
+app.config['WEATHER_BULK_TIMEOUT'] = float(os.environ.get('WEATHER_BULK_TIMEOUT', 20))
+app.config['REFRESH_API_TOKEN'] = os.environ.get('REFRESH_API_TOKEN')
+app.config['REFRESH_API_MIN_INTERVAL'] = float(os.environ.get('REFRESH_API_MIN_INTERVAL', 60))
+app.config['API_PAGE_SIZE'] = int(os.environ.get('API_PAGE_SIZE', 50))
+app.config['API_MAX_PAGE_SIZE'] = int(os.environ.get('API_MAX_PAGE_SIZE', 500))
+app.config['SLOW_REQUEST_THRESHOLD'] = float(os.environ.get('SLOW_REQUEST_THRESHOLD', 0))
+app.config['SLOW_REQUEST_PROFILE_DIR'] = os.environ.get('SLOW_REQUEST_PROFILE_DIR')
+app.config['ASYNC_DB_WORKERS'] = int(os.environ.get('ASYNC_DB_WORKERS', 4))
+app.config['ASYNC_MAX_CONNECTIONS'] = int(os.environ.get('ASYNC_MAX_CONNECTIONS', 100))
+app.config['CITY_CATALOG'] = os.environ.get('CITY_CATALOG', DEFAULT_CATALOG)
+app.config['AUTOCOMPLETE_MAX_LIMIT'] = int(os.environ.get('AUTOCOMPLETE_MAX_LIMIT', 20))
 db = SQLAlchemy(app)
 
 
-BASE_URL = 'https://api.openweathermap.org/data/2.5/weather?q='
+BASE_URL = os.environ.get('WEATHER_API_URL', 'https://api.openweathermap.org/data/2.5/weather')
+
+CITY_EXISTS_MESSAGE = 'The city has already been added to the list!'
+CITY_NOT_FOUND_MESSAGE = "The city doesn't exist!"
+SERVICE_UNAVAILABLE_MESSAGE = 'The weather service is unavailable, try again later!'
 
 
 class City(db.Model):
@@ -24,17 +67,36 @@ class City(db.Model):
 
     Contains: id
               name - full name of city
+              catalog_id - id of city in weather API and in @CityCatalog, None for cities added before it
               day_state - state of the day. Enum of {evening-morning, day, night}
               temperatue - current temperature in celciyn
               state - current weather state
+              updated_at - time of the last weather update in UTC
     """
 
     __tablename__ = 'city'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False, unique=True)
+    catalog_id = db.Column(db.Integer, nullable=True, unique=True)
     day_state = db.Column(db.String(15), nullable=False)
     temperature = db.Column(db.Integer, nullable=False)
     state = db.Column(db.String(15), nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+
+class TableVersion(db.Model):
+    """
+    Version counter of table, increased by triggers on every change of its rows
+
+    Contains: name - name of table
+              version - number of changes
+              modified_at - time of the last change in UTC
+    """
+
+    __tablename__ = 'table_version'
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    modified_at = db.Column(db.DateTime, nullable=False)
 
 
 fields = {
@@ -45,7 +107,141 @@ fields = {
     'state': fields.String
 }
 
+
+def migrate_schema() -> None:
+    """
+    Add columns introduced after table @City was created, create_all does not alter existing tables
+    """
+
+    columns = {column['name'] for column in inspect(db.engine).get_columns(City.__tablename__)}
+    if 'updated_at' not in columns:
+        with db.engine.begin() as connection:
+            connection.execute(text('ALTER TABLE city ADD COLUMN updated_at DATETIME'))
+    if 'catalog_id' not in columns:  # sqlite can not add unique column, so uniqueness is kept by index
+        with db.engine.begin() as connection:
+            connection.execute(text('ALTER TABLE city ADD COLUMN catalog_id INTEGER'))
+            connection.execute(text('CREATE UNIQUE INDEX city_catalog_id ON city (catalog_id)'))
+    with db.engine.begin() as connection:
+        connection.execute(text('''INSERT OR IGNORE INTO table_version (name, version, modified_at)
+                                   VALUES ('city', 0, CURRENT_TIMESTAMP)'''))
+        for event in ('insert', 'update', 'delete'):
+            connection.execute(text(f'''CREATE TRIGGER IF NOT EXISTS city_version_{event}
+                                        AFTER {event.upper()} ON city
+                                        BEGIN
+                                            UPDATE table_version SET version = version + 1,
+                                                                     modified_at = CURRENT_TIMESTAMP
+                                            WHERE name = 'city';
+                                        END'''))
+
+
 db.create_all()
+migrate_schema()
+
+# names are validated by local catalog before calls of weather API, empty CITY_CATALOG disables it
+city_catalog = CityCatalog(db.engine) if app.config['CITY_CATALOG'] else None
+if city_catalog is not None:
+    city_catalog.ensure_loaded(app.config['CITY_CATALOG'])
+
+instrumentation = Instrumentation(slow_threshold=app.config['SLOW_REQUEST_THRESHOLD'],
+                                  profile_dir=app.config['SLOW_REQUEST_PROFILE_DIR'])
+instrumentation.init_app(app, db.engine)
+
+weather_cache = WeatherCache(app.config['WEATHER_CACHE_SIZE'], app.config['WEATHER_CACHE_TTL'],
+                             app.config['WEATHER_CACHE_NEGATIVE_TTL'],
+                             SQLiteCacheStore(db.engine) if app.config['WEATHER_CACHE_PERSISTENT'] else None,
+                             purge_every=app.config['WEATHER_CACHE_PURGE_EVERY'])
+weather_client = WeatherClient(BASE_URL, API_KEY, weather_cache,
+                               timeout=(3.05, app.config['WEATHER_API_TIMEOUT']),
+                               pool_size=app.config['WEATHER_REFRESH_WORKERS'],
+                               retries=app.config['WEATHER_API_RETRIES'],
+                               observer=instrumentation.observe_upstream)
+instrumentation.registry.reading('weather_cache_hits_total', 'Lookups answered by weather cache',
+                                 lambda: weather_cache.hits, 'counter')
+instrumentation.registry.reading('weather_cache_misses_total', 'Lookups missed by weather cache',
+                                 lambda: weather_cache.misses, 'counter')
+instrumentation.registry.reading('weather_cache_entries', 'Entries kept in memory by weather cache',
+                                 lambda: len(weather_cache.entries))
+
+
+def find_city(city_name: str,
+              reject_typos: bool = False) -> Tuple[str, Optional[int], List[Tuple[str, Union[int, str]]]]:
+    """
+    Normalize name of city by @city_catalog without calling weather API. Cities missing in catalog,
+    e.g. small towns, and all cities without catalog are queried by name, weather API tells if they exist.
+    Cities of catalog are queried by id, and by name with country code if weather API does not know the id
+
+    :param city_name: name typed by user, optionally with country code after comma
+    :param reject_typos: give no query for name missing in catalog but similar to names of its cities,
+                         so mistyped name is not found without call of weather API. Names with country code
+                         are queried anyway, so towns missing in catalog can be added as "Town, CC"
+    :Return name to store - @CityCatalog.label of city, id of city or None if it is not in catalog,
+            names and values of query parameters of weather API to try in order, look @WeatherClient.fetch_first
+    """
+
+    city = city_catalog.resolve(city_name) if city_catalog is not None else None
+    if city is None:
+        if reject_typos and city_catalog is not None and ',' not in city_name and city_catalog.suggest(city_name, 1):
+            return city_name.strip(), None, []
+        return city_name.strip(), None, [('q', city_name)]
+    return city_catalog.label(city), city.id, [('id', city.id), ('q', f'{city.name},{city.country}')]
+
+
+def link_catalog_ids() -> int:
+    """
+    Set catalog id of cities of @City stored without it, if @find_city finds them in catalog
+    and other city with the id is not stored
+
+    :Return number of linked cities
+    """
+
+    with app.app_context():
+        taken = {catalog_id for catalog_id, in db.session.query(City.catalog_id).filter(City.catalog_id.isnot(None))}
+        linked = 0
+        for city in City.query.filter(City.catalog_id.is_(None)):
+            catalog_id = find_city(city.name)[1]
+            if catalog_id is not None and catalog_id not in taken:
+                city.catalog_id = catalog_id
+                taken.add(catalog_id)
+                linked += 1
+        db.session.commit()
+        return linked
+
+
+if city_catalog is not None:
+    link_catalog_ids()
+
+
+def resolve_cities(city_names: List[str]) -> Dict[str, List[Tuple[str, Union[int, str]]]]:
+    """
+    Get query parameters of weather API by names, look @find_city
+    """
+
+    return {name: find_city(name)[2] for name in city_names}
+
+
+def fetch_city(city_name: str, fresh: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Get current weather of city found by @find_city
+
+    :param city_name: name of city
+    :param fresh: skip lookup in cache
+    :Return json of weather or None if city is not found
+    """
+
+    return weather_client.fetch_first(find_city(city_name)[2], fresh)
+
+
+def not_found_message(city_name: str) -> str:
+    """
+    Message about unknown city with names of similar cities of @city_catalog.
+    Unless the name has country code, it tells how to add a city missing in catalog, look @find_city
+    """
+
+    similar = city_catalog.suggest(city_name, 3) if city_catalog is not None else []
+    if not similar:
+        return CITY_NOT_FOUND_MESSAGE
+    message = f'{CITY_NOT_FOUND_MESSAGE} Did you mean {" or ".join(city_catalog.label(city) for city in similar)}?'
+    return message if ',' in city_name else f'{message} If not, add country code after comma, e.g. "{city_name}, US".'
 
 
 def get_day_state(response: Dict[str, Any]) -> str:
@@ -69,12 +265,200 @@ def get_day_state(response: Dict[str, Any]) -> str:
         return 'night'
 
 
+def weather_values(response: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Get columns of @City from response of weather API
+
+    :param response: json from weather API
+    :Return values of temperature, day_state, state and updated_at
+    """
+
+    return {'temperature': int(response['main']['temp']),
+            'day_state': get_day_state(response),
+            'state': response['weather'][0]['main'],
+            'updated_at': datetime.utcnow()}
+
+
+def load_cities() -> List[Tuple[int, str]]:
+    """
+    Get ids and names of all stored cities for @RefreshScheduler
+    """
+
+    with app.app_context():
+        return [(city_id, name) for city_id, name in db.session.query(City.id, City.name)]
+
+
+def save_weather(updates: List[Tuple[int, Dict[str, Any]]]) -> None:
+    """
+    Write refreshed weather of cities in one transaction. Cities deleted meanwhile are skipped
+
+    :param updates: list of (id of city, json from weather API)
+    """
+
+    statement = City.__table__.update().where(City.id == bindparam('city_id')).values(
+        temperature=bindparam('new_temperature'), day_state=bindparam('new_day_state'),
+        state=bindparam('new_state'), updated_at=bindparam('new_updated_at'))
+    rows = [{'city_id': city_id, **{f'new_{key}': value for key, value in weather_values(response).items()}}
+            for city_id, response in updates]
+    with app.app_context():
+        db.session.execute(statement, rows)
+        db.session.commit()
+
+
+refresh_scheduler = RefreshScheduler(load_cities, partial(fetch_city, fresh=True), save_weather,
+                                     app.config['WEATHER_REFRESH_INTERVAL'], app.config['WEATHER_REFRESH_WORKERS'],
+                                     app.config['WEATHER_API_RATE'], app.config['WEATHER_REFRESH_BATCH'])
+refresh_guard = RefreshGuard(app.config['REFRESH_API_MIN_INTERVAL'])
+# whether periodic refresh was started in this process, look @start_background_refresh
+background_refresh_started = False
+background_refresh_lock = threading.Lock()
+
+
+def start_background_refresh(start: Callable[[], None] = refresh_scheduler.start) -> bool:
+    """
+    Start periodic refresh of cities once per process. Called before every request, so it runs
+    under any WSGI server, and on startup of ASGI mode, which starts its own refresh instead of @refresh_scheduler
+
+    :param start: function starting the refresh
+    :Return True if refresh was started by this call
+    """
+
+    global background_refresh_started
+    if background_refresh_started:
+        return False
+    with background_refresh_lock:
+        if background_refresh_started:
+            return False
+        background_refresh_started = True
+    start()
+    return True
+
+
+@app.before_request
+def start_background_refresh_on_request() -> None:
+    """Start periodic refresh on the first request served by this process, look @start_background_refresh"""
+
+    if app.config['WEATHER_REFRESH_INTERVAL'] > 0:
+        start_background_refresh()
+
+
+API_FIELDS = ('id', 'name', 'temperature', 'day_state', 'state', 'updated_at')
+# sort columns with types of their values
+API_SORTS = {'id': int, 'name': str}
+
+# version of table @City and html of index page rendered for it
+rendered_index: Tuple[Optional[int], str] = (None, '')
+
+
+def city_version() -> Tuple[int, datetime]:
+    """
+    Get version counter of table @City and time of its last change, look @TableVersion
+    """
+
+    return db.session.query(TableVersion.version, TableVersion.modified_at).filter_by(name='city').one()
+
+
+def conditional_response(build: Callable[[], Response]) -> Response:
+    """
+    Answer 304 Not Modified without building response if client has the current representation.
+    ETag depends on version of table @City and on url of request, Last-Modified is time of the last change
+
+    :param build: function to build full response
+    """
+
+    version, modified_at = city_version()
+    etag = f'city-{version}-{zlib.crc32(request.full_path.encode("utf-8")):08x}'
+    last_modified = modified_at.replace(tzinfo=timezone.utc)
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    else:
+        not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+    response = Response(status=304) if not_modified else build()
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def encode_cursor(value: Any) -> str:
+    """Make opaque cursor of keyset pagination from value of sort column"""
+
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, kind: type) -> Any:
+    """
+    Get value of sort column from cursor made by @encode_cursor, raise ValueError if it is malformed
+
+    :param cursor: cursor from url
+    :param kind: type of sort column, int or str
+    """
+
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as error:
+        raise ValueError('Malformed cursor') from error
+    if not isinstance(value, kind) or isinstance(value, bool):
+        raise ValueError('Malformed cursor')
+    return value
+
+
+@app.route('/api/cities', methods=['GET'])
+def api_cities():
+    """
+    JSON list of cities by pages. Pagination is keyset: next page continues after the last sort key
+    of previous one, so deep pages cost as much as the first. Supports conditional requests
+
+    Query arguments: limit - number of cities in page
+                     fields - comma separated subset of @API_FIELDS, all by default
+                     sort - one of @API_SORTS
+                     after - cursor of page from "next" url of previous page
+    """
+
+    try:
+        limit = int(request.args.get('limit', app.config['API_PAGE_SIZE']))
+        if not 0 < limit <= app.config['API_MAX_PAGE_SIZE']:
+            raise ValueError(f'limit must be from 1 to {app.config["API_MAX_PAGE_SIZE"]}')
+        selected = [name for name in request.args.get('fields', ','.join(API_FIELDS)).split(',') if name]
+        unknown = set(selected) - set(API_FIELDS)
+        if unknown or not selected:
+            raise ValueError(f'fields must be a subset of {",".join(API_FIELDS)}')
+        sort = request.args.get('sort', 'id')
+        if sort not in API_SORTS:
+            raise ValueError(f'sort must be one of {",".join(API_SORTS)}')
+        after = decode_cursor(request.args['after'], API_SORTS[sort]) if 'after' in request.args else None
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+
+    def build() -> Response:
+        sort_column = getattr(City, sort)
+        query = db.session.query(*(getattr(City, name) for name in dict.fromkeys([sort, *selected])))
+        if after is not None:
+            query = query.filter(sort_column > after)
+        rows = query.order_by(sort_column).limit(limit + 1).all()
+        page = [{name: value.isoformat() if isinstance(value, datetime) else value
+                 for name, value in zip(row._fields, row) if name in selected} for row in rows[:limit]]
+        next_url = None
+        if len(rows) > limit:
+            next_url = url_for('api_cities', limit=limit, fields=','.join(selected), sort=sort,
+                               after=encode_cursor(getattr(rows[limit - 1], sort)))
+        return jsonify(cities=page, next=next_url)
+
+    return conditional_response(build)
+
+
 @app.route('/')
 def index():
     """
     Default index page, rendering index.html
+    Page without flashed messages is rendered once per version of table @City
     """
 
+    global rendered_index
+    version, _ = city_version()
+    cacheable = not session.get('_flashes')
+    if cacheable and rendered_index[0] == version:
+        return rendered_index[1]
     all_data = City.query.all()
     cities = marshal(all_data, fields)
     args = dict()
@@ -83,35 +467,317 @@ def index():
                               'degrees': city['temperature'],
                               'state_day': city['day_state'],
                               'id': city['id']}
-    return render_template('index.html', args=args)
+    html = render_template('index.html', args=args)
+    if cacheable:
+        rendered_index = version, html
+    return html
 
 
 @app.route('/add', methods=['POST'])
 def add_city():
     """
     Add city to database @City
-    Expect city_name from input form
+    Expect city_name from input form, it is normalized by @find_city before call of weather API
     """
 
     city_name = request.form['city_name']
-    db_city = City.query.filter_by(name=city_name).first()
+    name, catalog_id, queries = find_city(city_name, reject_typos=True)
 
-    if db_city:
-        flash('The city has already been added to the list!')
+    if city_exists(name, catalog_id):
+        flash(CITY_EXISTS_MESSAGE)
     else:
-        response = requests.get(BASE_URL + f'{city_name}&appid={API_KEY}&units=metric').json()
-        if int(response['cod']) == 404:
-            flash("The city doesn't exist!")
-        else:
-            day_state = get_day_state(response)
-            db.session.add(City(name=city_name,
-                                temperature=int(response['main']['temp']),
-                                day_state=day_state,
-                                state=response['weather'][0]['main']))
-            db.session.commit()
+        try:
+            response = weather_client.fetch_first(queries)
+        except WeatherAPIError:
+            flash(SERVICE_UNAVAILABLE_MESSAGE)
+            return redirect(url_for('index'))
+        if response is None:
+            flash(not_found_message(city_name))
+        elif not store_city(name, response):
+            flash(CITY_EXISTS_MESSAGE)
     return redirect(url_for('index'))
 
 
+def stored_cities(cities: Dict[str, Optional[int]]) -> Set[str]:
+    """
+    Find cities stored in @City by name or by catalog id
+
+    :param cities: catalog id or None by name of city
+    :Return names of stored cities
+    """
+
+    ids = {catalog_id: name for name, catalog_id in cities.items() if catalog_id is not None}
+    stored = set()
+    for name, catalog_id in db.session.query(City.name, City.catalog_id).filter(
+            or_(City.name.in_(list(cities)), City.catalog_id.in_(list(ids)))):
+        if name in cities:
+            stored.add(name)
+        if catalog_id in ids:
+            stored.add(ids[catalog_id])
+    return stored
+
+
+def city_exists(city_name: str, catalog_id: Optional[int] = None) -> bool:
+    """
+    Check if city is stored in @City by name or by catalog id
+    """
+
+    return bool(stored_cities({city_name: catalog_id}))
+
+
+def new_city(city_name: str, response: Dict[str, Any]) -> City:
+    """
+    Make row of @City, catalog id is id of city in answer of weather API
+    """
+
+    return City(name=city_name, catalog_id=response.get('id'), **weather_values(response))
+
+
+def store_city(city_name: str, response: Dict[str, Any]) -> bool:
+    """
+    Insert city into @City
+
+    :param city_name: name of city
+    :param response: json from weather API
+    :Return False if the city was added by concurrent request meanwhile, by name or by catalog id
+    """
+
+    db.session.add(new_city(city_name, response))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return True
+
+
+def import_cities(city_names: List[str], timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Add many cities at once. Names are normalized by @find_city and deduplicated against @City
+    by name and catalog id in one query, weather is fetched concurrently with shared rate limit
+    of @refresh_scheduler and all found cities are inserted in one transaction.
+    Only calls of API take slots of rate limit, answers of cache do not. Cities whose slot would come
+    later than @timeout are deferred, so request of many cities ends in time and can be repeated for the rest
+
+    :param city_names: names of cities
+    :param timeout: seconds to wait for slots of rate limit, no limit if None
+    :Return report with results - list of {name, status[, error]} in order of @city_names,
+            status is one of added, exists, duplicate, not_found, deferred, failed; and number of cities by status
+    """
+
+    results, statuses, queries = prepare_import(city_names)
+    limiter = refresh_scheduler.limiter
+    remaining = limiter.deadline(timeout)
+
+    def fetch(name: str) -> Optional[Dict[str, Any]]:
+        return weather_client.fetch_first(queries[name], throttle=lambda: limiter.wait(remaining()))
+
+    fetched = fetch_concurrently(list(queries), fetch, app.config['WEATHER_REFRESH_WORKERS'])
+    return finish_import(results, statuses, fetched)
+
+
+def prepare_import(city_names: List[str]) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]],
+                                                   Dict[str, List[Tuple[str, Union[int, str]]]]]:
+    """
+    Normalize and deduplicate names and find stored cities, the first step of @import_cities.
+    Names of one city in catalog, e.g. "London" and "London, GB", are normalized to the same name
+
+    :param city_names: names of cities
+    :Return results in order of @city_names, result by distinct normalized name
+            and query parameters of weather API by normalized name of city to fetch, look @find_city.
+            Mistyped names get no query, so they are not found without call of weather API
+    """
+
+    names = [name.strip() for name in city_names if name.strip()]
+    statuses: Dict[str, Dict[str, Any]] = {}
+    catalog_ids: Dict[str, Optional[int]] = {}
+    queries: Dict[str, List[Tuple[str, Union[int, str]]]] = {}
+    results = []
+    for name in names:
+        found_name, catalog_id, query = find_city(name, reject_typos=True)
+        if found_name in statuses:
+            results.append({'name': found_name, 'status': 'duplicate'})
+        else:
+            statuses[found_name] = {'name': found_name, 'status': None}
+            catalog_ids[found_name] = catalog_id
+            queries[found_name] = query
+            results.append(statuses[found_name])
+    for name in stored_cities(catalog_ids):
+        statuses[name]['status'] = 'exists'
+    return results, statuses, {name: query for name, query in queries.items() if statuses[name]['status'] is None}
+
+
+def finish_import(results: List[Dict[str, Any]], statuses: Dict[str, Dict[str, Any]],
+                  fetched: Dict[str, Union[Dict[str, Any], None, Exception]]) -> Dict[str, Any]:
+    """
+    Insert found cities in one transaction and count results, the last step of @import_cities
+
+    :param results: results made by @prepare_import
+    :param statuses: result by distinct normalized name made by @prepare_import
+    :param fetched: json of weather, None or exception by name, look @fetch_concurrently
+    :Return report of @import_cities
+    """
+
+    new_cities: Dict[str, City] = {}
+    new_ids: Set[int] = set()
+    for name in fetched:
+        response = fetched[name]
+        if isinstance(response, RateLimitTimeout):
+            statuses[name].update(status='deferred', error=str(response))
+        elif isinstance(response, Exception):
+            statuses[name].update(status='failed', error=str(response))
+        elif response is None:
+            statuses[name]['status'] = 'not_found'
+        elif response.get('id') in new_ids:  # other name of city, e.g. one missing in catalog
+            statuses[name]['status'] = 'duplicate'
+        else:
+            new_cities[name] = new_city(name, response)
+            if response.get('id') is not None:
+                new_ids.add(response['id'])
+    try:
+        db.session.add_all(new_cities.values())
+        db.session.commit()
+    except IntegrityError:  # some cities were added by concurrent request meanwhile
+        db.session.rollback()
+        added = stored_cities({name: fetched[name].get('id') for name in new_cities})
+        for name in added:
+            statuses[name]['status'] = 'exists'
+        db.session.add_all(new_city(name, fetched[name]) for name in new_cities if name not in added)
+        db.session.commit()
+    for name in new_cities:
+        if statuses[name]['status'] is None:
+            statuses[name]['status'] = 'added'
+    counts: Dict[str, int] = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return {'results': results, 'counts': counts}
+
+
+@app.route('/add/bulk', methods=['POST'])
+def add_cities_bulk():
+    """
+    Add many cities to database @City, look @import_cities
+    Expect json list of names or {"cities": [...]}, or city_names from form separated by newlines or commas
+    """
+
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('cities')
+    else:
+        data = re.split(r'[\n,]', request.form.get('city_names', ''))
+    error = check_city_names(data)
+    if error is not None:
+        return jsonify(error=error[0]), error[1]
+    return jsonify(import_cities(data, app.config['WEATHER_BULK_TIMEOUT']))
+
+
+def check_city_names(data: Any) -> Optional[Tuple[str, int]]:
+    """
+    Validate names given to @add_cities_bulk
+
+    :param data: parsed body of request
+    :Return message and HTTP status of error or None if names are valid
+    """
+
+    if not isinstance(data, list) or not all(isinstance(name, str) for name in data):
+        return 'Expected list of city names', 400
+    if len(data) > app.config['WEATHER_BULK_LIMIT']:
+        return f'At most {app.config["WEATHER_BULK_LIMIT"]} cities per request', 413
+    return None
+
+
+def refresh_status(status: str) -> Dict[str, Any]:
+    """
+    Describe manual refresh for @api_refresh
+
+    :param status: started, running or idle
+    :Return json with status and report of the last finished refresh, null before the first one
+    """
+
+    return {'status': status, 'last_report': refresh_scheduler.last_report}
+
+
+def refresh_authorized(authorization: Optional[str]) -> bool:
+    """
+    Check bearer token of refresh API if REFRESH_API_TOKEN is set
+
+    :param authorization: value of Authorization header or None
+    """
+
+    token = app.config['REFRESH_API_TOKEN']
+    return not token or hmac.compare_digest((authorization or '').encode('utf-8'), f'Bearer {token}'.encode('utf-8'))
+
+
+def check_refresh_request(authorization: Optional[str]) -> Optional[Tuple[Dict[str, Any], int, Dict[str, str]]]:
+    """
+    Authorize and admit manual refresh of @api_refresh. On success @refresh_guard is acquired
+    and caller has to release it when the refresh finishes
+
+    :param authorization: value of Authorization header or None
+    :Return json, HTTP status and headers of answer if refresh may not start, else None
+    """
+
+    if not refresh_authorized(authorization):
+        return {'error': 'Invalid refresh token'}, 401, {'WWW-Authenticate': 'Bearer'}
+    wait = refresh_guard.acquire()
+    if wait > 0 and refresh_guard.running:
+        return refresh_status('running'), 202, {}
+    if wait > 0:
+        return {'error': 'Refresh was done recently, try again later'}, 429, {'Retry-After': str(math.ceil(wait))}
+    return None
+
+
+@app.route('/api/autocomplete', methods=['GET'])
+def api_autocomplete():
+    """
+    Complete typed name of city by local @city_catalog, for input of index page. See @CityCatalog.complete
+
+    Query arguments: q - typed part of name
+                     limit - number of cities, 10 by default
+    """
+
+    if city_catalog is None:
+        return jsonify(error='City catalog is disabled'), 404
+    try:
+        limit = int(request.args.get('limit', 10))
+        if not 0 < limit <= app.config['AUTOCOMPLETE_MAX_LIMIT']:
+            raise ValueError
+    except ValueError:
+        return jsonify(error=f'limit must be from 1 to {app.config["AUTOCOMPLETE_MAX_LIMIT"]}'), 400
+    cities = city_catalog.complete(request.args.get('q', ''), limit)
+    response = jsonify(cities=[city_json(city, city_catalog.label(city)) for city in cities])
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response
+
+
+@app.route('/api/refresh', methods=['POST'])
+def api_refresh():
+    """
+    Start refresh of weather of all stored cities in background, look @RefreshScheduler.run_once,
+    and answer 202 with @refresh_status at once. If a refresh is running, no other one is started.
+    Protected and rate limited by @check_refresh_request
+    """
+
+    error = check_refresh_request(request.headers.get('Authorization'))
+    if error is not None:
+        return jsonify(error[0]), error[1], error[2]
+    refresh_scheduler.run_in_background(refresh_guard.release)
+    return jsonify(refresh_status('started')), 202
+
+
+@app.route('/api/refresh', methods=['GET'])
+def api_refresh_status():
+    """
+    Tell if refresh started by @api_refresh is running and report of the last one, look @refresh_status
+    """
+
+    if not refresh_authorized(request.headers.get('Authorization')):
+        return jsonify(error='Invalid refresh token'), 401, {'WWW-Authenticate': 'Bearer'}
+    return jsonify(refresh_status('running' if refresh_guard.running else 'idle'))
+
+
 @app.route('/delete/<city_id>', methods=['GET'])
 def delete_city(city_id):
     """
@@ -126,6 +792,39 @@ def delete_city(city_id):
     return redirect(url_for('index'))
 
 
+@app.cli.command('refresh')
+def refresh_command():
+    """
+    Refresh weather of all stored cities once
+    """
+
+    print(refresh_scheduler.run_once())
+
+
+@app.cli.command('load-catalog')
+@click.argument('path', required=False)
+def load_catalog_command(path):
+    """
+    Replace city catalog by csv file or by city.list.json(.gz) of OpenWeatherMap, CITY_CATALOG by default
+    """
+
+    path = path or app.config['CITY_CATALOG'] or DEFAULT_CATALOG
+    print(f'Loaded {(city_catalog or CityCatalog(db.engine)).load(path)} cities from {path}')
+
+
+@app.cli.command('import-cities')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+def import_cities_command(source):
+    """
+    Add cities listed in file one per line, use - for stdin
+    """
+
+    report = import_cities(source.read().splitlines())
+    for result in report['results']:
+        print(f'{result["name"]}: {result["status"]}' + (f' ({result["error"]})' if 'error' in result else ''))
+    print(', '.join(f'{status}: {count}' for status, count in report['counts'].items()))
+
+
 if __name__ == '__main__':
     if len(sys.argv) > 1:
         arg_host, arg_port = sys.argv[1].split(':')
@@ -0,0 +1,478 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs
+import asyncio
+import contextvars
+import io
+import json
+import logging
+import re
+import sys
+import time
+
+import aiohttp
+from flask import flash, redirect, url_for
+
+from app import (API_KEY, BASE_URL, CITY_EXISTS_MESSAGE, SERVICE_UNAVAILABLE_MESSAGE, app, check_city_names,
+                 check_refresh_request, city_exists, find_city, finish_import, instrumentation, load_cities,
+                 not_found_message, prepare_import, refresh_guard, refresh_scheduler, refresh_status, resolve_cities,
+                 save_weather, start_background_refresh, store_city, weather_cache)
+from refresh import RateLimiter
+from weather_cache import CacheEntry, WeatherAPIError, WeatherCache, WeatherClient
+
+
+logger = logging.getLogger(__name__)
+
+# HTTP status, headers and body of response
+Answer = Tuple[int, List[Tuple[str, str]], bytes]
+
+
+class AsyncWeatherClient:
+    """
+    Non-blocking twin of @WeatherClient over aiohttp connection pool, shares @WeatherCache with it.
+    Lookups of persistent store of cache are run by @executor
+    """
+
+    def __init__(self, base_url: str, api_key: Optional[str], cache: Optional[WeatherCache] = None,
+                 timeout: Tuple[float, float] = (3.05, 10.0), max_connections: int = 100, retries: int = 0,
+                 backoff: float = 0.5, observer: Optional[Callable[[float, str], None]] = None,
+                 executor: Optional[ThreadPoolExecutor] = None):
+        """
+        :param base_url: url of endpoint of current weather, e.g. of local stub server
+        :param api_key: appid of API
+        :param cache: cache of answers or None to always call API
+        :param timeout: seconds to connect and to read answer, the latter also limits wait for free connection
+        :param max_connections: number of concurrent connections, they are kept alive
+        :param retries: number of repeats of request after retryable error
+        :param backoff: seconds to wait before the first repeat, doubled for each next one
+        :param observer: function called after every call of API with its seconds and HTTP status or name of error
+        :param executor: pool of threads to access persistent store of cache
+        """
+
+        self.base_url = base_url
+        self.api_key = api_key
+        self.cache = cache
+        self.retries = retries
+        self.backoff = backoff
+        self.observer = observer
+        self.executor = executor
+        self.timeout = aiohttp.ClientTimeout(connect=timeout[1], sock_connect=timeout[0], sock_read=timeout[1])
+        self.max_connections = max_connections
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def request(self, params: Dict[str, Any], throttle: Optional[Callable[[], Awaitable[None]]] = None
+                      ) -> Tuple[int, Dict[str, Any]]:
+        """
+        Call API bypassing cache, look @WeatherClient.request. @throttle is awaited before every attempt
+        """
+
+        attempt = 0
+        while True:
+            if throttle is not None:
+                await throttle()
+            try:
+                return await self.request_once(params)
+            except WeatherAPIError as error:
+                if not error.retryable or attempt >= self.retries:
+                    raise
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    async def request_once(self, params: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """
+        Call API once, look @WeatherClient.request_once
+        """
+
+        if self.session is None:  # session binds to running loop, so it is made by the first call
+            self.session = aiohttp.ClientSession(timeout=self.timeout,
+                                                 connector=aiohttp.TCPConnector(limit=self.max_connections))
+        query = {key: value for key, value in {**params, 'appid': self.api_key, 'units': 'metric'}.items()
+                 if value is not None}
+        start = time.perf_counter()
+        try:
+            async with self.session.get(self.base_url, params=query) as response:
+                status, body = response.status, await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            if self.observer is not None:
+                self.observer(time.perf_counter() - start, type(error).__name__)
+            # message of error contains url with api key, keep its type only
+            raise WeatherAPIError(f'Weather API is unreachable: {type(error).__name__}', retryable=True) from error
+        if self.observer is not None:
+            self.observer(time.perf_counter() - start, str(status))
+        return WeatherClient.read_answer(status, lambda: json.loads(body))
+
+    async def fetch(self, kind: str, value: Union[int, str], fresh: bool = False,
+                    throttle: Optional[Callable[[], Awaitable[None]]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get current weather from cache or API, look @WeatherClient.fetch
+        """
+
+        key = WeatherCache.key(kind, value)
+        entry = None
+        if self.cache is not None and not fresh:
+            entry = await self.in_executor(self.cache.get, key)
+        if entry is None:
+            status, payload = await self.request({kind: value}, throttle)
+            if self.cache is not None:
+                entry = await self.in_executor(self.cache.put, key, status, payload)
+            else:
+                entry = CacheEntry(status, payload, 0)
+        return entry.payload if entry.status == 200 else None
+
+    async def fetch_first(self, queries: List[Tuple[str, Union[int, str]]], fresh: bool = False,
+                          throttle: Optional[Callable[[], Awaitable[None]]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get current weather by the first query which finds city, look @WeatherClient.fetch_first
+        """
+
+        for kind, value in queries:
+            payload = await self.fetch(kind, value, fresh, throttle)
+            if payload is not None:
+                return payload
+        return None
+
+    async def fetch_by_name(self, city_name: str, fresh: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Get current weather of city by name, look @fetch
+        """
+
+        return await self.fetch('q', city_name, fresh)
+
+    async def in_executor(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Call function of cache, in @executor if cache has persistent store which blocks.
+        It runs in copy of current context, so its queries are counted for current request
+        """
+
+        if self.cache is None or self.cache.store is None:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, contextvars.copy_context().run,
+                                                                func, *args)
+
+    async def aclose(self) -> None:
+        """Close connections of pool"""
+
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+def wsgi_environ(scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+    """
+    Make WSGI environ of ASGI http request
+
+    :param scope: ASGI connection scope
+    :param body: whole body of request
+    """
+
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1').upper().replace('-', '_'), value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        if name in environ:
+            value = f'{environ[name]}{"; " if name == "HTTP_COOKIE" else ","}{value}'
+        environ[name] = value
+    return environ
+
+
+def call_wsgi(wsgi_app: Callable[..., Any], environ: Dict[str, Any]) -> Answer:
+    """
+    Call WSGI app and collect its whole response
+
+    :param wsgi_app: WSGI callable, e.g. flask app
+    :param environ: environ of request
+    """
+
+    started: List[Any] = []
+    chunks: List[bytes] = []
+
+    def start_response(status: str, headers: List[Tuple[str, str]], exc_info: Any = None) -> Callable[[bytes], None]:
+        started[:] = [int(status.split(' ', 1)[0]), headers]
+        return chunks.append
+
+    result = wsgi_app(environ, start_response)
+    try:
+        chunks.extend(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return started[0], started[1], b''.join(chunks)
+
+
+def json_answer(data: Any, status: int = 200) -> Answer:
+    """Answer with json body"""
+
+    return status, [('Content-Type', 'application/json')], json.dumps(data).encode('utf-8')
+
+
+class WeatherASGI:
+    """
+    ASGI serving mode of flask @app. Routes which call weather API - add, bulk add and refresh of cities -
+    are handled natively: handlers await @AsyncWeatherClient, so slow upstream does not hold a thread,
+    and their database work is run by pool of @db_workers threads. Other routes are delegated to flask
+    on the same pool. Native routes are measured by @Instrumentation like flask ones; their profile covers
+    the event loop thread, where other requests may run meanwhile, but not the pool.
+    Serve by any ASGI server, e.g. uvicorn asgi:application
+    """
+
+    def __init__(self, db_workers: int = 4, max_connections: int = 100, refresh_interval: float = 0.0,
+                 limiter: Optional[RateLimiter] = None):
+        """
+        :param db_workers: number of threads for database and delegated flask requests
+        :param max_connections: number of concurrent calls of weather API
+        :param refresh_interval: seconds between refreshes of all cities in background, 0 disables them
+        :param limiter: limiter of rate of calls of weather API shared with other clients, no limit if omitted
+        """
+
+        self.executor = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix='weather-db')
+        self.client = AsyncWeatherClient(BASE_URL, API_KEY, weather_cache, (3.05, app.config['WEATHER_API_TIMEOUT']),
+                                         max_connections, app.config['WEATHER_API_RETRIES'],
+                                         observer=instrumentation.observe_upstream, executor=self.executor)
+        self.max_connections = max_connections
+        self.fetch_slots: Optional[asyncio.Semaphore] = None
+        self.refresh_interval = refresh_interval
+        self.limiter = limiter or RateLimiter(0)
+        self.refresh_task: Optional[asyncio.Task] = None
+        self.manual_refresh_task: Optional[asyncio.Task] = None
+        self.routes: Dict[Tuple[str, str], Callable[[Dict[str, Any], bytes], Awaitable[Answer]]] = {
+            ('POST', '/add'): self.add_city,
+            ('POST', '/add/bulk'): self.add_cities_bulk,
+            ('POST', '/api/refresh'): self.api_refresh,
+        }
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable[[], Awaitable[Dict[str, Any]]],
+                       send: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f'Unsupported ASGI scope {scope["type"]}')
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body = b''.join(chunks)
+        environ = wsgi_environ(scope, body)
+        handler = self.routes.get((scope['method'], scope['path']))
+        if handler is None:
+            status, headers, body = await self.run_blocking(call_wsgi, app, environ)
+        else:
+            record = instrumentation.start()
+            try:
+                status, headers, body = await handler(environ, body)
+            except Exception:
+                logger.exception('Request %s %s failed', scope['method'], scope['path'])
+                status, headers, body = 500, [('Content-Type', 'text/plain')], b'Internal Server Error'
+            query = environ['QUERY_STRING']
+            instrumentation.finish(record, scope['path'], scope['method'], status,
+                                   f'{scope["path"]}?{query}' if query else scope['path'], handler.__name__)
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                for name, value in headers]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def lifespan(self, receive: Callable[[], Awaitable[Dict[str, Any]]],
+                       send: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+        """Start refreshes in background on startup, stop them and close pools on shutdown"""
+
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if self.refresh_interval > 0:
+                    start_background_refresh(self.start_refresh_forever)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.refresh_task is not None:
+                    self.refresh_task.cancel()
+                await self.client.aclose()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def run_blocking(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Call blocking function by pool of threads, in copy of current context to count its queries for request"""
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, contextvars.copy_context().run,
+                                                                func, *args)
+
+    async def run_db(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Call function using database by pool of threads, inside app context"""
+
+        def call() -> Any:
+            with app.app_context():
+                return func(*args)
+
+        return await self.run_blocking(call)
+
+    async def fetch_many(self, queries: Dict[str, List[Tuple[str, Union[int, str]]]], fresh: bool = False,
+                         timeout: Optional[float] = None) -> Dict[str, Union[Dict[str, Any], None, Exception]]:
+        """
+        Fetch weather of many cities concurrently, look @fetch_concurrently. Concurrency is bounded
+        by @max_connections over all requests and calls of API, but not answers of cache, are staggered by @limiter
+
+        :param queries: query parameters of weather API to try in order by name of city, look @find_city
+        :param fresh: skip lookup in cache
+        :param timeout: seconds to wait for slots of @limiter, @RateLimitTimeout is the result of cities
+                        whose slot comes later. No limit if None
+        """
+
+        if self.fetch_slots is None:  # semaphore binds to running loop before python 3.10
+            self.fetch_slots = asyncio.Semaphore(self.max_connections)
+        remaining = self.limiter.deadline(timeout)
+
+        async def throttle() -> None:
+            delay = self.limiter.reserve(remaining())
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        async def fetch_limited(city_queries: List[Tuple[str, Union[int, str]]]) -> Optional[Dict[str, Any]]:
+            async with self.fetch_slots:
+                return await self.client.fetch_first(city_queries, fresh, throttle)
+
+        results = await asyncio.gather(*(fetch_limited(query) for query in queries.values()), return_exceptions=True)
+        return dict(zip(queries, results))
+
+    async def add_city(self, environ: Dict[str, Any], body: bytes) -> Answer:
+        """Add city from form, look @app.add_city"""
+
+        form = parse_qs(body.decode('utf-8', 'replace'))
+        if 'city_name' not in form:
+            return 400, [('Content-Type', 'text/plain')], b'Bad Request'
+        city_name = form['city_name'][0]
+        name, catalog_id, queries = await self.run_blocking(find_city, city_name, True)
+        if await self.run_db(city_exists, name, catalog_id):
+            return await self.run_blocking(self.redirect_to_index, environ, CITY_EXISTS_MESSAGE)
+        try:
+            response = await self.client.fetch_first(queries)
+        except WeatherAPIError:
+            return await self.run_blocking(self.redirect_to_index, environ, SERVICE_UNAVAILABLE_MESSAGE)
+        message = None
+        if response is None:
+            message = await self.run_blocking(not_found_message, city_name)
+        elif not await self.run_db(store_city, name, response):
+            message = CITY_EXISTS_MESSAGE
+        return await self.run_blocking(self.redirect_to_index, environ, message)
+
+    @staticmethod
+    def redirect_to_index(environ: Dict[str, Any], message: Optional[str]) -> Answer:
+        """Redirect to index page by flask, flashing message into session cookie"""
+
+        with app.request_context(environ):
+            if message is not None:
+                flash(message)
+            response = app.process_response(redirect(url_for('index')))
+        return response.status_code, response.headers.to_wsgi_list(), response.get_data()
+
+    async def add_cities_bulk(self, environ: Dict[str, Any], body: bytes) -> Answer:
+        """Add many cities, look @app.add_cities_bulk and @app.import_cities"""
+
+        if environ.get('CONTENT_TYPE', '').split(';')[0].strip() == 'application/json':
+            try:
+                data = json.loads(body)
+            except ValueError:
+                data = None
+            if isinstance(data, dict):
+                data = data.get('cities')
+        else:
+            form = parse_qs(body.decode('utf-8', 'replace'))
+            data = re.split(r'[\n,]', form.get('city_names', [''])[0])
+        error = await self.run_db(check_city_names, data)
+        if error is not None:
+            return json_answer({'error': error[0]}, error[1])
+        results, statuses, queries = await self.run_db(prepare_import, data)
+        fetched = await self.fetch_many(queries, timeout=app.config['WEATHER_BULK_TIMEOUT'])
+        return json_answer(await self.run_db(finish_import, results, statuses, fetched))
+
+    async def refresh(self) -> Dict[str, Any]:
+        """
+        Refresh all stored cities now, look @RefreshScheduler.run_once
+
+        :Return report with numbers of cities, refreshed, not found and failed ones and time spent
+        """
+
+        start = time.perf_counter()
+        cities = await self.run_blocking(load_cities)
+        queries = await self.run_blocking(resolve_cities, [name for _, name in cities])
+        fetched = await self.fetch_many(queries, fresh=True)
+        report = {'cities': len(cities), 'refreshed': 0, 'not_found': 0, 'failed': 0}
+        updates = []
+        for city_id, name in cities:
+            payload = fetched.get(name)
+            if isinstance(payload, Exception):
+                logger.warning('Refresh of city %s failed: %s', city_id, payload)
+                report['failed'] += 1
+            elif payload is None:
+                report['not_found'] += 1
+            else:
+                updates.append((city_id, payload))
+        batch_size = app.config['WEATHER_REFRESH_BATCH']
+        for i in range(0, len(updates), batch_size):
+            await self.run_blocking(save_weather, updates[i:i + batch_size])
+            report['refreshed'] += len(updates[i:i + batch_size])
+        report['seconds'] = time.perf_counter() - start
+        refresh_scheduler.last_report = report
+        return report
+
+    def start_refresh_forever(self) -> None:
+        """Start @refresh_forever in the event loop"""
+
+        self.refresh_task = asyncio.create_task(self.refresh_forever())
+
+    async def refresh_forever(self) -> None:
+        """Refresh all cities every @refresh_interval seconds"""
+
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                report = await self.refresh()
+            except Exception:
+                logger.exception('Refresh of cities failed')
+            else:
+                logger.info('Refreshed weather of cities: %s', report)
+
+    async def refresh_and_release(self) -> None:
+        """Refresh all cities for @api_refresh, then release @refresh_guard"""
+
+        try:
+            await self.refresh()
+        except Exception:
+            logger.exception('Refresh of cities failed')
+        finally:
+            refresh_guard.release()
+
+    async def api_refresh(self, environ: Dict[str, Any], body: bytes) -> Answer:
+        """Start refresh of weather of all stored cities in background, look @app.api_refresh"""
+
+        error = check_refresh_request(environ.get('HTTP_AUTHORIZATION'))
+        if error is not None:
+            status, headers, body = json_answer(error[0], error[1])
+            return status, headers + list(error[2].items()), body
+        self.manual_refresh_task = asyncio.create_task(self.refresh_and_release())
+        return json_answer(refresh_status('started'), 202)
+
+
+application = WeatherASGI(app.config['ASYNC_DB_WORKERS'], app.config['ASYNC_MAX_CONNECTIONS'],
+                          app.config['WEATHER_REFRESH_INTERVAL'], refresh_scheduler.limiter)
@@ -0,0 +1,269 @@
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import unicodedata
+
+from sqlalchemy import (Column, Float, Integer, MetaData, String, Table, and_, bindparam, func, literal_column,
+                        select)
+from sqlalchemy.engine import Engine
+
+
+DEFAULT_CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'cities.csv.gz')
+
+
+class CatalogCity(NamedTuple):
+    """City of catalog, id is the city id of weather API"""
+
+    id: int
+    name: str
+    country: str
+    population: int
+    latitude: float
+    longitude: float
+
+
+def normalize_name(name: str) -> str:
+    """
+    Make search key of name: without diacritics and case, words of letters and digits joined by single space,
+    so "São-Paulo" and "sao paulo" have the same key
+
+    :param name: name of city or typed part of it
+    """
+
+    decomposed = unicodedata.normalize('NFKD', name)
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(re.findall(r'\w+', stripped.casefold().replace('_', ' ')))
+
+
+def word_suffixes(key: str) -> List[str]:
+    """Keys to find name by prefix of any its word: "new york city", "york city" and "city" """
+
+    words = key.split(' ')
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+def trigrams(key: str) -> Set[str]:
+    """Trigrams of key padded with spaces, so short keys and starts of words weigh more"""
+
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def read_catalog(path: str) -> Iterator[CatalogCity]:
+    """
+    Read cities from csv with columns of @CatalogCity or from city.list.json of OpenWeatherMap, optionally gzipped
+
+    :param path: path to .csv, .json, .csv.gz or .json.gz file
+    """
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as binary:
+        text = io.TextIOWrapper(binary, encoding='utf-8', newline='')
+        if path.rsplit('.gz', 1)[0].endswith('.json'):
+            for city in json.load(text):
+                yield CatalogCity(int(city['id']), city['name'], city.get('country', ''),
+                                  int(city.get('population', 0)), float(city['coord']['lat']),
+                                  float(city['coord']['lon']))
+        else:
+            for row in csv.DictReader(text):
+                yield CatalogCity(int(row['id']), row['name'], row['country'], int(row['population'] or 0),
+                                  float(row['latitude']), float(row['longitude']))
+
+
+class CityCatalog:
+    """
+    Local catalog of cities in tables of the app database, to validate names and to complete them
+    without calls of weather API. Names are indexed by normalized prefixes of their words
+    and by trigrams for lookups tolerant to typos
+    """
+
+    metadata = MetaData()
+    cities = Table('catalog_city', metadata,
+                   Column('id', Integer, primary_key=True, autoincrement=False),
+                   Column('name', String(200), nullable=False),
+                   Column('country', String(2), nullable=False),
+                   Column('population', Integer, nullable=False),
+                   Column('latitude', Float, nullable=False),
+                   Column('longitude', Float, nullable=False),
+                   Column('search_key', String(200), nullable=False, index=True),
+                   Column('trigrams', Integer, nullable=False))
+    prefixes = Table('catalog_prefix', metadata,
+                     Column('key', String(200), primary_key=True),
+                     Column('city_id', Integer, primary_key=True),
+                     sqlite_with_rowid=False)
+    trigram_index = Table('catalog_trigram', metadata,
+                          Column('trigram', String(3), primary_key=True),
+                          Column('city_id', Integer, primary_key=True),
+                          sqlite_with_rowid=False)
+    sources = Table('catalog_source', metadata,
+                    Column('signature', String(300), primary_key=True))
+
+    def __init__(self, engine: Engine, min_similarity: float = 0.4):
+        """
+        :param engine: engine of the app database, tables are created if they are missing
+        :param min_similarity: share of common trigrams of names, from 0 to 1, for suggestions
+        """
+
+        self.engine = engine
+        self.min_similarity = min_similarity
+        self.metadata.create_all(engine)
+
+    def load(self, path: str) -> int:
+        """
+        Replace catalog by cities of file in one transaction, look @read_catalog
+
+        :param path: path to file
+        :Return number of loaded cities
+        """
+
+        cities, prefix_rows, trigram_rows = [], [], []
+        for city in read_catalog(path):
+            key = normalize_name(city.name)
+            if not key:
+                continue
+            city_trigrams = trigrams(key)
+            cities.append({**city._asdict(), 'search_key': key, 'trigrams': len(city_trigrams)})
+            prefix_rows.extend({'key': suffix, 'city_id': city.id} for suffix in dict.fromkeys(word_suffixes(key)))
+            trigram_rows.extend({'trigram': trigram, 'city_id': city.id} for trigram in city_trigrams)
+        with self.engine.begin() as connection:
+            for table in (self.cities, self.prefixes, self.trigram_index, self.sources):
+                connection.execute(table.delete())
+            connection.execute(self.cities.insert().prefix_with('OR REPLACE'), cities)
+            connection.execute(self.prefixes.insert().prefix_with('OR IGNORE'), prefix_rows)
+            connection.execute(self.trigram_index.insert().prefix_with('OR IGNORE'), trigram_rows)
+            connection.execute(self.sources.insert(), {'signature': self.signature(path)})
+        return len(cities)
+
+    def ensure_loaded(self, path: str) -> bool:
+        """
+        Load file unless the catalog was loaded from it already
+
+        :param path: path to file
+        :Return True if file was loaded now
+        """
+
+        with self.engine.connect() as connection:
+            loaded = connection.execute(select(self.sources.c.signature)).scalar()
+        if loaded == self.signature(path):
+            return False
+        self.load(path)
+        return True
+
+    @staticmethod
+    def signature(path: str) -> str:
+        """Identify version of file by its name, size and time of change"""
+
+        stat = os.stat(path)
+        return f'{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}'
+
+    def get(self, city_id: int) -> Optional[CatalogCity]:
+        """Get city by id"""
+
+        with self.engine.connect() as connection:
+            row = connection.execute(self.select_cities().where(self.cities.c.id == city_id)).first()
+        return CatalogCity(*row) if row is not None else None
+
+    def resolve(self, name: str) -> Optional[CatalogCity]:
+        """
+        Find city by name, case, diacritics and punctuation do not matter. The most populated one
+        of cities with the same name is chosen unless country code follows comma, e.g. "London, CA"
+
+        :param name: name of city
+        :Return city or None if catalog has no city with the name
+        """
+
+        country = None
+        if ',' in name:
+            name, country = (part.strip().upper() for part in name.rsplit(',', 1))
+        key = normalize_name(name)
+        if not key:
+            return None
+        query = self.select_cities().where(self.cities.c.search_key == key)
+        if country:
+            query = query.where(self.cities.c.country == country)
+        with self.engine.connect() as connection:
+            row = connection.execute(query.order_by(self.cities.c.population.desc()).limit(1)).first()
+        return CatalogCity(*row) if row is not None else None
+
+    def complete(self, text: str, limit: int = 10) -> List[CatalogCity]:
+        """
+        Autocomplete typed name: cities which have a word starting with the text, the most populated first,
+        followed by @suggest-ed ones if there are fewer than @limit
+
+        :param text: typed part of name
+        :param limit: number of cities
+        """
+
+        key = normalize_name(text)
+        if not key:
+            return []
+        upper = key[:-1] + chr(ord(key[-1]) + 1)
+        query = (self.select_cities()
+                 .where(self.cities.c.id.in_(select(self.prefixes.c.city_id)
+                                             .where(and_(self.prefixes.c.key >= key, self.prefixes.c.key < upper))))
+                 .order_by(self.cities.c.population.desc()).limit(limit))
+        with self.engine.connect() as connection:
+            found = [CatalogCity(*row) for row in connection.execute(query)]
+        if len(found) < limit:
+            ids = {city.id for city in found}
+            found.extend(city for city in self.suggest(text, limit) if city.id not in ids)
+        return found[:limit]
+
+    def suggest(self, text: str, limit: int = 5) -> List[CatalogCity]:
+        """
+        Find cities with names similar to text, e.g. mistyped one. Similarity is the share of common trigrams
+
+        :param text: name of city
+        :param limit: number of cities
+        :Return cities at least @min_similarity similar, the most similar and populated first
+        """
+
+        key = normalize_name(text)
+        if not key:
+            return []
+        key_trigrams = trigrams(key)
+        shared = func.count().label('shared')
+        candidates = (select(self.trigram_index.c.city_id, shared)
+                      .where(self.trigram_index.c.trigram.in_(bindparam('trigrams', expanding=True)))
+                      .group_by(self.trigram_index.c.city_id).subquery())
+        # constants are literal, bound ones are misnumbered next to expanding parameter of subquery
+        similarity = (candidates.c.shared * literal_column('1.0')
+                      / (literal_column(str(len(key_trigrams))) + self.cities.c.trigrams - candidates.c.shared))
+        query = (self.select_cities().join(candidates, candidates.c.city_id == self.cities.c.id)
+                 .where(similarity >= self.min_similarity)
+                 .order_by(similarity.desc(), self.cities.c.population.desc()).limit(limit))
+        with self.engine.connect() as connection:
+            return [CatalogCity(*row) for row in connection.execute(query, {'trigrams': sorted(key_trigrams)})]
+
+    def label(self, city: CatalogCity) -> str:
+        """
+        Name of city to store and show, one per city: plain name for the city which @resolve finds by it,
+        the most populated of namesakes, and name with country code after comma for the others
+
+        :param city: city of catalog
+        """
+
+        resolved = self.resolve(city.name)
+        return city.name if resolved is not None and resolved.id == city.id else f'{city.name}, {city.country}'
+
+    def select_cities(self) -> Any:
+        """Select columns of @CatalogCity"""
+
+        return select(*(self.cities.c[name] for name in CatalogCity._fields))
+
+    def size(self) -> int:
+        """Number of cities in catalog"""
+
+        with self.engine.connect() as connection:
+            return connection.execute(select(func.count()).select_from(self.cities)).scalar()
+
+
+def city_json(city: CatalogCity, label: str) -> Dict[str, Any]:
+    """Json of city for API, label is name to store made by @CityCatalog.label"""
+
+    return {'id': city.id, 'name': city.name, 'country': city.country, 'label': label,
+            'population': city.population, 'coord': {'lat': city.latitude, 'lon': city.longitude}}
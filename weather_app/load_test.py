@@ -0,0 +1,152 @@
+from typing import Any, Dict, List
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import aiohttp
+
+from city_catalog import DEFAULT_CATALOG, normalize_name, read_catalog
+from stub_server import start_in_thread
+
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVERS = {
+    'wsgi': ['{python}', 'app.py', '127.0.0.1:{port}'],
+    'asgi': ['{python}', '-m', 'uvicorn', 'asgi:application', '--port', '{port}', '--log-level', 'warning'],
+}
+REFRESH_TOKEN = 'load-test'
+
+
+def city_names(catalog: str) -> List[str]:
+    """Names of cities of catalog which are distinct after normalization, the most populated first"""
+
+    names: Dict[str, str] = {}
+    for city in sorted(read_catalog(catalog), key=lambda city: -city.population):
+        names.setdefault(normalize_name(city.name), city.name)
+    return list(names.values())
+
+
+def start_server(mode: str, port: int, env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    """
+    Start app in serving mode in subprocess and wait until it answers
+
+    :param mode: key of @SERVERS
+    :param port: port to listen on
+    :param env: environment of app
+    :param log_path: file to write output of server to, pipe would block server once it is full
+    """
+
+    command = [part.format(python=sys.executable, port=port) for part in SERVERS[mode]]
+    with open(log_path, 'wb') as log:
+        process = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            with open(log_path, encoding='utf-8', errors='replace') as log:
+                raise RuntimeError(f'{mode} server exited: {log.read()}')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+async def run_load(base_url: str, names: List[str], requests: int, concurrency: int,
+                   refresh_every: int) -> Dict[str, Any]:
+    """
+    Send requests to app by @concurrency clients: adds of new cities, every @refresh_every-th one is refresh of all
+
+    :param base_url: url of app
+    :param names: names of cities to add, repeated ones are added already
+    :param requests: number of requests
+    :param concurrency: number of requests in flight
+    :param refresh_every: period of refresh requests, 0 disables them
+    :Return throughput, latency percentiles and counts of answers by route and status
+    """
+
+    queue: 'asyncio.Queue[int]' = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+    timings: List[float] = []
+    counts: Dict[str, int] = {}
+
+    async def client(http: aiohttp.ClientSession) -> None:
+        while not queue.empty():
+            i = queue.get_nowait()
+            if refresh_every and i % refresh_every == refresh_every - 1:
+                route, url, data = 'refresh', '/api/refresh', None
+                headers = {'Authorization': f'Bearer {REFRESH_TOKEN}'}
+            else:
+                route, url, data = 'add', '/add', {'city_name': names[i % len(names)]}
+                headers = {}
+            start = time.perf_counter()
+            try:
+                async with http.post(base_url + url, data=data, headers=headers, allow_redirects=False) as response:
+                    await response.read()
+                outcome = f'{route} {response.status}'
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                outcome = type(error).__name__
+            timings.append(time.perf_counter() - start)
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=120)) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    timings.sort()
+    return {'requests': requests, 'concurrency': concurrency, 'seconds': elapsed,
+            'requests_per_second': requests / elapsed, 'median_ms': statistics.median(timings) * 1000,
+            'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+            'max_ms': timings[-1] * 1000, 'answers': counts}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare throughput of WSGI and ASGI serving modes '
+                                                 'against local stub weather API')
+    parser.add_argument('--modes', nargs='+', choices=list(SERVERS), default=list(SERVERS), help='Serving modes')
+    parser.add_argument('--requests', type=int, default=500, help='Number of requests per mode')
+    parser.add_argument('--concurrency', type=int, default=50, help='Number of requests in flight')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds of stub API to answer')
+    parser.add_argument('--refresh-every', type=int, default=50, help='Every n-th request refreshes all cities')
+    parser.add_argument('--port', type=int, default=8090, help='Port of app')
+    parser.add_argument('--output', '-o', required=False, help='Path to JSON report, stdout if omitted')
+    args = parser.parse_args()
+
+    stub = start_in_thread(latency=args.latency, catalog=DEFAULT_CATALOG)
+    load_names = city_names(DEFAULT_CATALOG)
+    report = {'latency': args.latency, 'modes': {}}
+    try:
+        for serving_mode in args.modes:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                app_env = {**os.environ, 'WEATHER_API_URL': stub.base_url, 'WEATHER_API_KEY': 'load-test',
+                           'WEATHER_API_RATE': '0', 'WEATHER_REFRESH_INTERVAL': '0',
+                           'REFRESH_API_TOKEN': REFRESH_TOKEN, 'REFRESH_API_MIN_INTERVAL': '0',
+                           'DATABASE_URL': f'sqlite:///{os.path.join(tmp_dir, "weather.db")}'}
+                server = start_server(serving_mode, args.port, app_env, os.path.join(tmp_dir, 'server.log'))
+                try:
+                    result = asyncio.run(run_load(f'http://127.0.0.1:{args.port}', load_names, args.requests,
+                                                  args.concurrency, args.refresh_every))
+                finally:
+                    server.terminate()
+                    server.wait()
+            report['modes'][serving_mode] = result
+            print(f'{serving_mode}: {result["requests_per_second"]:.1f} requests/s, '
+                  f'median {result["median_ms"]:.0f}ms, p95 {result["p95_ms"]:.0f}ms, {result["answers"]}',
+                  file=sys.stderr)
+    finally:
+        stub.shutdown()
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,350 @@
+from bisect import bisect_left
+from contextvars import ContextVar, Token
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+
+from flask import Flask, Response, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def escape_label(value: str) -> str:
+    """Escape value of label for Prometheus text format"""
+
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """
+    Histogram of observed values: counts by upper bounds of @buckets, sum and number of values
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Add value, caller holds lock of family"""
+
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class HistogramFamily:
+    """
+    Histograms of one metric by values of its labels. Safe to use from many threads
+    """
+
+    def __init__(self, name: str, help_: str, label_names: Sequence[str], buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        :param name: name of metric
+        :param help_: description of metric
+        :param label_names: names of labels
+        :param buckets: upper bounds of buckets, sorted
+        """
+
+        self.name = name
+        self.help = help_
+        self.label_names = label_names
+        self.buckets = buckets
+        self.histograms: Dict[Tuple[str, ...], Histogram] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        """
+        Add value to histogram of labels
+
+        :param value: observed value
+        :param label_values: values of labels in order of @label_names
+        """
+
+        with self.lock:
+            histogram = self.histograms.get(label_values)
+            if histogram is None:
+                histogram = self.histograms[label_values] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def render(self) -> List[str]:
+        """Lines of metric in Prometheus text format"""
+
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for label_values, histogram in sorted(self.histograms.items()):
+                labels = ','.join(f'{name}="{escape_label(value)}"'
+                                  for name, value in zip(self.label_names, label_values))
+                prefix = labels + ',' if labels else ''
+                cumulative = 0
+                for bound, count in zip([*self.buckets, '+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                suffix = f'{{{labels}}}' if labels else ''
+                lines.append(f'{self.name}_sum{suffix} {histogram.sum}')
+                lines.append(f'{self.name}_count{suffix} {histogram.count}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Set of metrics rendered together: histograms and values read on render, e.g. counters of cache
+    """
+
+    def __init__(self):
+        self.histograms: List[HistogramFamily] = []
+        self.readings: List[Tuple[str, str, str, Callable[[], float]]] = []
+
+    def histogram(self, name: str, help_: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> HistogramFamily:
+        """Register new histogram, look @HistogramFamily"""
+
+        family = HistogramFamily(name, help_, label_names, buckets)
+        self.histograms.append(family)
+        return family
+
+    def reading(self, name: str, help_: str, read: Callable[[], float], kind: str = 'gauge') -> None:
+        """
+        Register value read on every render
+
+        :param name: name of metric
+        :param help_: description of metric
+        :param read: function to get current value
+        :param kind: counter or gauge
+        """
+
+        self.readings.append((name, help_, kind, read))
+
+    def render(self) -> str:
+        """All metrics in Prometheus text format"""
+
+        lines = []
+        for family in self.histograms:
+            lines.extend(family.render())
+        for name, help_, kind, read in self.readings:
+            lines.extend((f'# HELP {name} {help_}', f'# TYPE {name} {kind}', f'{name} {read()}'))
+        return '\n'.join(lines) + '\n'
+
+
+class RequestRecord:
+    """
+    Measurements of one HTTP request: time of start, number of database queries and profiler or None
+    """
+
+    def __init__(self, profiler: Optional[cProfile.Profile]):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.profiler = profiler
+        self.token: Optional[Token] = None
+
+
+class Instrumentation:
+    """
+    Metrics of app: latency of requests by route, number and latency of database queries
+    via SQLAlchemy events, latency and outcome of calls of weather API. Served at /metrics.
+    Requests slower than @slow_threshold seconds are logged with their cProfile,
+    every request is profiled while the threshold is set, one request per thread at a time.
+    Flask requests are measured by hooks, other ones, e.g. native ASGI handlers, call @start and @finish.
+    Queries are counted for request of current context, so work of request in other threads is counted
+    if it runs in a copy of the context
+    """
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None, slow_threshold: float = 0.0,
+                 profile_dir: Optional[str] = None, profile_lines: int = 25):
+        """
+        :param registry: registry to add metrics to, new one if omitted
+        :param slow_threshold: seconds of request to log it as slow, 0 disables profiling
+        :param profile_dir: directory to dump .prof files of slow requests to, only logged if omitted
+        :param profile_lines: number of functions in logged profile
+        """
+
+        self.registry = registry or MetricsRegistry()
+        self.slow_threshold = slow_threshold
+        self.profile_dir = profile_dir
+        self.profile_lines = profile_lines
+        self.request_latency = self.registry.histogram(
+            'weather_http_request_duration_seconds', 'Latency of HTTP requests', ('route', 'method', 'status'))
+        self.request_queries = self.registry.histogram(
+            'weather_http_request_db_queries', 'Number of database queries per HTTP request', ('route',),
+            COUNT_BUCKETS)
+        self.query_latency = self.registry.histogram(
+            'weather_db_query_duration_seconds', 'Latency of database queries', ('statement',))
+        self.upstream_latency = self.registry.histogram(
+            'weather_upstream_request_duration_seconds', 'Latency of calls of weather API by HTTP status or error',
+            ('outcome',))
+        self.current: ContextVar[Optional[RequestRecord]] = ContextVar('metrics_request', default=None)
+        self.profiled_threads: Set[int] = set()
+        self.lock = threading.Lock()
+
+    def init_app(self, app: Flask, engine: Engine) -> None:
+        """
+        Register request hooks, SQLAlchemy events and /metrics route
+
+        :param app: flask app
+        :param engine: engine of app database
+        """
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_response)
+        app.teardown_request(self.teardown_request)
+        event.listen(engine, 'before_cursor_execute', self.before_query)
+        event.listen(engine, 'after_cursor_execute', self.after_query)
+        event.listen(engine, 'handle_error', self.query_failed)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def metrics_view(self) -> Response:
+        """Render metrics for Prometheus"""
+
+        return Response(self.registry.render(), mimetype='text/plain; version=0.0.4')
+
+    def start(self) -> RequestRecord:
+        """
+        Start measuring request: timer, counter of queries of current context and profiler if slow requests are logged
+
+        :Return record to pass to @finish in the same context
+        """
+
+        record = RequestRecord(self.start_profiler())
+        record.token = self.current.set(record)
+        return record
+
+    def start_profiler(self) -> Optional[cProfile.Profile]:
+        """Enable profiler of current thread unless it is profiled by other request already"""
+
+        if self.slow_threshold <= 0:
+            return None
+        thread_id = threading.get_ident()
+        with self.lock:
+            if thread_id in self.profiled_threads:
+                return None
+            self.profiled_threads.add(thread_id)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # other profiler is active, e.g. in concurrent request on Python 3.12+
+            with self.lock:
+                self.profiled_threads.discard(thread_id)
+            return None
+        return profiler
+
+    def finish(self, record: RequestRecord, route: str, method: str, status: int, path: str, endpoint: str) -> None:
+        """
+        Record metrics of request, log and dump its profile if it is slow
+
+        :param record: record made by @start
+        :param route: rule of route, label of metrics
+        :param method: HTTP method
+        :param status: HTTP status of response
+        :param path: path of request with query string, for log
+        :param endpoint: name of handler, for name of profile file
+        """
+
+        elapsed = time.perf_counter() - record.start
+        if record.profiler is not None:
+            record.profiler.disable()
+            with self.lock:
+                self.profiled_threads.discard(threading.get_ident())
+        try:
+            self.current.reset(record.token)
+        except ValueError:  # finished in other context than started
+            self.current.set(None)
+        self.request_latency.observe(elapsed, route, method, str(status))
+        self.request_queries.observe(record.queries, route)
+        if record.profiler is not None and elapsed >= self.slow_threshold:
+            self.log_slow_request(record.profiler, elapsed, method, path, endpoint)
+
+    def start_request(self) -> None:
+        """Start measuring flask request, look @start"""
+
+        g.metrics_record = self.start()
+
+    def finish_response(self, response: Response) -> Response:
+        """Record request which returned response"""
+
+        self.finish_request(response.status_code)
+        return response
+
+    def teardown_request(self, error: Optional[BaseException]) -> None:
+        """Record request which raised unhandled error"""
+
+        if error is not None:
+            self.finish_request(500)
+
+    def finish_request(self, status: int) -> None:
+        """
+        Record metrics of flask request once, look @finish
+
+        :param status: HTTP status of response
+        """
+
+        record = g.pop('metrics_record', None)
+        if record is None:
+            return
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        self.finish(record, route, request.method, status, request.full_path.rstrip('?'), str(request.endpoint))
+
+    def log_slow_request(self, profiler: cProfile.Profile, elapsed: float, method: str, path: str,
+                         endpoint: str) -> None:
+        """
+        Log top functions of profile of slow request by cumulative time
+
+        :param profiler: disabled profiler of request
+        :param elapsed: seconds of request
+        :param method: HTTP method
+        :param path: path of request with query string
+        :param endpoint: name of handler
+        """
+
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(self.profile_lines)
+        location = ''
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path_ = os.path.join(self.profile_dir, f'{endpoint}-{time.time_ns()}.prof')
+            profiler.dump_stats(path_)
+            location = f', profile is saved to {path_}'
+        logger.warning('Slow request %s %s took %.3fs%s\n%s', method, path, elapsed, location, stream.getvalue())
+
+    def before_query(self, connection: Any, cursor: Any, statement: str, parameters: Any, context: Any,
+                     executemany: bool) -> None:
+        """Start timer of query, timers are stacked per connection"""
+
+        connection.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def after_query(self, connection: Any, cursor: Any, statement: str, parameters: Any, context: Any,
+                    executemany: bool) -> None:
+        """Record query and count it for request of current context"""
+
+        elapsed = time.perf_counter() - connection.info['metrics_query_start'].pop()
+        self.query_latency.observe(elapsed, statement.lstrip().split(None, 1)[0].upper() if statement.strip() else '')
+        record = self.current.get()
+        if record is not None:
+            record.queries += 1
+
+    def query_failed(self, context: Any) -> None:
+        """Drop timer of failed query"""
+
+        if context.connection is not None and context.connection.info.get('metrics_query_start'):
+            context.connection.info['metrics_query_start'].pop()
+
+    def observe_upstream(self, elapsed: float, outcome: str) -> None:
+        """
+        Record call of weather API, look @WeatherClient
+
+        :param elapsed: seconds of call
+        :param outcome: HTTP status or name of error
+        """
+
+        self.upstream_latency.observe(elapsed, outcome)
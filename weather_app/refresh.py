@@ -0,0 +1,279 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitTimeout(Exception):
+    """Free slot of @RateLimiter comes later than caller can wait"""
+
+
+class RateLimiter:
+    """
+    Space calls evenly, so at most @rate calls start per second. Shared by threads:
+    every caller reserves the next free slot and sleeps until it comes
+    """
+
+    def __init__(self, rate: float, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        """
+        :param rate: calls per second, no limit if not positive
+        :param clock: monotonic source of time in seconds
+        :param sleep: function to wait given seconds
+        """
+
+        self.rate = rate
+        self.clock = clock
+        self.sleep = sleep
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self, timeout: Optional[float] = None) -> float:
+        """
+        Reserve the next free slot without waiting, e.g. to wait for it by asyncio.sleep
+
+        :param timeout: seconds caller can wait, slot is not reserved if it comes later. No limit if None
+        :Return seconds until the slot comes
+        """
+
+        if self.rate <= 0:
+            return 0.0
+        with self.lock:
+            now = self.clock()
+            slot = max(now, self.next_slot)
+            if timeout is not None and slot - now > timeout:
+                raise RateLimitTimeout(f'No free slot of rate limit of {self.rate:g} calls per second '
+                                       f'within {max(timeout, 0):.1f}s, repeat later')
+            self.next_slot = slot + 1 / self.rate
+        return slot - now
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """
+        Block until caller may make its call
+
+        :param timeout: seconds caller can wait, look @reserve
+        """
+
+        delay = self.reserve(timeout)
+        if delay > 0:
+            self.sleep(delay)
+
+    def deadline(self, timeout: Optional[float]) -> Callable[[], Optional[float]]:
+        """
+        Function to get the rest of @timeout counted from now, to pass it to @reserve or @wait
+        before every call of a batch which has to finish in time
+
+        :param timeout: seconds for the whole batch, no limit if None
+        """
+
+        if timeout is None:
+            return lambda: None
+        end = self.clock() + timeout
+        return lambda: end - self.clock()
+
+
+def fetch_concurrently(names: Iterable[str], fetch: Callable[[str], Optional[Dict[str, Any]]],
+                       workers: int) -> Dict[str, Union[Dict[str, Any], None, Exception]]:
+    """
+    Fetch weather of many cities by pool of threads. Rate of calls of API is limited by @fetch,
+    so answers of cache do not wait, look @WeatherClient.fetch
+
+    :param names: names of cities
+    :param fetch: function to get json of current weather by name, None if city is not found
+    :param workers: number of concurrent requests
+    :Return result_by_name: json of weather, None if city is not found or exception raised by @fetch
+    """
+
+    results: Dict[str, Union[Dict[str, Any], None, Exception]] = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='weather-fetch') as executor:
+        futures = {executor.submit(fetch, name): name for name in names}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as error:
+                results[futures[future]] = error
+    return results
+
+
+class RefreshGuard:
+    """
+    Admit manual refreshes one at a time and at most once per @min_interval seconds,
+    so requests of refresh API can not keep upstream API and database busy
+    """
+
+    def __init__(self, min_interval: float, clock: Callable[[], float] = time.monotonic):
+        """
+        :param min_interval: seconds between starts of refreshes
+        :param clock: monotonic source of time in seconds
+        """
+
+        self.min_interval = min_interval
+        self.clock = clock
+        self.running = False
+        self.last_start: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Start refresh if it is admitted, then @release has to follow it
+
+        :Return 0 if refresh is started, else seconds to wait before the next try
+        """
+
+        with self.lock:
+            now = self.clock()
+            wait = 0.0
+            if self.last_start is not None:
+                wait = self.last_start + self.min_interval - now
+            if self.running:
+                wait = max(wait, 1.0)
+            if wait > 0:
+                return wait
+            self.running = True
+            self.last_start = now
+        return 0.0
+
+    def release(self) -> None:
+        """Finish refresh started by @acquire"""
+
+        with self.lock:
+            self.running = False
+
+
+class RefreshScheduler:
+    """
+    Background thread which re-fetches weather of every stored city each @interval seconds.
+    Cities are fetched by pool of @workers threads, requests are staggered by @RateLimiter
+    to respect rate limit of upstream API, and results are saved by batches of @batch_size.
+    Storage and API are given as functions, so scheduler does not depend on app
+    """
+
+    def __init__(self, load: Callable[[], List[Tuple[int, str]]], fetch: Callable[[str], Optional[Dict[str, Any]]],
+                 save: Callable[[List[Tuple[int, Dict[str, Any]]]], None], interval: float = 600.0,
+                 workers: int = 4, rate: float = 1.0, batch_size: int = 50):
+        """
+        :param load: function to get list of (id, name) of stored cities
+        :param fetch: function to get json of current weather by name, None if city is not found
+        :param save: function to write list of (id, json of weather) in one transaction
+        :param interval: seconds between starts of refreshes
+        :param workers: number of concurrent requests
+        :param rate: requests per second
+        :param batch_size: number of cities written at once
+        """
+
+        self.load = load
+        self.fetch = fetch
+        self.save = save
+        self.interval = interval
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.batch_size = batch_size
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.last_report: Optional[Dict[str, Any]] = None
+
+    def fetch_staggered(self, city_name: str) -> Optional[Dict[str, Any]]:
+        """
+        Fetch weather of city in its rate-limited slot
+
+        :param city_name: name of city
+        """
+
+        self.limiter.wait()
+        return self.fetch(city_name)
+
+    def run_once(self) -> Dict[str, Any]:
+        """
+        Refresh all stored cities now. Cities not found or failed keep their stored weather
+
+        :Return report with numbers of cities, refreshed, not found and failed ones and time spent
+        """
+
+        start = time.perf_counter()
+        cities = self.load()
+        report = {'cities': len(cities), 'refreshed': 0, 'not_found': 0, 'failed': 0}
+        batch: List[Tuple[int, Dict[str, Any]]] = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='weather-refresh') as executor:
+            futures = {executor.submit(self.fetch_staggered, name): city_id for city_id, name in cities}
+            for future in as_completed(futures):
+                if self.stopped.is_set():
+                    executor.shutdown(cancel_futures=True)
+                    break
+                try:
+                    payload = future.result()
+                except Exception as error:
+                    logger.warning('Refresh of city %s failed: %s', futures[future], error)
+                    report['failed'] += 1
+                    continue
+                if payload is None:
+                    report['not_found'] += 1
+                    continue
+                batch.append((futures[future], payload))
+                if len(batch) >= self.batch_size:
+                    self.save(batch)
+                    report['refreshed'] += len(batch)
+                    batch = []
+        if batch:
+            self.save(batch)
+            report['refreshed'] += len(batch)
+        report['seconds'] = time.perf_counter() - start
+        self.last_report = report
+        return report
+
+    def run_logged(self) -> None:
+        """Refresh all stored cities once and log report or error instead of raising it"""
+
+        try:
+            report = self.run_once()
+        except Exception:
+            logger.exception('Refresh of cities failed')
+        else:
+            logger.info('Refreshed weather of cities: %s', report)
+
+    def run(self) -> None:
+        """Loop of background thread: refresh every @interval seconds until @stop"""
+
+        while not self.stopped.wait(self.interval):
+            self.run_logged()
+
+    def run_in_background(self, finish: Callable[[], None]) -> threading.Thread:
+        """
+        Refresh all stored cities once in a new thread, e.g. for a request which should not wait for it
+
+        :param finish: function called in the thread after refresh, also if it failed
+        :Return started thread
+        """
+
+        def run() -> None:
+            try:
+                self.run_logged()
+            finally:
+                finish()
+
+        thread = threading.Thread(target=run, name='weather-refresh-once', daemon=True)
+        thread.start()
+        return thread
+
+    def start(self) -> None:
+        """Start background thread, the first refresh happens after @interval seconds"""
+
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name='weather-refresh-scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Ask background thread to stop and wait for it
+
+        :param timeout: seconds to wait
+        """
+
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
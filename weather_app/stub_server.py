@@ -0,0 +1,178 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+
+from city_catalog import DEFAULT_CATALOG, read_catalog
+
+
+WEATHER_PATH = '/data/2.5/weather'
+STATES = ('Clear', 'Clouds', 'Rain', 'Drizzle', 'Thunderstorm', 'Snow', 'Mist')
+# name is a city if it consists of words of letters, joined by space, hyphen, apostrophe or dot
+CITY_NAME_RE = re.compile(r"[^\W\d_]+(?:[ '.-]+[^\W\d_]+)*")
+
+
+def city_weather(name: str, now: Optional[int] = None, city_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Make up current weather of city in format of OpenWeatherMap. It depends on name only,
+    so answers are reproducible
+
+    :param name: name of city
+    :param now: unix time of measurement
+    :param city_id: id of city, made up from name if omitted
+    :Return json body of answer
+    """
+
+    now = int(time.time()) if now is None else now
+    seed = zlib.crc32(' '.join(name.split()).casefold().encode('utf-8'))
+    day_start = now - now % 86400
+    sunrise = day_start + 3600 * 4 + seed % 7200
+    return {'coord': {'lon': seed % 360 - 180.0, 'lat': seed % 180 - 90.0},
+            'weather': [{'id': 800, 'main': STATES[seed % len(STATES)], 'description': 'stub', 'icon': '01d'}],
+            'main': {'temp': seed % 60 - 20 + (seed >> 8) % 100 / 100, 'humidity': seed % 100},
+            'dt': now, 'sys': {'sunrise': sunrise, 'sunset': sunrise + 3600 * 12},
+            'id': seed % 10_000_000 if city_id is None else city_id,
+            'name': ' '.join(word.capitalize() for word in name.split()), 'cod': 200}
+
+
+class StubWeatherServer(ThreadingHTTPServer):
+    """
+    Local stand-in of OpenWeatherMap current weather API for tests and load tests.
+    Any name of letters, optionally with country code after comma, is a city, other names are answered
+    with 404. Cities are queried by id
+    if @catalog is given, ids missing in it are answered with 404.
+    Answers can be delayed by @latency and replaced by 503 errors with @error_rate
+
+    Contains: counts - number of answers by HTTP status, served at /stats
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024  # default backlog of 5 drops connections of concurrent clients in load tests
+
+    def __init__(self, address: Tuple[str, int], latency: float = 0.0, error_rate: float = 0.0, seed: int = 0,
+                 verbose: bool = False, catalog: Optional[str] = None):
+        """
+        :param address: host and port, port 0 picks a free one
+        :param latency: seconds to wait before every answer
+        :param error_rate: probability of answering 503
+        :param seed: seed of random errors
+        :param verbose: log every request to stderr
+        :param catalog: path to catalog of cities to answer queries by id, look @read_catalog
+        """
+
+        super().__init__(address, StubWeatherHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.counts: Dict[int, int] = {}
+        self.names_by_id = {city.id: city.name for city in read_catalog(catalog)} if catalog else {}
+
+    @property
+    def base_url(self) -> str:
+        """Url of weather endpoint to configure app with"""
+
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}{WEATHER_PATH}'
+
+    def answer(self, params: Dict[str, str]) -> Tuple[int, Dict[str, Any]]:
+        """
+        Answer query of weather endpoint
+
+        :param params: query parameters
+        :Return HTTP status and json body
+        """
+
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            failed = self.error_rate and self.rng.random() < self.error_rate
+        if failed:
+            return 503, {'cod': 503, 'message': 'service unavailable'}
+        if not params.get('appid'):
+            return 401, {'cod': 401, 'message': 'Invalid API key'}
+        if 'id' in params:
+            city_id = int(params['id']) if params['id'].isdigit() else None
+            if city_id not in self.names_by_id:
+                return 404, {'cod': '404', 'message': 'city not found'}
+            return 200, city_weather(self.names_by_id[city_id], city_id=city_id)
+        name = params.get('q', '').split(',')[0].strip()
+        if not CITY_NAME_RE.fullmatch(name):
+            return 404, {'cod': '404', 'message': 'city not found'}
+        return 200, city_weather(name)
+
+    def count(self, status: int) -> None:
+        """Count answer with HTTP status"""
+
+        with self.lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+
+class StubWeatherHandler(BaseHTTPRequestHandler):
+    """Route requests of @StubWeatherServer"""
+
+    server: StubWeatherServer
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        if url.path == WEATHER_PATH:
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            status, body = self.server.answer(params)
+            self.server.count(status)
+        elif url.path == '/stats':
+            with self.server.lock:
+                status, body = 200, {str(key): value for key, value in self.server.counts.items()}
+        else:
+            status, body = 404, {'cod': '404', 'message': 'Internal error'}
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format_: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format_, *args)
+
+
+def start_in_thread(host: str = '127.0.0.1', port: int = 0, **kwargs: Any) -> StubWeatherServer:
+    """
+    Start stub server in daemon thread, e.g. inside test or load test. Stop it by shutdown()
+
+    :param host: host to listen on
+    :param port: port to listen on, 0 picks a free one
+    :param kwargs: options of @StubWeatherServer
+    :Return running server
+    """
+
+    server = StubWeatherServer((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve fake OpenWeatherMap API for local testing')
+    parser.add_argument('--host', default='127.0.0.1', help='Host to listen on')
+    parser.add_argument('--port', type=int, default=8081, help='Port to listen on')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before every answer')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probability of answering 503')
+    parser.add_argument('--catalog', default=DEFAULT_CATALOG,
+                        help='Catalog of cities to answer queries by id, bundled one by default')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Log every request')
+    args = parser.parse_args()
+    stub = StubWeatherServer((args.host, args.port), args.latency, args.error_rate, verbose=args.verbose,
+                             catalog=args.catalog)
+    print(f'Serving stub weather API, set WEATHER_API_URL={stub.base_url}')
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        stub.server_close()
@@ -0,0 +1,171 @@
+from typing import Iterator
+
+import pytest
+from sqlalchemy import create_engine
+
+from stub_server import StubWeatherServer, start_in_thread
+from weather_cache import SQLiteCacheStore, WeatherAPIError, WeatherCache, WeatherClient
+
+
+class FakeClock:
+    """Clock of @WeatherCache moved by tests"""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def stub() -> Iterator[StubWeatherServer]:
+    server = start_in_thread()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+def upstream_calls(server: StubWeatherServer) -> int:
+    """Number of requests answered by stub server"""
+
+    with server.lock:
+        return sum(server.counts.values())
+
+
+def make_client(server: StubWeatherServer, cache: WeatherCache) -> WeatherClient:
+    return WeatherClient(server.base_url, 'test-key', cache)
+
+
+def test_answer_is_cached_until_ttl_expires(stub, clock):
+    client = make_client(stub, WeatherCache(ttl=60, clock=clock))
+
+    assert client.fetch_by_name('London')['name'] == 'London'
+    assert client.fetch_by_name('London')['name'] == 'London'
+    assert upstream_calls(stub) == 1
+
+    clock.advance(59)
+    client.fetch_by_name('London')
+    assert upstream_calls(stub) == 1
+
+    clock.advance(2)
+    client.fetch_by_name('London')
+    assert upstream_calls(stub) == 2
+
+
+def test_key_ignores_case_and_extra_spaces(stub, clock):
+    cache = WeatherCache(clock=clock)
+    client = make_client(stub, cache)
+
+    client.fetch_by_name('New York')
+    client.fetch_by_name('  new   YORK ')
+    assert upstream_calls(stub) == 1
+    assert cache.hits == 1 and cache.misses == 1
+
+
+def test_fresh_fetch_calls_api_and_updates_entry(stub, clock):
+    cache = WeatherCache(ttl=60, clock=clock)
+    client = make_client(stub, cache)
+
+    client.fetch_by_name('Paris')
+    clock.advance(30)
+    client.fetch_by_name('Paris', fresh=True)
+    assert upstream_calls(stub) == 2
+
+    clock.advance(59)
+    client.fetch_by_name('Paris')
+    assert upstream_calls(stub) == 2
+
+
+def test_not_found_is_cached_with_negative_ttl(stub, clock):
+    client = make_client(stub, WeatherCache(ttl=60, negative_ttl=300, clock=clock))
+
+    assert client.fetch_by_name('N0where') is None
+    assert client.fetch_by_name('N0where') is None
+    assert stub.counts == {404: 1}
+
+    clock.advance(299)
+    assert client.fetch_by_name('N0where') is None
+    assert upstream_calls(stub) == 1
+
+    clock.advance(2)
+    assert client.fetch_by_name('N0where') is None
+    assert stub.counts == {404: 2}
+
+
+def test_least_recently_used_entry_is_evicted(stub, clock):
+    cache = WeatherCache(max_size=2, clock=clock)
+    client = make_client(stub, cache)
+
+    client.fetch_by_name('Oslo')
+    client.fetch_by_name('Rome')
+    client.fetch_by_name('Oslo')
+    client.fetch_by_name('Lima')
+    assert list(cache.entries) == [WeatherCache.key('q', 'Oslo'), WeatherCache.key('q', 'Lima')]
+    assert upstream_calls(stub) == 3
+
+    client.fetch_by_name('Oslo')
+    assert upstream_calls(stub) == 3
+    client.fetch_by_name('Rome')
+    assert upstream_calls(stub) == 4
+
+
+def test_server_errors_are_not_cached(clock):
+    server = start_in_thread(error_rate=1.0)
+    try:
+        cache = WeatherCache(clock=clock)
+        client = WeatherClient(server.base_url, 'test-key', cache, retries=2, backoff=0)
+        with pytest.raises(WeatherAPIError) as error:
+            client.fetch_by_name('Berlin')
+        assert error.value.retryable
+        assert server.counts == {503: 3}
+        assert not cache.entries
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_store_keeps_entries_for_new_cache(stub, clock, tmp_path):
+    store = SQLiteCacheStore(create_engine(f'sqlite:///{tmp_path / "cache.db"}'))
+    make_client(stub, WeatherCache(ttl=60, store=store, clock=clock)).fetch_by_name('Tokyo')
+
+    restarted = WeatherCache(ttl=60, store=store, clock=clock)
+    assert make_client(stub, restarted).fetch_by_name('Tokyo')['name'] == 'Tokyo'
+    assert upstream_calls(stub) == 1
+    assert restarted.hits == 1
+
+    clock.advance(61)
+    assert store.purge(clock()) == 1
+    assert WeatherCache(store=store, clock=clock).get(WeatherCache.key('q', 'Tokyo')) is None
+
+
+def test_store_is_purged_every_few_writes(stub, clock, tmp_path):
+    store = SQLiteCacheStore(create_engine(f'sqlite:///{tmp_path / "cache.db"}'))
+    client = make_client(stub, WeatherCache(ttl=60, negative_ttl=60, store=store, clock=clock, purge_every=3))
+
+    client.fetch_by_name('N0where')
+    client.fetch_by_name('N0wh3re')
+    clock.advance(61)
+    client.fetch_by_name('Quito')
+    with store.engine.connect() as connection:
+        assert [row.key for row in connection.execute(store.table.select())] == [WeatherCache.key('q', 'Quito')]
+
+
+def test_next_query_is_tried_if_city_is_not_found(stub, clock):
+    cache = WeatherCache(clock=clock)
+    client = make_client(stub, cache)
+
+    assert client.fetch_first([('id', 2643743), ('q', 'London,GB')])['name'] == 'London'
+    assert stub.counts == {404: 1, 200: 1}
+
+    assert client.fetch_first([('id', 2643743), ('q', 'London,GB')])['name'] == 'London'
+    assert upstream_calls(stub) == 2
+    assert client.fetch_first([]) is None
+    assert upstream_calls(stub) == 2
@@ -0,0 +1,341 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text
+from sqlalchemy.engine import Engine
+
+
+class CacheEntry(NamedTuple):
+    """Answer of weather API: HTTP status, json body and unix time when it expires"""
+
+    status: int
+    payload: Dict[str, Any]
+    expires_at: float
+
+
+class SQLiteCacheStore:
+    """
+    Persistent backing of @WeatherCache in table weather_cache of the app database,
+    so cached answers survive restarts and are shared by processes
+    """
+
+    metadata = MetaData()
+    table = Table('weather_cache', metadata,
+                  Column('key', String(100), primary_key=True),
+                  Column('status', Integer, nullable=False),
+                  Column('payload', Text, nullable=False),
+                  Column('expires_at', Float, nullable=False))
+
+    def __init__(self, engine: Engine):
+        """
+        :param engine: engine of the app database, table is created if it is missing
+        """
+
+        self.engine = engine
+        self.metadata.create_all(engine)
+
+    def load(self, key: str) -> Optional[CacheEntry]:
+        """
+        Get stored entry, expired or not
+
+        :param key: key of entry, look @WeatherCache.key
+        """
+
+        with self.engine.connect() as connection:
+            row = connection.execute(self.table.select().where(self.table.c.key == key)).first()
+        if row is None:
+            return None
+        return CacheEntry(row.status, json.loads(row.payload), row.expires_at)
+
+    def save(self, key: str, entry: CacheEntry) -> None:
+        """
+        Insert or replace entry
+
+        :param key: key of entry
+        :param entry: entry to store
+        """
+
+        with self.engine.begin() as connection:
+            connection.execute(self.table.insert().prefix_with('OR REPLACE'),
+                               {'key': key, 'status': entry.status, 'payload': json.dumps(entry.payload),
+                                'expires_at': entry.expires_at})
+
+    def purge(self, now: float) -> int:
+        """
+        Delete expired entries
+
+        :param now: current unix time
+        :Return number of deleted entries
+        """
+
+        with self.engine.begin() as connection:
+            return connection.execute(self.table.delete().where(self.table.c.expires_at <= now)).rowcount
+
+
+class WeatherCache:
+    """
+    Bounded in-memory cache of weather API answers with time to live and LRU eviction.
+    Successful answers live @ttl seconds, "city not found" answers live @negative_ttl seconds.
+    Misses of memory are looked up in optional persistent @store, whose expired entries are deleted
+    every @purge_every writes. Safe to use from many threads
+
+    Contains: entries - entry_by_key ordered from least to most recently used
+              hits, misses - counters of lookups
+              writes - counter of entries saved to @store
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 600.0, negative_ttl: float = 3600.0,
+                 store: Optional[SQLiteCacheStore] = None, clock: Callable[[], float] = time.time,
+                 purge_every: int = 1000):
+        """
+        :param max_size: number of entries kept in memory
+        :param ttl: seconds to keep weather of city
+        :param negative_ttl: seconds to remember that city does not exist
+        :param store: persistent backing or None
+        :param clock: source of current unix time
+        :param purge_every: number of writes to @store between purges of its expired entries
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.store = store
+        self.clock = clock
+        self.purge_every = purge_every
+        self.entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    @staticmethod
+    def key(kind: str, value: Union[int, str]) -> str:
+        """
+        Normalize query to key of cache: case and extra spaces of city names do not matter
+
+        :param kind: name of query parameter, e.g. q
+        :param value: value of query parameter
+        """
+
+        return f'{kind}:{" ".join(str(value).split()).casefold()}'
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """
+        Get entry which is not expired yet
+
+        :param key: key of entry
+        :Return entry or None if it is missing or expired
+        """
+
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        if self.store is not None:
+            entry = self.store.load(key)
+            if entry is not None and entry.expires_at > now:
+                with self.lock:
+                    self.remember(key, entry)
+                    self.hits += 1
+                return entry
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, status: int, payload: Dict[str, Any]) -> CacheEntry:
+        """
+        Cache answer of weather API
+
+        :param key: key of entry
+        :param status: HTTP status, anything but 200 is cached as negative answer
+        :param payload: json body of answer
+        :Return cached entry
+        """
+
+        entry = CacheEntry(status, payload, self.clock() + (self.ttl if status == 200 else self.negative_ttl))
+        with self.lock:
+            self.remember(key, entry)
+        if self.store is not None:
+            self.store.save(key, entry)
+            with self.lock:
+                self.writes += 1
+                purge = self.writes % self.purge_every == 0
+            if purge:
+                self.store.purge(self.clock())
+        return entry
+
+    def remember(self, key: str, entry: CacheEntry) -> None:
+        """Put entry into memory and evict the least recently used ones over @max_size, lock must be held"""
+
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Forget entries kept in memory"""
+
+        with self.lock:
+            self.entries.clear()
+
+
+class WeatherAPIError(Exception):
+    """
+    Weather API is unreachable, timed out or answered with unexpected status.
+    Error is retryable if the same request may succeed later: network errors, 429 and 5xx statuses
+    """
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class WeatherClient:
+    """
+    Client of OpenWeatherMap current weather API over keep-alive session, with timeouts and @WeatherCache in front
+    """
+
+    def __init__(self, base_url: str, api_key: Optional[str], cache: Optional[WeatherCache] = None,
+                 timeout: Tuple[float, float] = (3.05, 10.0), session: Optional[requests.Session] = None,
+                 pool_size: int = 10, retries: int = 0, backoff: float = 0.5,
+                 observer: Optional[Callable[[float, str], None]] = None):
+        """
+        :param base_url: url of endpoint of current weather, e.g. of local stub server
+        :param api_key: appid of API
+        :param cache: cache of answers or None to always call API
+        :param timeout: seconds to connect and to read answer
+        :param session: HTTP session to reuse connections of
+        :param pool_size: number of keep-alive connections of new session, set it to number of threads using client
+        :param retries: number of repeats of request after retryable error
+        :param backoff: seconds to wait before the first repeat, doubled for each next one
+        :param observer: function called after every call of API with its seconds and HTTP status or name of error
+        """
+
+        self.base_url = base_url
+        self.api_key = api_key
+        self.cache = cache
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.observer = observer
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+    def request(self, params: Dict[str, Any], throttle: Optional[Callable[[], None]] = None
+                ) -> Tuple[int, Dict[str, Any]]:
+        """
+        Call API bypassing cache, repeat it up to @retries times with exponential backoff after retryable errors
+
+        :param params: query parameters besides appid and units
+        :param throttle: function called before every attempt, e.g. to wait for slot of rate limiter
+        :Return HTTP status, 200 or 404, and json body
+        """
+
+        attempt = 0
+        while True:
+            if throttle is not None:
+                throttle()
+            try:
+                return self.request_once(params)
+            except WeatherAPIError as error:
+                if not error.retryable or attempt >= self.retries:
+                    raise
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def request_once(self, params: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """
+        Call API once, look @request
+        """
+
+        start = time.perf_counter()
+        try:
+            response = self.session.get(self.base_url, params={**params, 'appid': self.api_key, 'units': 'metric'},
+                                        timeout=self.timeout)
+        except requests.RequestException as error:
+            if self.observer is not None:
+                self.observer(time.perf_counter() - start, type(error).__name__)
+            # message of error contains url with api key, keep its type only
+            raise WeatherAPIError(f'Weather API is unreachable: {type(error).__name__}', retryable=True) from error
+        if self.observer is not None:
+            self.observer(time.perf_counter() - start, str(response.status_code))
+        return self.read_answer(response.status_code, response.json)
+
+    @staticmethod
+    def read_answer(status: int, read_json: Callable[[], Any]) -> Tuple[int, Dict[str, Any]]:
+        """
+        Check answer of API, shared with async client of asgi mode
+
+        :param status: HTTP status of answer
+        :param read_json: function to parse json body
+        :Return HTTP status, 200 or 404, and json body
+        """
+
+        if status not in (200, 404):
+            raise WeatherAPIError(f'Weather API answered with status {status}',
+                                  retryable=status == 429 or status >= 500)
+        try:
+            return status, read_json()
+        except ValueError as error:
+            raise WeatherAPIError('Weather API answered with malformed json') from error
+
+    def fetch(self, kind: str, value: Union[int, str], fresh: bool = False,
+              throttle: Optional[Callable[[], None]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get current weather from cache or API
+
+        :param kind: name of query parameter, e.g. q
+        :param value: value of query parameter
+        :param fresh: skip lookup in cache and call API, the answer is cached still
+        :param throttle: function called before calls of API only, look @request. Answers of cache do not wait
+        :Return json of weather or None if city is not found
+        """
+
+        key = WeatherCache.key(kind, value)
+        entry = self.cache.get(key) if self.cache is not None and not fresh else None
+        if entry is None:
+            status, payload = self.request({kind: value}, throttle)
+            entry = self.cache.put(key, status, payload) if self.cache is not None else CacheEntry(status, payload, 0)
+        return entry.payload if entry.status == 200 else None
+
+    def fetch_first(self, queries: List[Tuple[str, Union[int, str]]], fresh: bool = False,
+                    throttle: Optional[Callable[[], None]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get current weather by the first query which finds city, e.g. by name if weather API does not know id of city
+
+        :param queries: names and values of query parameters to try in order, look @fetch
+        :param fresh: skip lookup in cache
+        :param throttle: function called before calls of API only
+        :Return json of weather or None if no query finds city
+        """
+
+        for kind, value in queries:
+            payload = self.fetch(kind, value, fresh, throttle)
+            if payload is not None:
+                return payload
+        return None
+
+    def fetch_by_name(self, city_name: str, fresh: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Get current weather of city by name, look @fetch
+
+        :param city_name: name of city
+        :param fresh: skip lookup in cache
+        """
+
+        return self.fetch('q', city_name, fresh)